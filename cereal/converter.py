@@ -0,0 +1,206 @@
+"""Schema-compiled conversion of capnp readers into plain dicts.
+
+capnp_to_dict walks a reader by reflection, which costs a hasattr probe and a
+recursive call per node on every message. The converters built here walk the
+schema once instead and generate one specialized Python function per struct,
+so converting a message is a flat sequence of field reads.
+
+  conv = service_converter("modelV2", fields=["frameId", "laneLines[*].y"])
+  conv(evt.modelV2)  # {"frameId": ..., "laneLines": [{"y": [...]}, ...]}
+
+`fields` projects the output onto the given paths. Paths are dot separated,
+list elements are addressed with "[*]" (or transparently, "laneLines.y" is the
+same path). Selecting a struct without going deeper keeps its whole subtree.
+Unknown field names raise a ValueError when the converter is built.
+
+The output matches to_dict(): unset pointer fields are omitted, enums become
+their names and unions only contain the active member. Data fields are
+replaced by None since raw blobs are not useful once serialized as JSON.
+"""
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from cereal import log
+
+Projection = Optional[Dict[str, Any]]
+
+POINTER_TYPES = ("text", "data", "list", "struct", "anyPointer")
+
+
+def capnp_to_dict(reader: Any) -> Any:
+  """Reflection based conversion, works on any capnp object but is slow."""
+  return _convert(reader)
+
+
+def _convert(obj: Any) -> Any:
+  """Recursively convert capnp objects to JSON-serializable types."""
+  if hasattr(obj, 'to_dict'):
+    try:
+      return obj.to_dict()
+    except Exception:
+      pass
+
+  if isinstance(obj, (bool, int, float, str, type(None))):
+    return obj
+
+  if isinstance(obj, bytes):
+    return None  # skip raw binary blobs
+
+  if isinstance(obj, (list, tuple)):
+    return [_convert(item) for item in obj]
+
+  if hasattr(obj, 'items'):
+    return {k: _convert(v) for k, v in obj.items()}
+
+  # capnp list-like objects
+  if hasattr(obj, '__len__') and hasattr(obj, '__getitem__'):
+    try:
+      return [_convert(obj[i]) for i in range(len(obj))]
+    except Exception:
+      pass
+
+  return str(obj)
+
+
+def parse_fields(fields: Optional[Iterable[str]]) -> Projection:
+  """Turn a list of field paths into a nested projection dict, None means everything."""
+  if fields is None:
+    return None
+
+  proj: Dict[str, Any] = {}
+  for path in fields:
+    node: Optional[Dict[str, Any]] = proj
+    parts = [p for p in path.replace("[*]", "").split(".") if p]
+    if not parts:
+      raise ValueError(f"empty field path: {path!r}")
+    for i, part in enumerate(parts):
+      last = i == len(parts) - 1
+      if part in node and node[part] is None:
+        break  # a shorter path already selects the whole subtree
+      if last:
+        node[part] = None
+      else:
+        node = node.setdefault(part, {})
+  return proj
+
+
+class _Compiler:
+  def __init__(self):
+    self.ns: Dict[str, Any] = {}
+    self.src = []
+    self.funcs: Dict[Any, str] = {}
+
+  def value(self, field: Any, var: str, proj: Projection) -> Optional[str]:
+    """Expression converting the already read field value `var`, None to skip the field."""
+    proto = field.proto
+    if proto.which() == "group":
+      return f"{self.struct(field.schema, proj)}({var})"
+
+    typ = proto.slot.type
+    kind = typ.which()
+    elem = typ.list.elementType.which() if kind == "list" else None
+    if proj is not None and kind != "struct" and elem != "struct":
+      raise ValueError(f"cannot select {sorted(proj)} inside non-struct field {proto.name}")
+
+    if kind == "enum":
+      return f"str({var})"
+    if kind == "data":
+      return "None"
+    if kind == "struct":
+      return f"{self.struct(field.schema, proj)}({var})"
+    if kind == "list":
+      if elem == "enum":
+        return f"[str(x) for x in {var}]"
+      if elem == "data":
+        return f"[None for x in {var}]"
+      if elem == "struct":
+        return f"[{self.struct(field.schema.elementType, proj)}(x) for x in {var}]"
+      if elem in ("list", "anyPointer", "interface"):
+        return None
+      return f"list({var})"
+    if kind in ("anyPointer", "interface"):
+      return None
+    return var
+
+  def struct(self, schema: Any, proj: Projection) -> str:
+    key = (schema.node.id, repr(proj))
+    if key in self.funcs:
+      return self.funcs[key]
+    name = f"_s{len(self.funcs)}"
+    self.funcs[key] = name
+
+    fields = schema.fields
+    if proj is not None:
+      unknown = set(proj) - set(fields)
+      if unknown:
+        raise ValueError(f"{schema.node.displayName} has no field(s) {sorted(unknown)}")
+    selected = [f for f in schema.fieldnames if proj is None or f in proj]
+    union = set(schema.union_fields)
+
+    lines = [f"def {name}(r):", "  g = r._get", "  d = {}"]
+    members = []
+    for fname in selected:
+      field = fields[fname]
+      expr = self.value(field, "v", None if proj is None else proj[fname])
+      if expr is None:
+        continue
+
+      if fname in union:
+        members.append((fname, expr))
+        continue
+
+      read = [f"  v = g({fname!r})", f"  d[{fname!r}] = {expr}"]
+      if field.proto.which() == "slot" and field.proto.slot.type.which() in POINTER_TYPES:
+        lines.append(f"  if r._has({fname!r}):")
+        lines += ["  " + line for line in read]
+      else:
+        lines += read
+
+    if members:
+      # dispatch on the active member instead of testing every union field
+      table = f"{name}_union"
+      self.src.append(f"{table} = {{}}")
+      for fname, expr in members:
+        self.src.append(f"def {table}_{fname}(v):\n  return {expr}")
+        self.src.append(f"{table}[{fname!r}] = {table}_{fname}")
+      lines += ["  w = r.which()",
+                f"  f = {table}.get(w)",
+                "  if f is not None:",
+                "    d[w] = f(g(w))"]
+
+    lines.append("  return d")
+    self.src.append("\n".join(lines))
+    return name
+
+  def compile(self, expr: str) -> Callable[[Any], Any]:
+    """Define every generated helper plus a root function returning `expr` of its argument v."""
+    self.src.append(f"def _root(v):\n  return {expr}")
+    exec("\n\n".join(self.src), self.ns)  # pylint: disable=exec-used
+    return self.ns["_root"]
+
+
+def build_converter(schema: Any, fields: Optional[Iterable[str]] = None) -> Callable[[Any], Dict[str, Any]]:
+  """Build a converter for readers of the given struct schema (e.g. log.ModelDataV2.schema)."""
+  compiler = _Compiler()
+  return compiler.compile(f"{compiler.struct(schema, parse_fields(fields))}(v)")
+
+
+@lru_cache(maxsize=None)
+def _service_converter(service: str, fields: Optional[tuple]) -> Callable[[Any], Any]:
+  event_fields = log.Event.schema.fields
+  if service not in event_fields:
+    raise ValueError(f"unknown service: {service}")
+
+  compiler = _Compiler()
+  expr = compiler.value(event_fields[service], "v", parse_fields(fields))
+  if expr is None:
+    raise ValueError(f"{service} cannot be converted")
+  return compiler.compile(expr)
+
+
+def service_converter(service: str, fields: Optional[Iterable[str]] = None) -> Callable[[Any], Any]:
+  """Converter for the payload of one log.Event service, e.g. service_converter("carState")(evt.carState).
+
+  Converters are cached per (service, fields), so calling this in a loop is cheap.
+  """
+  return _service_converter(service, None if fields is None else tuple(fields))
@@ -0,0 +1,64 @@
+"""Read which(), logMonoTime and valid straight from serialized log.Event
+buffers, without building a capnp reader. Used to filter and index messages
+before paying for a decode."""
+import struct
+from typing import Optional, Tuple
+
+from cereal import log
+
+
+def _event_layout():
+  schema = log.Event.schema
+  fields = schema.fields
+  names = {fields[n].proto.discriminantValue: n for n in schema.union_fields}
+  valid = fields['valid'].proto.slot
+  return (names, schema.node.struct.discriminantOffset * 2, fields['logMonoTime'].proto.slot.offset * 8,
+          valid.offset, valid.defaultValue.bool)
+
+EVENT_NAMES, WHICH_OFFSET, LOG_MONO_TIME_OFFSET, VALID_BIT, VALID_DEFAULT = _event_layout()
+EVENT_IDS = {name: which for which, name in EVENT_NAMES.items()}
+
+
+def message_size(dat: bytes, offset: int = 0) -> Optional[int]:
+  """Size of the unpacked capnp message starting at offset, None while dat
+  doesn't hold its whole segment table yet."""
+  if offset + 4 > len(dat):
+    return None
+  n_segments = struct.unpack_from('<I', dat, offset)[0] + 1
+  header = (4 * (n_segments + 1) + 7) & ~7
+  if offset + header > len(dat):
+    return None
+  return header + 8 * sum(struct.unpack_from(f'<{n_segments}I', dat, offset + 4))
+
+
+def event_header(dat: bytes, offset: int = 0) -> Optional[Tuple[str, int, bool]]:
+  """(which, logMonoTime, valid) of the unpacked log.Event at offset. Returns
+  None when the layout needs a full decode to resolve."""
+  try:
+    n_segments = struct.unpack_from('<I', dat, offset)[0] + 1
+    root = offset + ((4 * (n_segments + 1) + 7) & ~7)
+    ptr = struct.unpack_from('<Q', dat, root)[0]
+  except struct.error:
+    return None
+  if ptr & 3 != 0:  # far pointer
+    return None
+
+  ptr_offset = (ptr >> 2) & 0x3fffffff
+  if ptr_offset & 0x20000000:
+    ptr_offset -= 0x40000000
+  start = root + 8 + ptr_offset * 8
+  size = ((ptr >> 32) & 0xffff) * 8
+  if start < root or start + size > len(dat):
+    return None
+
+  # fields beyond the data section (older writer) hold their default
+  which = struct.unpack_from('<H', dat, start + WHICH_OFFSET)[0] if WHICH_OFFSET + 2 <= size else 0
+  log_mono_time = struct.unpack_from('<Q', dat, start + LOG_MONO_TIME_OFFSET)[0] if LOG_MONO_TIME_OFFSET + 8 <= size else 0
+  valid = VALID_DEFAULT
+  if VALID_BIT // 8 < size:
+    valid ^= bool(dat[start + VALID_BIT // 8] & (1 << (VALID_BIT % 8)))
+
+  name = EVENT_NAMES.get(which)
+  if name is None:
+    return None
+  return name, log_mono_time, valid
@@ -2,13 +2,16 @@
 from .messaging_pyx import Context, Poller, SubSocket, PubSocket  # pylint: disable=no-name-in-module, import-error
 from .messaging_pyx import MultiplePublishersError, MessagingError  # pylint: disable=no-name-in-module, import-error
 import os
+import sys
 import capnp
 
-from typing import Optional, List, Union
+from typing import Dict, Optional, List, Union
 from collections import deque
 
 from cereal import log
+from cereal.event_header import event_header as _event_header
 from cereal.services import service_list
+from cereal.messaging.trace import TRACE, TraceContext
 
 assert MultiplePublishersError
 assert MessagingError
@@ -18,6 +21,19 @@ AVG_FREQ_HISTORY = 100
 SIMULATION = "SIMULATION" in os.environ
 DEVICE_ADDR = os.environ.get("DEVICE_ADDR", None)
 
+# The remote subscriber class (external displays, bridges over TCP) gets its own
+# port per service, see PubMaster. Services are published to it when listed in
+# REMOTE_SERVICES, e.g. "modelV2:2,carState:5,deviceState" (service[:decimation]).
+REMOTE_PORT_OFFSET = 1000
+REMOTE_SERVICES = os.environ.get("REMOTE_SERVICES", "")
+REMOTE_MAX_RATE = float(os.environ.get("REMOTE_MAX_RATE", "0"))
+
+# With SHM_TRANSPORT=1 services marked shm in services.yaml are also published
+# over shared memory (msgq), and local Python subscribers read them from there
+# instead of the loopback ZMQ socket. Only meaningful on the ZMQ backend.
+SHM_TRANSPORT = os.environ.get("SHM_TRANSPORT", "0") == "1" and "MSGQ" not in os.environ and \
+                sys.platform.startswith("linux")
+
 # sec_since_boot is faster, but allow to run standalone too
 try:
   from common.realtime import sec_since_boot
@@ -31,6 +47,45 @@ context = Context()
 def log_from_bytes(dat: bytes) -> capnp.lib.capnp._DynamicStructReader:
   return log.Event.from_bytes(dat, traversal_limit_in_words=NO_TRAVERSAL_LIMIT)
 
+class LazyEvent:
+  """log.Event that keeps the received bytes and only decodes them once a field
+  other than which(), logMonoTime or valid is read. Any other attribute is
+  forwarded to the decoded reader."""
+  __slots__ = ('dat', 'logMonoTime', 'valid', '_which', '_evt')
+
+  def __init__(self, dat: bytes):
+    self.dat = dat
+    self._evt = None
+    header = _event_header(dat)
+    if header is None:
+      self._evt = log_from_bytes(dat)
+      header = self._evt.which(), self._evt.logMonoTime, self._evt.valid
+    self._which, self.logMonoTime, self.valid = header
+
+  def which(self) -> str:
+    return self._which
+
+  @property
+  def decoded(self) -> bool:
+    return self._evt is not None
+
+  @property
+  def evt(self) -> capnp.lib.capnp._DynamicStructReader:
+    if self._evt is None:
+      self._evt = log_from_bytes(self.dat)
+    return self._evt
+
+  def to_bytes(self) -> bytes:
+    return self.dat
+
+  def __getattr__(self, name: str):
+    return getattr(self.evt, name)
+
+  def __repr__(self) -> str:
+    return f"LazyEvent({self._which}, logMonoTime={self.logMonoTime})"
+
+Message = Union[capnp.lib.capnp._DynamicStructReader, LazyEvent]
+
 def new_message(service: Optional[str] = None, size: Optional[int] = None) -> capnp.lib.capnp._DynamicStructBuilder:
   dat = log.Event.new_message()
   dat.logMonoTime = int(sec_since_boot() * 1e9)
@@ -42,17 +97,58 @@ def new_message(service: Optional[str] = None, size: Optional[int] = None) -> ca
       dat.init(service, size)
   return dat
 
-def pub_sock(endpoint: str) -> PubSocket:
+def remote_endpoint(endpoint: str) -> str:
+  return str(service_list[endpoint].port + REMOTE_PORT_OFFSET)
+
+def use_shm(endpoint: str, addr: str = "127.0.0.1") -> bool:
+  """Whether local Python sockets of a service go over shared memory, remote
+  subscribers always fall back to ZMQ."""
+  return SHM_TRANSPORT and DEVICE_ADDR is None and addr == "127.0.0.1" and \
+         endpoint in service_list and service_list[endpoint].shm
+
+class ShmPubSocket:
+  """Publishes to shared memory for local Python subscribers, and to ZMQ for
+  remote, C++ and Java subscribers."""
+  def __init__(self, endpoint: str):
+    self.shm = PubSocket(shm=True)
+    self.shm.connect(context, endpoint)
+    self.zmq = PubSocket()
+    self.zmq.connect(context, endpoint)
+
+  def send(self, dat: bytes) -> None:
+    self.shm.send(dat)
+    self.zmq.send(dat)
+
+  def all_readers_updated(self) -> bool:
+    return self.shm.all_readers_updated()
+
+def pub_sock(endpoint: str, remote: bool = False) -> Union[PubSocket, ShmPubSocket]:
+  if not remote and use_shm(endpoint):
+    return ShmPubSocket(endpoint)
+
   sock = PubSocket()
-  sock.connect(context, endpoint)
+  if remote:
+    # a lagging remote subscriber only ever has the latest message queued
+    sock.setConflate(True)
+    sock.connect(context, remote_endpoint(endpoint), check_endpoint=False)
+  else:
+    sock.connect(context, endpoint)
   return sock
 
 def sub_sock(endpoint: str, poller: Optional[Poller] = None, addr: str = "127.0.0.1",
-             conflate: bool = False, timeout: Optional[int] = None) -> SubSocket:
-  sock = SubSocket()
+             conflate: bool = False, timeout: Optional[int] = None, remote: bool = False,
+             shm: Optional[bool] = None) -> SubSocket:
+  """shm: None picks shared memory for local subscribers of shm services (see
+  SHM_TRANSPORT), False forces ZMQ."""
   if DEVICE_ADDR is not None:
     addr = DEVICE_ADDR
-  sock.connect(context, endpoint, addr.encode('utf8'), conflate)
+  if shm is None:
+    shm = not remote and use_shm(endpoint, addr)
+  sock = SubSocket(shm=shm)
+  if remote:
+    sock.connect(context, remote_endpoint(endpoint), addr.encode('utf8'), conflate, check_endpoint=False)
+  else:
+    sock.connect(context, endpoint, addr.encode('utf8'), conflate)
 
   if timeout is not None:
     sock.setTimeout(timeout)
@@ -78,9 +174,9 @@ def drain_sock_raw(sock: SubSocket, wait_for_one: bool = False) -> List[bytes]:
 
   return ret
 
-def drain_sock(sock: SubSocket, wait_for_one: bool = False) -> List[capnp.lib.capnp._DynamicStructReader]:
+def drain_sock(sock: SubSocket, wait_for_one: bool = False, lazy: bool = False) -> List[Message]:
   """Receive all message currently available on the queue"""
-  ret: List[capnp.lib.capnp._DynamicStructReader] = []
+  ret: List[Message] = []
   while 1:
     if wait_for_one and len(ret) == 0:
       dat = sock.receive()
@@ -90,14 +186,13 @@ def drain_sock(sock: SubSocket, wait_for_one: bool = False) -> List[capnp.lib.ca
     if dat is None:  # Timeout hit
       break
 
-    dat = log_from_bytes(dat)
-    ret.append(dat)
+    ret.append(LazyEvent(dat) if lazy else log_from_bytes(dat))
 
   return ret
 
 
 # TODO: print when we drop packets?
-def recv_sock(sock: SubSocket, wait: bool = False) -> Optional[capnp.lib.capnp._DynamicStructReader]:
+def recv_sock(sock: SubSocket, wait: bool = False, lazy: bool = False) -> Optional[Message]:
   """Same as drain sock, but only returns latest message. Consider using conflate instead."""
   dat = None
 
@@ -113,20 +208,20 @@ def recv_sock(sock: SubSocket, wait: bool = False) -> Optional[capnp.lib.capnp._
     dat = rcv
 
   if dat is not None:
-    dat = log_from_bytes(dat)
+    dat = LazyEvent(dat) if lazy else log_from_bytes(dat)
 
   return dat
 
-def recv_one(sock: SubSocket) -> Optional[capnp.lib.capnp._DynamicStructReader]:
+def recv_one(sock: SubSocket, lazy: bool = False) -> Optional[Message]:
   dat = sock.receive()
   if dat is not None:
-    dat = log_from_bytes(dat)
+    dat = LazyEvent(dat) if lazy else log_from_bytes(dat)
   return dat
 
-def recv_one_or_none(sock: SubSocket) -> Optional[capnp.lib.capnp._DynamicStructReader]:
+def recv_one_or_none(sock: SubSocket, lazy: bool = False) -> Optional[Message]:
   dat = sock.receive(non_blocking=True)
   if dat is not None:
-    dat = log_from_bytes(dat)
+    dat = LazyEvent(dat) if lazy else log_from_bytes(dat)
   return dat
 
 def recv_one_retry(sock: SubSocket) -> capnp.lib.capnp._DynamicStructReader:
@@ -139,7 +234,10 @@ def recv_one_retry(sock: SubSocket) -> capnp.lib.capnp._DynamicStructReader:
 class SubMaster:
   def __init__(self, services: List[str], poll: Optional[List[str]] = None,
                ignore_alive: Optional[List[str]] = None, ignore_avg_freq: Optional[List[str]] = None,
-               addr: str = "127.0.0.1"):
+               addr: str = "127.0.0.1", lazy: bool = False, shm: Optional[bool] = None):
+    # lazy: received messages are only decoded once read through sm[s], sm.data lags behind until then
+    self.lazy = lazy
+    self._pending = {}
     self.frame = -1
     self.updated = {s: False for s in services}
     self.rcv_time = {s: 0. for s in services}
@@ -147,11 +245,17 @@ class SubMaster:
     self.alive = {s: False for s in services}
     self.freq_ok = {s: False for s in services}
     self.recv_dts = {s: deque([0.0] * AVG_FREQ_HISTORY, maxlen=AVG_FREQ_HISTORY) for s in services}
+    # running sum of recv_dts, avoids summing the whole history on every update
+    self.recv_dts_sum = {s: 0.0 for s in services}
+    self.recv_dts_count = {s: 0 for s in services}
     self.sock = {}
     self.freq = {}
     self.data = {}
     self.valid = {}
     self.logMonoTime = {}
+    # MESSAGING_TRACE: latest message and receive time per service, see trace_context
+    self.trace = TRACE
+    self._trace_rcv = {}
 
     self.poller = Poller()
     self.non_polled_services = [s for s in services if poll is not None and
@@ -159,12 +263,16 @@ class SubMaster:
 
     self.ignore_average_freq = [] if ignore_avg_freq is None else ignore_avg_freq
     self.ignore_alive = [] if ignore_alive is None else ignore_alive
+    self.track_freq = {s for s in services if s not in self.non_polled_services and
+                       s not in self.ignore_average_freq}
 
     for s in services:
       if addr is not None:
         p = self.poller if s not in self.non_polled_services else None
-        self.sock[s] = sub_sock(s, poller=p, addr=addr, conflate=True)
+        self.sock[s] = sub_sock(s, poller=p, addr=addr, conflate=True, shm=shm)
       self.freq[s] = service_list[s].frequency
+      if self.freq[s] <= 1e-5:
+        self.track_freq.discard(s)
 
       try:
         data = new_message(s)
@@ -175,58 +283,94 @@ class SubMaster:
       self.logMonoTime[s] = 0
       self.valid[s] = data.valid
 
+    self._updated_last: List[str] = []
+    # arbitrary small number to avoid float comparison. If freq is 0, we can skip the checks
+    self.alive_max_dt = {s: 10. / f for s, f in self.freq.items() if f > 1e-5}
+    self.expected_dt = {s: 1 / (f * 0.90) for s, f in self.freq.items() if f > 1e-5}
+
   def __getitem__(self, s: str) -> capnp.lib.capnp._DynamicStructReader:
+    if s in self._pending:
+      self.data[s] = getattr(self._pending.pop(s).evt, s)
     return self.data[s]
 
   def update(self, timeout: int = 1000) -> None:
     msgs = []
     for sock in self.poller.poll(timeout):
-      msgs.append(recv_one_or_none(sock))
+      msgs.append(recv_one_or_none(sock, lazy=self.lazy))
 
     # non-blocking receive for non-polled sockets
     for s in self.non_polled_services:
-      msgs.append(recv_one_or_none(self.sock[s]))
+      msgs.append(recv_one_or_none(self.sock[s], lazy=self.lazy))
     self.update_msgs(sec_since_boot(), msgs)
 
-  def update_msgs(self, cur_time: float, msgs: List[capnp.lib.capnp._DynamicStructReader]) -> None:
+  def update_msgs(self, cur_time: float, msgs: List[Message]) -> None:
     self.frame += 1
-    self.updated = dict.fromkeys(self.updated, False)
+    for s in self._updated_last:
+      self.updated[s] = False
+    self._updated_last = []
+
+    if self.frame == 0 and not SIMULATION:
+      # freq_ok is only recomputed when a message arrives, so set it up for the all zero history
+      for s, f in self.freq.items():
+        self.freq_ok[s] = f <= 1e-5 or 0. < self.expected_dt[s]
+        if f <= 1e-5:
+          self.alive[s] = True
+
     for msg in msgs:
       if msg is None:
         continue
 
       s = msg.which()
       self.updated[s] = True
+      self._updated_last.append(s)
+
+      if self.rcv_time[s] > 1e-5 and s in self.track_freq:
+        dts = self.recv_dts[s]
+        dt = cur_time - self.rcv_time[s]
+        self.recv_dts_sum[s] += dt - dts[0]
+        dts.append(dt)
 
-      if self.rcv_time[s] > 1e-5 and self.freq[s] > 1e-5 and (s not in self.non_polled_services) \
-        and (s not in self.ignore_average_freq):
-        self.recv_dts[s].append(cur_time - self.rcv_time[s])
+        # resum once per history length so float errors in the running sum can't accumulate
+        self.recv_dts_count[s] += 1
+        if self.recv_dts_count[s] >= AVG_FREQ_HISTORY:
+          self.recv_dts_count[s] = 0
+          self.recv_dts_sum[s] = sum(dts)
+
+        # TODO: check if update frequency is high enough to not drop messages
+        # freq_ok if average frequency is higher than 90% of expected frequency
+        avg_dt = self.recv_dts_sum[s] / AVG_FREQ_HISTORY
+        self.freq_ok[s] = avg_dt < self.expected_dt[s]
 
       self.rcv_time[s] = cur_time
       self.rcv_frame[s] = self.frame
-      self.data[s] = getattr(msg, s)
+      if isinstance(msg, LazyEvent) and not msg.decoded:
+        self._pending[s] = msg
+      else:
+        self.data[s] = getattr(msg, s)
+        if self._pending:
+          self._pending.pop(s, None)
       self.logMonoTime[s] = msg.logMonoTime
       self.valid[s] = msg.valid
+      if self.trace:
+        self._trace_rcv[s] = (msg, cur_time)
 
       if SIMULATION:
         self.freq_ok[s] = True
         self.alive[s] = True
 
     if not SIMULATION:
-      for s in self.data:
-        # arbitrary small number to avoid float comparison. If freq is 0, we can skip the check
-        if self.freq[s] > 1e-5:
-          # alive if delay is within 10x the expected frequency
-          self.alive[s] = (cur_time - self.rcv_time[s]) < (10. / self.freq[s])
-
-          # TODO: check if update frequency is high enough to not drop messages
-          # freq_ok if average frequency is higher than 90% of expected frequency
-          avg_dt = sum(self.recv_dts[s]) / AVG_FREQ_HISTORY
-          expected_dt = 1 / (self.freq[s] * 0.90)
-          self.freq_ok[s] = (avg_dt < expected_dt)
-        else:
-          self.freq_ok[s] = True
-          self.alive[s] = True
+      # freq_ok only changes when a message arrives, alive also changes as time passes.
+      # alive if delay is within 10x the expected frequency
+      for s, max_dt in self.alive_max_dt.items():
+        self.alive[s] = (cur_time - self.rcv_time[s]) < max_dt
+
+  def trace_context(self, s: str) -> Optional[TraceContext]:
+    """Trace of the latest s, to pass to PubMaster.send with what was computed
+    from it. None unless tracing (MESSAGING_TRACE=1)."""
+    if s not in self._trace_rcv:
+      return None
+    msg, rcv_time = self._trace_rcv[s]
+    return TraceContext.received(msg, int(rcv_time * 1e9))
 
   def all_alive(self, service_list=None) -> bool:
     if service_list is None:  # check all
@@ -250,16 +394,97 @@ class SubMaster:
            and self.all_freq_ok(service_list=service_list) \
            and self.all_valid(service_list=service_list)
 
+def parse_remote_services(spec: str) -> Dict[str, int]:
+  """"modelV2:2,carState" -> {"modelV2": 2, "carState": 1}"""
+  ret = {}
+  for item in spec.split(","):
+    if not item.strip():
+      continue
+    name, _, decimation = item.strip().partition(":")
+    ret[name] = int(decimation) if decimation else 1
+  return ret
+
+class RemotePublisher:
+  """Copy of one service for the remote subscriber class. Only every
+  decimation-th message is forwarded, and with max_rate set messages arriving
+  faster are coalesced in a latest only slot that is sent once due."""
+  def __init__(self, service: str, decimation: int = 1, max_rate: float = 0.):
+    self.sock = pub_sock(service, remote=True)
+    self.decimation = max(1, decimation)
+    self.min_dt = 1. / max_rate if max_rate > 0 else 0.
+    self.next_send = 0.
+    self.pending: Optional[bytes] = None
+    self.cnt = 0
+    self.stats = {"sent": 0, "decimated": 0, "coalesced": 0}
+
+  def send(self, dat: bytes, cur_time: float) -> None:
+    self.cnt += 1
+    if (self.cnt - 1) % self.decimation != 0:
+      self.stats["decimated"] += 1
+      return
+
+    if self.pending is not None:
+      self.stats["coalesced"] += 1
+    self.pending = dat
+    self.flush(cur_time)
+
+  def flush(self, cur_time: float) -> bool:
+    """Send the pending message if it is due, returns whether one is still pending."""
+    if self.pending is None:
+      return False
+    if cur_time < self.next_send:
+      return True
+
+    self.sock.send(self.pending)
+    self.pending = None
+    self.stats["sent"] += 1
+    self.next_send = cur_time + self.min_dt
+    return False
+
 class PubMaster:
-  def __init__(self, services: List[str]):
+  def __init__(self, services: List[str], remote: Optional[Dict[str, int]] = None,
+               remote_max_rate: Optional[float] = None):
+    """remote maps services to the decimation of their copy for the remote
+    subscriber class, defaults to REMOTE_SERVICES and REMOTE_MAX_RATE."""
     self.sock = {}
     for s in services:
       self.sock[s] = pub_sock(s)
 
-  def send(self, s: str, dat: Union[bytes, capnp.lib.capnp._DynamicStructBuilder]) -> None:
+    if remote is None:
+      remote = parse_remote_services(REMOTE_SERVICES)
+    if remote_max_rate is None:
+      remote_max_rate = REMOTE_MAX_RATE
+    self.remote = {s: RemotePublisher(s, d, remote_max_rate) for s, d in remote.items() if s in self.sock}
+    self._remote_pending = set()
+
+  def send(self, s: str, dat: Union[bytes, capnp.lib.capnp._DynamicStructBuilder],
+           trace: Optional[TraceContext] = None) -> None:
+    """trace: SubMaster.trace_context of the input dat was computed from"""
     if not isinstance(dat, bytes):
+      if trace is not None:
+        trace.write(dat)
       dat = dat.to_bytes()
     self.sock[s].send(dat)
 
+    if self.remote:
+      cur_time = sec_since_boot()
+      if s in self.remote:
+        self.remote[s].send(dat, cur_time)
+        if self.remote[s].pending is not None:
+          self._remote_pending.add(s)
+      if self._remote_pending:
+        self.flush_remote(cur_time)
+
+  def flush_remote(self, cur_time: Optional[float] = None) -> None:
+    """Send coalesced remote messages that became due. Runs on every send,
+    publishers that may go quiet for a while can call it periodically."""
+    if cur_time is None:
+      cur_time = sec_since_boot()
+    self._remote_pending = {s for s in self._remote_pending if self.remote[s].flush(cur_time)}
+
+  def remote_stats(self) -> Dict[str, Dict[str, int]]:
+    """Per service counters of the remote subscriber class."""
+    return {s: dict(r.stats) for s, r in self.remote.items()}
+
   def all_readers_updated(self, s: str) -> bool:
     return self.sock[s].all_readers_updated()  # type: ignore
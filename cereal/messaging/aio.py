@@ -0,0 +1,169 @@
+"""asyncio integration for cereal messaging.
+
+With ZMQ the socket file descriptors are registered with the event loop, so a
+coroutine wakes up as soon as a message arrives instead of polling from a
+worker thread. msgq has no file descriptor, there the blocking poll runs in
+the loop's default executor. For the same reason these sockets never use the
+SHM_TRANSPORT shared memory path, shm services are also published over ZMQ.
+
+  sock = async_sub_sock("carState", conflate=True)
+  async for evt in sock:
+    ...
+
+  sm = AsyncSubMaster(["carState", "modelV2"])
+  while True:
+    await sm.update()
+"""
+import asyncio
+from typing import List, Optional, Union
+
+import capnp
+
+from cereal.messaging import Poller, SubSocket, PubMaster, SubMaster, LazyEvent, Message, \
+                             sub_sock, log_from_bytes, sec_since_boot
+
+
+class _FdWatch:
+  """One shot readiness of a SubSocket, fd is -1 if the socket has none. After
+  arm() the event is set once the fd is readable. The ZMQ fd stays readable
+  until zmq processes its commands, so a permanent reader would spin the loop
+  while a message waits unread."""
+
+  def __init__(self, sock: SubSocket, loop: asyncio.AbstractEventLoop, readable: asyncio.Event):
+    self.fd = sock.getFd()
+    self.loop = loop
+    self.readable = readable
+    self.armed = False
+
+  def arm(self) -> None:
+    if self.fd >= 0 and not self.armed:
+      self.loop.add_reader(self.fd, self._fire)
+      self.armed = True
+
+  def _fire(self) -> None:
+    self.loop.remove_reader(self.fd)
+    self.armed = False
+    self.readable.set()
+
+  def close(self) -> None:
+    if self.armed:
+      self.loop.remove_reader(self.fd)
+      self.armed = False
+    self.fd = -1
+
+
+class AsyncSubSocket:
+  """Awaitable wrapper around a connected SubSocket."""
+
+  def __init__(self, sock: SubSocket, raw: bool = False, poll_timeout: int = 100):
+    self.sock = sock
+    self.raw = raw
+    self.poll_timeout = poll_timeout
+    self.loop = asyncio.get_running_loop()
+    self._readable = asyncio.Event()
+    self._watch = _FdWatch(sock, self.loop, self._readable)
+    self._poller = None
+    if self._watch.fd < 0:
+      self._poller = Poller()
+      self._poller.registerSocket(sock)
+
+  async def receive_raw(self) -> bytes:
+    """Wait for the next message and return its bytes."""
+    while True:
+      dat = self.sock.receive(non_blocking=True)
+      if dat is not None:
+        return dat
+
+      if self._poller is not None:
+        await self.loop.run_in_executor(None, self._poller.poll, self.poll_timeout)
+        continue
+
+      # check once more after arming so a message arriving in between is not missed
+      self._readable.clear()
+      self._watch.arm()
+      dat = self.sock.receive(non_blocking=True)
+      if dat is not None:
+        return dat
+      await self._readable.wait()
+
+  async def receive(self) -> Union[bytes, capnp.lib.capnp._DynamicStructReader]:
+    dat = await self.receive_raw()
+    return dat if self.raw else log_from_bytes(dat)
+
+  def __aiter__(self):
+    return self
+
+  async def __anext__(self) -> Union[bytes, capnp.lib.capnp._DynamicStructReader]:
+    return await self.receive()
+
+  def close(self) -> None:
+    self._watch.close()
+
+
+def async_sub_sock(endpoint: str, addr: str = "127.0.0.1", conflate: bool = False,
+                   raw: bool = False, remote: bool = False) -> AsyncSubSocket:
+  """Like sub_sock, must be called from a running event loop. Iterating yields
+  decoded events, or the received bytes if raw is set."""
+  return AsyncSubSocket(sub_sock(endpoint, addr=addr, conflate=conflate, remote=remote, shm=False), raw=raw)
+
+
+class AsyncSubMaster(SubMaster):
+  """SubMaster whose update() is a coroutine. Same bookkeeping and checks as SubMaster."""
+
+  def __init__(self, services: List[str], poll: Optional[List[str]] = None,
+               ignore_alive: Optional[List[str]] = None, ignore_avg_freq: Optional[List[str]] = None,
+               addr: str = "127.0.0.1", lazy: bool = False):
+    super().__init__(services, poll=poll, ignore_alive=ignore_alive, ignore_avg_freq=ignore_avg_freq, addr=addr,
+                     lazy=lazy, shm=False)
+    self.loop = asyncio.get_running_loop()
+    self.polled_services = [s for s in self.sock if s not in self.non_polled_services]
+
+    self._readable = asyncio.Event()
+    self._watches = [_FdWatch(self.sock[s], self.loop, self._readable) for s in self.polled_services]
+    self._use_fds = len(self._watches) > 0 and all(w.fd >= 0 for w in self._watches)
+
+  def _receive(self, services: List[str]) -> List[Message]:
+    msgs = []
+    for s in services:
+      dat = self.sock[s].receive(non_blocking=True)
+      if dat is not None:
+        msgs.append(LazyEvent(dat) if self.lazy else log_from_bytes(dat))
+    return msgs
+
+  async def update(self, timeout: int = 1000) -> None:  # type: ignore[override]
+    msgs = self._receive(self.polled_services)
+    if not msgs and self._use_fds:
+      # a readable fd doesn't always mean a message, wait again until the timeout
+      deadline = self.loop.time() + timeout / 1000.
+      while not msgs and self.loop.time() < deadline:
+        self._readable.clear()
+        for w in self._watches:
+          w.arm()
+        msgs = self._receive(self.polled_services)
+        if msgs:
+          break
+        try:
+          await asyncio.wait_for(self._readable.wait(), deadline - self.loop.time())
+        except asyncio.TimeoutError:
+          pass
+        msgs = self._receive(self.polled_services)
+    elif not msgs:
+      await self.loop.run_in_executor(None, self.poller.poll, timeout)
+      msgs = self._receive(self.polled_services)
+
+    # non-blocking receive for non-polled sockets
+    msgs += self._receive(self.non_polled_services)
+    self.update_msgs(sec_since_boot(), msgs)
+
+  def close(self) -> None:
+    for w in self._watches:
+      w.close()
+
+
+class AsyncPubMaster(PubMaster):
+  """PubMaster for coroutines. Sending never blocks, so send() stays synchronous;
+  wait_readers_updated() lets a publisher yield until all readers caught up (msgq only)."""
+
+  async def wait_readers_updated(self, s: str, interval: float = 0.001) -> None:
+    while not self.all_readers_updated(s):
+      await asyncio.sleep(interval)
@@ -37,6 +37,7 @@ public:
   int connect(Context *context, std::string endpoint, std::string address, bool conflate=false, bool check_endpoint=true);
   void setTimeout(int timeout);
   void * getRawSocket() {return (void*)q;}
+  int getFd() {return -1;}  // msgq signals readers, there is no fd to wait on
   Message *receive(bool non_blocking=false);
   ~MSGQSubSocket();
 };
@@ -46,6 +47,7 @@ private:
   msgq_queue_t * q = NULL;
 public:
   int connect(Context *context, std::string endpoint, bool check_endpoint=true);
+  int setConflate(bool conflate) {return -1;}  // readers conflate on their side
   int sendMessage(Message *message);
   int send(char *data, size_t size);
   bool all_readers_updated();
@@ -125,6 +125,16 @@ void ZMQSubSocket::setTimeout(int timeout){
   zmq_setsockopt(sock, ZMQ_RCVTIMEO, &timeout, sizeof(int));
 }
 
+int ZMQSubSocket::getFd(){
+  // Edge triggered: it only signals again after receive() returned no message
+  int fd = -1;
+  size_t fd_size = sizeof(fd);
+  if (zmq_getsockopt(sock, ZMQ_FD, &fd, &fd_size) != 0){
+    return -1;
+  }
+  return fd;
+}
+
 ZMQSubSocket::~ZMQSubSocket(){
   zmq_close(sock);
 }
@@ -135,6 +145,11 @@ int ZMQPubSocket::connect(Context *context, std::string endpoint, bool check_end
     return -1;
   }
 
+  if (conflate){
+    int arg = 1;
+    zmq_setsockopt(sock, ZMQ_CONFLATE, &arg, sizeof(int));
+  }
+
   std::string addr = "127.0.0.1";
   char *discoverable = std::getenv("DISCOVERABLE_PUBLISHERS");
   if (discoverable != NULL){
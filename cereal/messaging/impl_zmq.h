@@ -38,6 +38,7 @@ public:
   int connect(Context *context, std::string endpoint, std::string address, bool conflate=false, bool check_endpoint=true);
   void setTimeout(int timeout);
   void * getRawSocket() {return sock;}
+  int getFd();
   Message *receive(bool non_blocking=false);
   ~ZMQSubSocket();
 };
@@ -46,8 +47,10 @@ class ZMQPubSocket : public PubSocket {
 private:
   void * sock;
   std::string full_endpoint;
+  bool conflate = false;
 public:
   int connect(Context *context, std::string endpoint, bool check_endpoint=true);
+  int setConflate(bool c) {conflate = c; return 0;}
   int sendMessage(Message *message);
   int send(char *data, size_t size);
   bool all_readers_updated();
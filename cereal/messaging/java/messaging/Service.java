@@ -6,5 +6,6 @@ public class Service{
     public boolean keepLast;
     public boolean log;
     public float decimation;
+    public boolean shm;
 }
 
@@ -1,4 +1,6 @@
+#include <algorithm>
 #include <cassert>
+#include <chrono>
 #include <iostream>
 
 #include "messaging.h"
@@ -42,6 +44,13 @@ SubSocket * SubSocket::create(){
   return s;
 }
 
+SubSocket * SubSocket::create(bool use_msgq){
+  if (use_msgq && !MUST_USE_ZMQ){
+    return new MSGQSubSocket();
+  }
+  return SubSocket::create();
+}
+
 SubSocket * SubSocket::create(Context * context, std::string endpoint, std::string address, bool conflate, bool check_endpoint){
   SubSocket *s = SubSocket::create();
   int r = s->connect(context, endpoint, address, conflate, check_endpoint);
@@ -64,6 +73,13 @@ PubSocket * PubSocket::create(){
   return s;
 }
 
+PubSocket * PubSocket::create(bool use_msgq){
+  if (use_msgq && !MUST_USE_ZMQ){
+    return new MSGQPubSocket();
+  }
+  return PubSocket::create();
+}
+
 PubSocket * PubSocket::create(Context * context, std::string endpoint, bool check_endpoint){
   PubSocket *s = PubSocket::create();
   int r = s->connect(context, endpoint, check_endpoint);
@@ -76,10 +92,55 @@ PubSocket * PubSocket::create(Context * context, std::string endpoint, bool chec
   }
 }
 
+// Polls ZMQ and msgq sockets together, with only ZMQ sockets it is a ZMQPoller.
+// msgq publishers signal the reader thread, which interrupts the blocking
+// zmq_poll. The wait is sliced since a signal can arrive right before it.
+class MixedPoller : public Poller {
+private:
+  ZMQPoller zmq;
+  MSGQPoller msgq;
+  bool has_zmq = false;
+  bool has_msgq = false;
+  static const int MAX_SLICE_MS = 10;
+
+public:
+  void registerSocket(SubSocket *socket){
+    if (dynamic_cast<MSGQSubSocket*>(socket) != nullptr){
+      msgq.registerSocket(socket);
+      has_msgq = true;
+    } else {
+      zmq.registerSocket(socket);
+      has_zmq = true;
+    }
+  }
+
+  std::vector<SubSocket*> poll(int timeout){
+    if (!has_msgq) return zmq.poll(timeout);
+    if (!has_zmq) return msgq.poll(timeout);
+
+    auto deadline = std::chrono::steady_clock::now() + std::chrono::milliseconds(timeout);
+    while (true){
+      std::vector<SubSocket*> r = msgq.poll(0);
+      std::vector<SubSocket*> z = zmq.poll(0);
+      r.insert(r.end(), z.begin(), z.end());
+      if (!r.empty()) return r;
+
+      int slice = MAX_SLICE_MS;
+      if (timeout >= 0){
+        auto left = std::chrono::duration_cast<std::chrono::milliseconds>(deadline - std::chrono::steady_clock::now()).count();
+        if (left <= 0) return r;
+        slice = std::min<int>(slice, left);
+      }
+      r = zmq.poll(slice);
+      if (!r.empty()) return r;
+    }
+  }
+};
+
 Poller * Poller::create(){
   Poller * p;
   if (messaging_use_zmq()){
-    p = new ZMQPoller();
+    p = new MixedPoller();
   } else {
     p = new MSGQPoller();
   }
@@ -40,7 +40,11 @@ public:
   virtual void setTimeout(int timeout) = 0;
   virtual Message *receive(bool non_blocking=false) = 0;
   virtual void * getRawSocket() = 0;
+  // File descriptor that becomes readable when messages may be available, -1 if not supported
+  virtual int getFd() = 0;
   static SubSocket * create();
+  // shared memory (msgq) socket regardless of the backend, where msgq is available
+  static SubSocket * create(bool use_msgq);
   static SubSocket * create(Context * context, std::string endpoint, std::string address="127.0.0.1", bool conflate=false, bool check_endpoint=true);
   virtual ~SubSocket(){};
 };
@@ -48,10 +52,13 @@ public:
 class PubSocket {
 public:
   virtual int connect(Context *context, std::string endpoint, bool check_endpoint=true) = 0;
+  // Keep only the latest unsent message per subscriber, call before connect. -1 if not supported
+  virtual int setConflate(bool conflate) = 0;
   virtual int sendMessage(Message *message) = 0;
   virtual int send(char *data, size_t size) = 0;
   virtual bool all_readers_updated() = 0;
   static PubSocket * create();
+  static PubSocket * create(bool use_msgq);
   static PubSocket * create(Context * context, std::string endpoint, bool check_endpoint=true);
   static PubSocket * create(Context * context, std::string endpoint, int port, bool check_endpoint=true);
   virtual ~PubSocket(){};
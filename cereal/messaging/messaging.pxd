@@ -21,14 +21,20 @@ cdef extern from "messaging.h":
   cdef cppclass SubSocket:
     @staticmethod
     SubSocket * create()
-    int connect(Context *, string, string, bool)
+    @staticmethod
+    SubSocket * create(bool)
+    int connect(Context *, string, string, bool, bool)
     Message * receive(bool)
     void setTimeout(int)
+    int getFd()
 
   cdef cppclass PubSocket:
     @staticmethod
     PubSocket * create()
-    int connect(Context *, string)
+    @staticmethod
+    PubSocket * create(bool)
+    int connect(Context *, string, bool)
+    int setConflate(bool)
     int sendMessage(Message *)
     int send(char *, size_t)
     bool all_readers_updated()
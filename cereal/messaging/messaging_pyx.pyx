@@ -72,8 +72,9 @@ cdef class SubSocket:
   cdef cppSubSocket * socket
   cdef bool is_owner
 
-  def __cinit__(self):
-    self.socket = cppSubSocket.create()
+  def __cinit__(self, bool shm=False):
+    # shm: shared memory (msgq) socket even if the default backend is ZMQ
+    self.socket = cppSubSocket.create(shm) if shm else cppSubSocket.create()
     self.is_owner = True
 
     if self.socket == NULL:
@@ -90,8 +91,9 @@ cdef class SubSocket:
     self.is_owner = False
     self.socket = ptr
 
-  def connect(self, Context context, string endpoint, string address=b"127.0.0.1", bool conflate=False):
-    r = self.socket.connect(context.context, endpoint, address, conflate)
+  def connect(self, Context context, string endpoint, string address=b"127.0.0.1", bool conflate=False,
+              bool check_endpoint=True):
+    r = self.socket.connect(context.context, endpoint, address, conflate, check_endpoint)
 
     if r != 0:
       if errno.errno == errno.EADDRINUSE:
@@ -102,6 +104,9 @@ cdef class SubSocket:
   def setTimeout(self, int timeout):
     self.socket.setTimeout(timeout)
 
+  def getFd(self):
+    return self.socket.getFd()
+
   def receive(self, bool non_blocking=False):
     msg = self.socket.receive(non_blocking)
 
@@ -123,16 +128,16 @@ cdef class SubSocket:
 cdef class PubSocket:
   cdef cppPubSocket * socket
 
-  def __cinit__(self):
-    self.socket = cppPubSocket.create()
+  def __cinit__(self, bool shm=False):
+    self.socket = cppPubSocket.create(shm) if shm else cppPubSocket.create()
     if self.socket == NULL:
       raise MessagingError
 
   def __dealloc__(self):
     del self.socket
 
-  def connect(self, Context context, string endpoint):
-    r = self.socket.connect(context.context, endpoint)
+  def connect(self, Context context, string endpoint, bool check_endpoint=True):
+    r = self.socket.connect(context.context, endpoint, check_endpoint)
 
     if r != 0:
       if errno.errno == errno.EADDRINUSE:
@@ -150,5 +155,8 @@ cdef class PubSocket:
       else:
         raise MessagingError
 
+  def setConflate(self, bool conflate):
+    return self.socket.setConflate(conflate)
+
   def all_readers_updated(self):
     return self.socket.all_readers_updated()
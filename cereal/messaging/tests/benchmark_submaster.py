@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Measure SubMaster.update_msgs bookkeeping with the controlsd subscription.
+
+Messages are replayed at their service frequencies on a 100 Hz loop, without
+sockets, and the result is compared with the previous implementation that
+summed the whole recv_dts history of every service on every update.
+
+  python cereal/messaging/tests/benchmark_submaster.py [seconds]
+"""
+import random
+import sys
+import time
+
+from cereal.messaging import SubMaster, AVG_FREQ_HISTORY
+from cereal.services import service_list
+
+# selfdrive/controls/controlsd.py
+SERVICES = ['deviceState', 'pandaStates', 'peripheralState', 'modelV2', 'liveCalibration',
+            'driverMonitoringState', 'longitudinalPlan', 'lateralPlan', 'liveLocationKalman',
+            'managerState', 'liveParameters', 'radarState', 'roadCameraState', 'driverCameraState']
+IGNORE_AVG_FREQ = ['radarState', 'longitudinalPlan', 'liveParameters', 'liveLocationKalman']
+LOOP_HZ = 100
+
+
+class FakeEvent:
+  """Just enough of a log.Event reader for update_msgs."""
+  def __init__(self, service, log_mono_time):
+    self._which = service
+    self.logMonoTime = log_mono_time
+    self.valid = True
+    setattr(self, service, None)
+
+  def which(self):
+    return self._which
+
+
+class LegacySubMaster(SubMaster):
+  def update_msgs(self, cur_time, msgs):
+    self.frame += 1
+    self.updated = dict.fromkeys(self.updated, False)
+    for msg in msgs:
+      if msg is None:
+        continue
+
+      s = msg.which()
+      self.updated[s] = True
+
+      if self.rcv_time[s] > 1e-5 and self.freq[s] > 1e-5 and (s not in self.non_polled_services) \
+        and (s not in self.ignore_average_freq):
+        self.recv_dts[s].append(cur_time - self.rcv_time[s])
+
+      self.rcv_time[s] = cur_time
+      self.rcv_frame[s] = self.frame
+      self.data[s] = getattr(msg, s)
+      self.logMonoTime[s] = msg.logMonoTime
+      self.valid[s] = msg.valid
+
+    for s in self.data:
+      if self.freq[s] > 1e-5:
+        self.alive[s] = (cur_time - self.rcv_time[s]) < (10. / self.freq[s])
+        avg_dt = sum(self.recv_dts[s]) / AVG_FREQ_HISTORY
+        expected_dt = 1 / (self.freq[s] * 0.90)
+        self.freq_ok[s] = (avg_dt < expected_dt)
+      else:
+        self.freq_ok[s] = True
+        self.alive[s] = True
+
+
+def schedule(seconds):
+  """Per loop iteration (time, events), with jitter and the occasional dropped message."""
+  rnd = random.Random(0)
+  frames = []
+  next_t = {s: 0.01 for s in SERVICES}
+  for i in range(int(seconds * LOOP_HZ)):
+    t = 1. + i / LOOP_HZ
+    msgs = []
+    for s in SERVICES:
+      freq = service_list[s].frequency
+      if freq > 1e-5 and next_t[s] <= t:
+        next_t[s] = t + (1. / freq) * rnd.uniform(0.9, 1.3)
+        if rnd.random() > 0.02:
+          msgs.append(FakeEvent(s, int(t * 1e9)))
+    frames.append((t, msgs))
+  return frames
+
+
+def run(sm, frames):
+  start = time.monotonic()
+  for t, msgs in frames:
+    sm.update_msgs(t, msgs)
+  return (time.monotonic() - start) / len(frames) * 1e6
+
+
+if __name__ == "__main__":
+  seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 60.
+  frames = schedule(seconds)
+
+  kwargs = dict(ignore_avg_freq=IGNORE_AVG_FREQ, addr=None)
+  legacy, current = LegacySubMaster(SERVICES, **kwargs), SubMaster(SERVICES, **kwargs)
+  t_legacy = run(legacy, frames)
+  t_current = run(current, frames)
+
+  for name in ("updated", "alive", "freq_ok", "rcv_frame"):
+    assert getattr(legacy, name) == getattr(current, name), name
+
+  print(f"{len(SERVICES)} services, {len(frames)} updates at {LOOP_HZ} Hz")
+  print(f"legacy  {t_legacy:8.2f} us/update")
+  print(f"current {t_current:8.2f} us/update ({t_legacy / t_current:.1f}x)")
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""Latency and throughput of the transports Python services can use.
+
+  tcp  ZMQ over loopback TCP (the default)
+  ipc  ZMQ over abstract unix sockets (ZMQ_MESSAGING_PROTOCOL=INTER_PROCESS)
+  shm  msgq shared memory (SHM_TRANSPORT=1 for services marked shm)
+
+Latency is half the round trip to an echo process, throughput is how many
+messages a subscriber gets while the publisher sends as fast as it can.
+
+  python cereal/messaging/tests/benchmark_transport.py [round trips]
+"""
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+
+PING, PONG = "carState", "carControl"
+TRANSPORTS = {"tcp": "TCP", "ipc": "INTER_PROCESS", "shm": None}
+# carState, a plan and a modelV2 sized message
+SIZES = [1 << 10, 8 << 10, 64 << 10]
+THROUGHPUT_SECONDS = 1.
+
+
+def setup(transport):
+  # the protocol is read on every connect, so set it before the sockets exist
+  os.environ["ZMQ_MESSAGING_PROTOCOL"] = TRANSPORTS[transport] or "TCP"
+  from cereal.messaging import Context, PubSocket, SubSocket
+  ctx = Context()
+  shm = transport == "shm"
+
+  def pub(endpoint):
+    sock = PubSocket(shm=shm)
+    sock.connect(ctx, endpoint)
+    return sock
+
+  def sub(endpoint, timeout=1000):
+    sock = SubSocket(shm=shm)
+    sock.connect(ctx, endpoint)
+    sock.setTimeout(timeout)
+    return sock
+  return pub, sub
+
+
+def echo(transport, ready, stop):
+  pub, sub = setup(transport)
+  ping, pong = sub(PING, timeout=100), pub(PONG)
+  ready.set()
+  while not stop.is_set():
+    dat = ping.receive()
+    if dat is not None:
+      pong.send(dat)
+
+
+def latency(transport, size, n):
+  ready, stop = multiprocessing.Event(), multiprocessing.Event()
+  proc = multiprocessing.Process(target=echo, args=(transport, ready, stop), daemon=True)
+  proc.start()
+
+  pub, sub = setup(transport)
+  ping, pong = pub(PING), sub(PONG)
+  ready.wait()
+  time.sleep(0.5)  # ZMQ subscriptions take a moment
+
+  dat = os.urandom(size)
+  dts = []
+  for i in range(n + 10):
+    t = time.perf_counter_ns()
+    ping.send(dat)
+    if pong.receive() is None:
+      continue
+    if i >= 10:  # warm up
+      dts.append((time.perf_counter_ns() - t) / 2e3)
+
+  stop.set()
+  proc.join()
+  return statistics.median(dts), sorted(dts)[int(len(dts) * 0.99)], n - len(dts)
+
+
+def count(transport, ready, result):
+  _, sub = setup(transport)
+  sock = sub(PING, timeout=500)
+  ready.set()
+  n = 0
+  while sock.receive() is not None:
+    n += 1
+  result.put(n)
+
+
+def throughput(transport, size):
+  ready, result = multiprocessing.Event(), multiprocessing.Queue()
+  proc = multiprocessing.Process(target=count, args=(transport, ready, result), daemon=True)
+  proc.start()
+
+  pub, _ = setup(transport)
+  sock = pub(PING)
+  ready.wait()
+  time.sleep(0.5)
+
+  dat = os.urandom(size)
+  sent = 0
+  start = time.monotonic()
+  while time.monotonic() - start < THROUGHPUT_SECONDS:
+    sock.send(dat)
+    sent += 1
+
+  received = result.get()
+  proc.join()
+  return received / THROUGHPUT_SECONDS, sent - received
+
+
+if __name__ == "__main__":
+  n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+  multiprocessing.set_start_method("fork")
+
+  print(f"{'transport':<10} {'size':>7} {'median us':>10} {'p99 us':>8} {'lost':>5} {'msgs/s':>10} {'dropped':>8}")
+  for transport in TRANSPORTS:
+    for size in SIZES:
+      med, p99, lost = latency(transport, size, n)
+      rate, dropped = throughput(transport, size)
+      print(f"{transport:<10} {size:>7} {med:>10.1f} {p99:>8.1f} {lost:>5} {rate:>10.0f} {dropped:>8}")
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+import asyncio
+import time
+import unittest
+
+import cereal.messaging as messaging
+from cereal.messaging.aio import AsyncSubMaster, async_sub_sock
+from cereal.messaging.tests.test_messaging import random_bytes, random_carstate, assert_carstate, zmq_sleep
+
+
+def delayed_send(delay, sock, dat):
+  asyncio.get_running_loop().call_later(delay, sock.send, dat)
+
+
+class TestAsyncSubSocket(unittest.TestCase):
+
+  def setUp(self):
+    # ZMQ pub socket takes too long to die
+    # sleep to prevent multiple publishers error between tests
+    zmq_sleep(3)
+
+  def test_receive_raw(self):
+    async def run():
+      pub_sock = messaging.pub_sock("carState")
+      sock = async_sub_sock("carState", raw=True)
+      zmq_sleep()
+
+      for _ in range(100):
+        msg = random_bytes()
+        pub_sock.send(msg)
+        recvd = await asyncio.wait_for(sock.receive(), 1)
+        self.assertEqual(msg, recvd)
+      sock.close()
+    asyncio.run(run())
+
+  def test_async_for(self):
+    async def run():
+      pub_sock = messaging.pub_sock("carState")
+      sock = async_sub_sock("carState")
+      zmq_sleep()
+
+      sent = [random_carstate() for _ in range(10)]
+      for i, msg in enumerate(sent):
+        delayed_send(0.01 * (i + 1), pub_sock, msg.to_bytes())
+
+      recvd = []
+      async for evt in sock:
+        recvd.append(evt)
+        if len(recvd) == len(sent):
+          break
+      for s, r in zip(sent, recvd):
+        assert_carstate(s.carState, r.carState)
+      sock.close()
+    asyncio.run(asyncio.wait_for(run(), 5))
+
+  def test_no_wakeups_while_unread(self):
+    async def run():
+      pub_sock = messaging.pub_sock("carState")
+      sock = async_sub_sock("carState", raw=True)
+      zmq_sleep()
+
+      wakeups = 0
+      fire = sock._watch._fire
+      def count():
+        nonlocal wakeups
+        wakeups += 1
+        fire()
+      sock._watch._fire = count
+
+      delayed_send(0.01, pub_sock, random_bytes())
+      await asyncio.wait_for(sock.receive(), 1)
+      # messages waiting while the consumer is busy elsewhere
+      for _ in range(10):
+        pub_sock.send(random_bytes())
+      wakeups = 0
+      await asyncio.sleep(0.5)
+      self.assertLessEqual(wakeups, 1)
+      for _ in range(10):
+        await asyncio.wait_for(sock.receive(), 1)
+      sock.close()
+    asyncio.run(run())
+
+  def test_does_not_block_loop(self):
+    async def run():
+      sock = async_sub_sock("carState", raw=True)
+      ticks = 0
+      task = asyncio.create_task(sock.receive())
+      for _ in range(10):
+        await asyncio.sleep(0.01)
+        ticks += 1
+      self.assertFalse(task.done())
+      self.assertEqual(ticks, 10)
+      task.cancel()
+      sock.close()
+    asyncio.run(run())
+
+
+class TestAsyncSubMaster(unittest.TestCase):
+
+  def setUp(self):
+    zmq_sleep(3)
+
+  def test_update(self):
+    async def run():
+      pub_sock = messaging.pub_sock("carState")
+      sm = AsyncSubMaster(["carState"])
+      zmq_sleep()
+
+      for i in range(10):
+        msg = random_carstate()
+        delayed_send(0.01, pub_sock, msg.to_bytes())
+        await sm.update(1000)
+        self.assertEqual(sm.frame, i)
+        self.assertTrue(sm.updated["carState"])
+        assert_carstate(msg.carState, sm["carState"])
+      sm.close()
+    asyncio.run(run())
+
+  def test_update_timeout(self):
+    async def run():
+      sm = AsyncSubMaster(["carState"])
+      for timeout in (100, 300):
+        start_time = time.monotonic()
+        await sm.update(timeout)
+        t = time.monotonic() - start_time
+        self.assertGreaterEqual(t, timeout / 1000.)
+        self.assertLess(t, 1)
+        self.assertFalse(any(sm.updated.values()))
+      sm.close()
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -103,6 +103,40 @@ class TestPubSubSockets(unittest.TestCase):
       self.assertLess(time.monotonic() - start_time, 0.2)
       assert recvd is None
 
+  @parameterized.expand([(True,), (False,)])
+  @unittest.skipUnless(os.path.isdir("/dev/shm"), "no shared memory")
+  def test_shm_pub_sub(self, conflate):
+    sock = random_sock()
+    pub_sock = messaging.PubSocket(shm=True)
+    pub_sock.connect(messaging.context, sock)
+    sub_sock = messaging.SubSocket(shm=True)
+    sub_sock.connect(messaging.context, sock, conflate=conflate)
+    sub_sock.setTimeout(100)
+
+    sent_msgs = [random_bytes() for _ in range(10)]
+    for msg in sent_msgs:
+      pub_sock.send(msg)
+    recvd_msgs = messaging.drain_sock_raw(sub_sock)
+    self.assertEqual(recvd_msgs, sent_msgs[-1:] if conflate else sent_msgs)
+
+  def test_use_shm(self):
+    shm_services = [s for s in service_list if service_list[s].shm]
+    other = [s for s in service_list if not service_list[s].shm]
+    self.assertGreater(len(shm_services), 0)
+
+    orig = messaging.SHM_TRANSPORT
+    try:
+      messaging.SHM_TRANSPORT = False
+      self.assertFalse(messaging.use_shm(shm_services[0]))
+
+      messaging.SHM_TRANSPORT = True
+      self.assertEqual(messaging.use_shm(shm_services[0]), messaging.DEVICE_ADDR is None)
+      self.assertFalse(messaging.use_shm(other[0]))
+      # remote subscribers stay on ZMQ
+      self.assertFalse(messaging.use_shm(shm_services[0], addr="192.168.1.2"))
+    finally:
+      messaging.SHM_TRANSPORT = orig
+
 class TestMessaging(unittest.TestCase):
 
   def setUp(self):
@@ -120,6 +154,44 @@ class TestMessaging(unittest.TestCase):
     self.assertTrue(msg.valid)
     self.assertEqual(evt, msg.which())
 
+  @parameterized.expand(events)
+  def test_lazy_event(self, evt):
+    try:
+      msg = messaging.new_message(evt)
+    except capnp.lib.capnp.KjException:
+      msg = messaging.new_message(evt, random.randrange(200))
+    msg.valid = random.choice([True, False])
+    dat = msg.to_bytes()
+
+    lazy = messaging.LazyEvent(dat)
+    self.assertFalse(lazy.decoded)
+    self.assertEqual(lazy.which(), evt)
+    self.assertEqual(lazy.logMonoTime, msg.logMonoTime)
+    self.assertEqual(lazy.valid, msg.valid)
+    self.assertEqual(lazy.to_bytes(), dat)
+
+    # any other field decodes the message
+    self.assertEqual(lazy.as_builder().to_bytes(), dat)
+    self.assertTrue(lazy.decoded)
+
+  def test_lazy_event_segments(self):
+    # large enough to span several segments
+    msg = messaging.new_message("liveTracks", 10000)
+    for i, t in enumerate(msg.liveTracks):
+      t.trackId = i
+    dat = msg.to_bytes()
+    self.assertGreater(int.from_bytes(dat[:4], "little"), 0)
+
+    lazy = messaging.LazyEvent(dat)
+    self.assertEqual(lazy.which(), "liveTracks")
+    self.assertEqual(lazy.logMonoTime, msg.logMonoTime)
+    self.assertEqual(lazy.liveTracks[-1].trackId, 9999)
+
+  def test_lazy_event_carstate(self):
+    msg = random_carstate()
+    lazy = messaging.LazyEvent(msg.to_bytes())
+    assert_carstate(msg.carState, lazy.carState)
+
   @parameterized.expand(events)
   def test_pub_sock(self, evt):
     messaging.pub_sock(evt)
@@ -131,6 +203,7 @@ class TestMessaging(unittest.TestCase):
   @parameterized.expand([
     (messaging.drain_sock, capnp._DynamicStructReader),
     (messaging.drain_sock_raw, bytes),
+    (lambda sock: messaging.drain_sock(sock, lazy=True), messaging.LazyEvent),
   ])
   def test_drain_sock(self, func, expected_type):
     sock = "carState"
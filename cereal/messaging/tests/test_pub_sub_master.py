@@ -74,7 +74,85 @@ class TestSubMaster(unittest.TestCase):
       self.assertFalse(any(sm.updated.values()))
 
   def test_alive(self):
-    pass
+    sock = "carState"
+    sm = messaging.SubMaster([sock,], addr=None)
+    dt = 1. / sm.freq[sock]
+    for i in range(10):
+      t = 1. + i * dt
+      sm.update_msgs(t, [messaging.new_message(sock)])
+      self.assertTrue(sm.alive[sock])
+
+    # dead once nothing arrived for 10x the expected interval
+    sm.update_msgs(t + 9.5 * dt, [])
+    self.assertTrue(sm.alive[sock])
+    sm.update_msgs(t + 10.5 * dt, [])
+    self.assertFalse(sm.alive[sock])
+    self.assertFalse(sm.updated[sock])
+
+  def test_freq_ok(self):
+    sock = "carState"
+    sm = messaging.SubMaster([sock,], addr=None)
+    dt = 1. / sm.freq[sock]
+    t = 1.
+    for _ in range(2 * messaging.AVG_FREQ_HISTORY):
+      sm.update_msgs(t, [messaging.new_message(sock)])
+      self.assertTrue(sm.freq_ok[sock])
+      t += dt
+
+    # at half the expected rate the average drops below 90% once enough history is replaced
+    for _ in range(messaging.AVG_FREQ_HISTORY):
+      t += dt
+      sm.update_msgs(t, [])
+      t += dt
+      sm.update_msgs(t, [messaging.new_message(sock)])
+    self.assertFalse(sm.freq_ok[sock])
+    self.assertAlmostEqual(sm.recv_dts_sum[sock], sum(sm.recv_dts[sock]))
+
+    for _ in range(messaging.AVG_FREQ_HISTORY):
+      t += dt
+      sm.update_msgs(t, [messaging.new_message(sock)])
+    self.assertTrue(sm.freq_ok[sock])
+
+  def test_ignore_avg_freq(self):
+    sock = "carState"
+    sm = messaging.SubMaster([sock,], ignore_avg_freq=[sock,], addr=None)
+    t = 1.
+    for _ in range(messaging.AVG_FREQ_HISTORY):
+      sm.update_msgs(t, [messaging.new_message(sock)])
+      t += 1.
+    self.assertTrue(sm.freq_ok[sock])
+
+  def test_trace(self):
+    # modelV2 -> plannerd -> lateralPlan -> controlsd
+    planner = messaging.SubMaster(["modelV2"], addr=None)
+    controls = messaging.SubMaster(["lateralPlan"], addr=None)
+    self.assertIsNone(planner.trace_context("modelV2"))
+    planner.trace = controls.trace = True
+
+    model = messaging.new_message("modelV2")
+    model.logMonoTime = int(1e9)
+    model.modelV2.frameId = 42
+    model.modelV2.timestampEof = int(0.95e9)
+    planner.update_msgs(1.002, [messaging.log_from_bytes(model.to_bytes())])
+
+    plan = messaging.new_message("lateralPlan")
+    plan.logMonoTime = int(1.010e9)
+    planner.trace_context("modelV2").write(plan)
+    controls.update_msgs(1.011, [messaging.log_from_bytes(plan.to_bytes())])
+
+    ctx = controls.trace_context("lateralPlan")
+    self.assertEqual(ctx.frame_id, 42)
+    self.assertEqual(ctx.origin, int(0.95e9))
+    self.assertEqual([h.service for h in ctx.hops], ["modelV2", "lateralPlan"])
+
+    end = int(1.015e9)
+    stages = ctx.stages(end)
+    expected = [("origin -> modelV2", 50.), ("modelV2 transport", 2.), ("modelV2 -> lateralPlan", 8.),
+                ("lateralPlan transport", 1.), ("lateralPlan -> end", 4.)]
+    self.assertEqual([s for s, _ in stages], [s for s, _ in expected])
+    for (_, ms), (_, expected_ms) in zip(stages, expected):
+      self.assertAlmostEqual(ms, expected_ms, places=3)
+    self.assertAlmostEqual(sum(ms for _, ms in stages), ctx.latency(end), places=3)
 
   def test_ignore_alive(self):
     pass
@@ -135,6 +213,44 @@ class TestPubMaster(unittest.TestCase):
           msg = msg.to_bytes()
         self.assertEqual(msg, recvd, i)
 
+  def test_remote_decimation(self):
+    sock = "carState"
+    pm = messaging.PubMaster([sock,], remote={sock: 3}, remote_max_rate=0)
+    local_sock = messaging.sub_sock(sock, conflate=True, timeout=1000)
+    remote_sock = messaging.sub_sock(sock, timeout=1000, remote=True)
+    zmq_sleep()
+
+    # local subscribers still get every message
+    for i in range(30):
+      msg = random_bytes()
+      pm.send(sock, msg)
+      self.assertEqual(local_sock.receive(), msg)
+      if i % 3 == 0:
+        self.assertEqual(remote_sock.receive(), msg)
+    self.assertEqual(pm.remote_stats(), {sock: {"sent": 10, "decimated": 20, "coalesced": 0}})
+
+  def test_remote_coalescing(self):
+    sock = "carState"
+    rp = messaging.RemotePublisher(sock, max_rate=10)
+    remote_sock = messaging.sub_sock(sock, timeout=1000, remote=True)
+    zmq_sleep()
+
+    msgs = [random_bytes() for _ in range(3)]
+    rp.send(msgs[0], 1.0)
+    self.assertEqual(remote_sock.receive(), msgs[0])
+
+    # within 100 ms of the last send, the newest message waits in the slot
+    rp.send(msgs[1], 1.02)
+    rp.send(msgs[2], 1.05)
+    self.assertTrue(rp.flush(1.08))
+    self.assertFalse(rp.flush(1.1))
+    self.assertEqual(remote_sock.receive(), msgs[2])
+    self.assertEqual(rp.stats, {"sent": 2, "decimated": 0, "coalesced": 1})
+
+  def test_parse_remote_services(self):
+    self.assertEqual(messaging.parse_remote_services(""), {})
+    self.assertEqual(messaging.parse_remote_services("modelV2:2, carState"), {"modelV2": 2, "carState": 1})
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,131 @@
+"""End-to-end latency tracing through the message graph.
+
+With MESSAGING_TRACE=1 a SubMaster remembers when it received every message,
+and a publisher passes the trace of the input its output was computed from
+to PubMaster.send:
+
+  pm.send('lateralPlan', plan_send, trace=sm.trace_context('modelV2'))
+
+The published event then carries every hop of the chain in its trace field,
+the publish time (logMonoTime) of each message and when the next process
+received it. A sink splits the latency into processing and transport time
+per process:
+
+  modelRaw -> modelparsed -> modelV2 -> plannerd -> lateralPlan -> controlsd -> controlsState -> bridge_ws
+
+Messages from publishers that don't trace (modelparsed is C++) start a new
+chain, from the camera end of frame if the message has one on the same clock.
+All times are CLOCK_MONOTONIC nanoseconds, so only processes on one device can
+be compared. See selfdrive/debug/latency_trace.py for a live waterfall.
+"""
+import os
+from collections import deque
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+import capnp
+
+TRACE = os.environ.get("MESSAGING_TRACE", "0") == "1"
+# an end of frame further back than this is on another clock
+MAX_ORIGIN_AGE_NS = 1_000_000_000
+
+
+class Hop(NamedTuple):
+  service: str
+  pub: int   # logMonoTime
+  recv: int  # when the next process received it
+
+
+class TraceContext:
+  """Trace of a received message, including the hop that delivered it."""
+  __slots__ = ("frame_id", "origin", "hops")
+
+  def __init__(self, frame_id: int, origin: int, hops: List[Hop]):
+    self.frame_id = frame_id
+    self.origin = origin
+    self.hops = hops
+
+  @classmethod
+  def received(cls, evt, recv_ns: int) -> "TraceContext":
+    s = evt.which()
+    hop = Hop(s, evt.logMonoTime, recv_ns)
+    trace = evt.trace
+    if trace.originMonoTime != 0:
+      hops = [Hop(h.service, h.pubMonoTime, h.recvMonoTime) for h in trace.hops]
+      return cls(trace.frameId, trace.originMonoTime, hops + [hop])
+
+    # untraced publisher, the chain starts here
+    frame_id, origin = 0, evt.logMonoTime
+    fields = getattr(getattr(evt, s), "schema", None)
+    fields = fields.fields if fields is not None else {}
+    if "frameId" in fields:
+      frame_id = getattr(evt, s).frameId
+    if "timestampEof" in fields:
+      eof = getattr(evt, s).timestampEof
+      if 0 < evt.logMonoTime - eof < MAX_ORIGIN_AGE_NS:
+        origin = eof
+    return cls(frame_id, origin, [hop])
+
+  def write(self, dat: capnp.lib.capnp._DynamicStructBuilder) -> None:
+    """Set the trace field of an event that is about to be published."""
+    trace = dat.init("trace")
+    trace.frameId = self.frame_id
+    trace.originMonoTime = self.origin
+    hops = trace.init("hops", len(self.hops))
+    for h, hop in zip(hops, self.hops):
+      h.service = hop.service
+      h.pubMonoTime = hop.pub
+      h.recvMonoTime = hop.recv
+
+  def stages(self, end: int, end_name: str = "end") -> List[Tuple[str, float]]:
+    """Waterfall of (stage, ms) up to end: for every hop the publishing process'
+    time from receiving its input to publishing, then the transport to the next."""
+    ret = []
+    prev, prev_name = self.origin, "origin"
+    for hop in self.hops:
+      ret.append((f"{prev_name} -> {hop.service}", (hop.pub - prev) / 1e6))
+      ret.append((f"{hop.service} transport", (hop.recv - hop.pub) / 1e6))
+      prev, prev_name = hop.recv, hop.service
+    ret.append((f"{prev_name} -> {end_name}", (end - prev) / 1e6))
+    return ret
+
+  def latency(self, end: int) -> float:
+    return (end - self.origin) / 1e6
+
+
+class LatencyStats:
+  """Stage percentiles over the last history traces."""
+
+  def __init__(self, history: int = 1000):
+    self.history = history
+    self.samples: Dict[str, deque] = {}
+
+  def add(self, ctx: TraceContext, end: int, end_name: str = "end") -> None:
+    for stage, ms in ctx.stages(end, end_name) + [("total", ctx.latency(end))]:
+      if stage not in self.samples:
+        self.samples[stage] = deque(maxlen=self.history)
+      self.samples[stage].append(ms)
+
+  def percentiles(self, ps: Sequence[float] = (50, 90, 99)) -> Dict[str, List[float]]:
+    ret = {}
+    for stage, samples in self.samples.items():
+      s = sorted(samples)
+      ret[stage] = [s[min(len(s) - 1, int(len(s) * p / 100))] for p in ps]
+    return ret
+
+  def report(self, ps: Sequence[float] = (50, 90, 99)) -> str:
+    width = max([len(s) for s in self.samples] + [5])
+    lines = [f"{'stage':<{width}} " + " ".join(f"{'p' + format(p, 'g'):>8}" for p in ps) + "  (ms)"]
+    for stage, values in self.percentiles(ps).items():
+      lines.append(f"{stage:<{width}} " + " ".join(f"{v:8.2f}" for v in values))
+    return "\n".join(lines)
+
+
+def waterfall(stages: List[Tuple[str, float]], scale: float = 1.) -> str:
+  """One bar per stage, scale is ms per character."""
+  width = max(len(s) for s, _ in stages)
+  lines, t = [], 0.
+  for stage, ms in stages:
+    bar = " " * int(t / scale) + "#" * max(1, int(ms / scale))
+    lines.append(f"{stage:<{width}} {ms:7.2f} |{bar}")
+    t += max(ms, 0.)
+  return "\n".join(lines)
@@ -19,6 +19,8 @@ class Service:
     self.frequency = vals.get("expectedFreq", 0.0)
     self.decimation = vals.get("decimation", None)
     self.keep_last = vals.get("keepLast", True)
+    # published by Python processes, local Python subscribers may use shared memory
+    self.shm = vals.get("shm", False)
     
 with open(os.path.join(CEREAL_PATH, "resources/services.yaml"), 'r') as stream:
     services = yaml.safe_load(stream)["services"]
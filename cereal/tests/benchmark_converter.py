@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""Compare the schema-compiled converter against reflection based capnp_to_dict.
+
+  python cereal/tests/benchmark_converter.py [iterations]
+"""
+import sys
+import time
+
+from cereal.converter import capnp_to_dict, service_converter
+from cereal.tests.test_converter import model_event, new_event
+
+# (service, projection) pairs, the HUD mostly needs a few modelV2 columns
+CASES = [
+  ("modelV2", None),
+  ("modelV2", ["frameId", "laneLines[*].y", "laneLineProbs", "roadEdges[*].y"]),
+  ("carState", None),
+  ("controlsState", None),
+  ("deviceState", None),
+  ("liveLocationKalman", None),
+]
+
+
+def bench(fn, reader, n):
+  t = time.monotonic()
+  for _ in range(n):
+    fn(reader)
+  return (time.monotonic() - t) / n * 1e6
+
+
+if __name__ == "__main__":
+  n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+  print(f"{'service':<20} {'fields':<8} {'_convert us':>12} {'compiled us':>12} {'speedup':>8}")
+  for service, fields in CASES:
+    evt = model_event() if service == "modelV2" else new_event(service)
+    reader = getattr(evt.as_reader(), service)
+    conv = service_converter(service, fields)
+
+    t_ref = bench(capnp_to_dict, reader, n)
+    t_new = bench(conv, reader, n)
+    proj = "all" if fields is None else str(len(fields))
+    print(f"{service:<20} {proj:<8} {t_ref:>12.1f} {t_new:>12.1f} {t_ref / t_new:>7.1f}x")
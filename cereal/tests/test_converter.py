@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+import unittest
+from parameterized import parameterized
+
+from cereal import log
+from cereal.converter import build_converter, capnp_to_dict, parse_fields, service_converter
+
+services = list(log.Event.schema.union_fields)
+
+
+def new_event(service, size=3):
+  msg = log.Event.new_message()
+  try:
+    msg.init(service)
+  except Exception:
+    msg.init(service, size)
+  return msg
+
+
+def model_event():
+  msg = log.Event.new_message()
+  model = msg.init('modelV2')
+  model.frameId = 42
+  for name in ('position', 'orientation', 'velocity'):
+    xyzt = model.init(name)
+    xyzt.x = [float(i) for i in range(33)]
+    xyzt.y = [0.5] * 33
+  for i, line in enumerate(model.init('laneLines', 4)):
+    line.y = [float(i)] * 33
+    line.x = [1.0] * 33
+  model.laneLineProbs = [0.1, 0.9, 0.8, 0.2]
+  return msg
+
+
+class TestConverter(unittest.TestCase):
+
+  @parameterized.expand(services)
+  def test_matches_to_dict(self, service):
+    reader = getattr(new_event(service).as_reader(), service)
+    self.assertEqual(service_converter(service)(reader), capnp_to_dict(reader))
+
+  def test_populated_model(self):
+    reader = model_event().as_reader().modelV2
+    self.assertEqual(service_converter('modelV2')(reader), capnp_to_dict(reader))
+
+  def test_union(self):
+    msg = log.Event.new_message()
+    cs = msg.init('controlsState')
+    cs.lateralControlState.init('torqueState').output = 0.5
+    out = service_converter('controlsState')(msg.as_reader().controlsState)
+    self.assertEqual(list(out['lateralControlState'].keys()), ['torqueState'])
+    self.assertEqual(out['lateralControlState']['torqueState']['output'], 0.5)
+
+  def test_enum(self):
+    msg = log.Event.new_message()
+    msg.init('carState').gearShifter = 'drive'
+    self.assertEqual(service_converter('carState')(msg.as_reader().carState)['gearShifter'], 'drive')
+
+  def test_projection(self):
+    reader = model_event().as_reader().modelV2
+    out = service_converter('modelV2', ['frameId', 'laneLines[*].y', 'laneLineProbs'])(reader)
+    self.assertEqual(set(out.keys()), {'frameId', 'laneLines', 'laneLineProbs'})
+    self.assertEqual(len(out['laneLines']), 4)
+    for i, line in enumerate(out['laneLines']):
+      self.assertEqual(line, {'y': [float(i)] * 33})
+
+  def test_projection_whole_subtree(self):
+    reader = model_event().as_reader().modelV2
+    out = service_converter('modelV2', ['position', 'position.x'])(reader)
+    self.assertEqual(out['position'], capnp_to_dict(reader.position))
+
+  def test_parse_fields(self):
+    self.assertIsNone(parse_fields(None))
+    self.assertEqual(parse_fields(['a.b[*].c', 'a.d', 'e']), {'a': {'b': {'c': None}, 'd': None}, 'e': None})
+    self.assertEqual(parse_fields(['a.b.c', 'a.b']), {'a': {'b': None}})
+    self.assertEqual(parse_fields(['a', 'a.b']), {'a': None})
+
+  def test_invalid_fields(self):
+    with self.assertRaises(ValueError):
+      service_converter('modelV2', ['laneLines[*].nope'])
+    with self.assertRaises(ValueError):
+      service_converter('carState', ['vEgo.x'])
+    with self.assertRaises(ValueError):
+      service_converter('notAService')
+
+  def test_build_converter(self):
+    reader = model_event().as_reader().modelV2
+    conv = build_converter(log.ModelDataV2.schema, ['frameId'])
+    self.assertEqual(conv(reader), {'frameId': 42})
+
+
+if __name__ == "__main__":
+  unittest.main()
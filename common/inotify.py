@@ -0,0 +1,91 @@
+"""Minimal inotify(7) bindings through ctypes, Linux and Android only."""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+from typing import Dict, List, NamedTuple, Optional
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+_EVENT = struct.Struct("iIII")
+READ_SIZE = 64 * 1024
+
+
+class Event(NamedTuple):
+  path: Optional[str]  # the watched directory, None on IN_Q_OVERFLOW
+  name: str
+  mask: int
+
+
+def _libc():
+  libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+  libc.inotify_init1  # raises AttributeError without inotify
+  return libc
+
+
+class Inotify:
+  """Watches directories (not recursively). Raises OSError when inotify is not
+  available, callers are expected to fall back to polling."""
+  def __init__(self):
+    try:
+      self.libc = _libc()
+    except (OSError, AttributeError) as e:
+      raise OSError("inotify is not available") from e
+    self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if self.fd < 0:
+      raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+    self.paths: Dict[int, str] = {}
+    self.wds: Dict[str, int] = {}
+
+  def add_watch(self, path: str, mask: int) -> None:
+    wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+    if wd < 0:
+      err = ctypes.get_errno()
+      raise OSError(err, os.strerror(err), path)
+    self.paths[wd] = path
+    self.wds[path] = wd
+
+  def rm_watch(self, path: str) -> None:
+    wd = self.wds.pop(path, None)
+    if wd is not None:
+      self.paths.pop(wd, None)
+      self.libc.inotify_rm_watch(self.fd, wd)
+
+  def read(self, timeout: Optional[float] = None) -> List[Event]:
+    """Events that arrived within timeout seconds, [] on timeout"""
+    if not select.select([self.fd], [], [], timeout)[0]:
+      return []
+    try:
+      dat = os.read(self.fd, READ_SIZE)
+    except BlockingIOError:
+      return []
+
+    events = []
+    off = 0
+    while off < len(dat):
+      wd, mask, _, name_len = _EVENT.unpack_from(dat, off)
+      off += _EVENT.size
+      name = os.fsdecode(dat[off:off + name_len].rstrip(b"\0"))
+      off += name_len
+      if mask & IN_IGNORED:
+        # the watched directory is gone
+        path = self.paths.pop(wd, None)
+        if path is not None:
+          self.wds.pop(path, None)
+        continue
+      if mask & IN_Q_OVERFLOW:
+        events.append(Event(None, name, mask))
+      elif wd in self.paths:  # not from a removed watch
+        events.append(Event(self.paths[wd], name, mask))
+    return events
+
+  def close(self) -> None:
+    os.close(self.fd)
@@ -1,46 +1,216 @@
 # hard-forked from https://github.com/commaai/openpilot/tree/05b37552f3a38f914af41f44ccc7c633ad152a15/selfdrive/common/profiler.py
+import os
+import sys
+import threading
 import time
+from collections import Counter
+
+# values below 2**SUB_BITS ns are exact, larger ones are kept to ~1.5%
+SUB_BITS = 7
+HALF_SUB = 1 << (SUB_BITS - 1)
+MAX_VALUE_NS = (1 << 40) - 1  # ~18 min
+MAX_STACK_DEPTH = 32
+
+
+class Histogram():
+  """Log-linear (HDR style) histogram of durations in ns. Recording is an
+  integer bucket increment, so it is cheap enough to do on every iteration."""
+  def __init__(self):
+    self.counts = [0] * (HALF_SUB * (MAX_VALUE_NS.bit_length() - SUB_BITS + 2))
+    self.count = 0
+    self.total = 0
+    self.max = 0
+
+  @staticmethod
+  def _index(value):
+    shift = value.bit_length() - SUB_BITS
+    if shift <= 0:
+      return value
+    return HALF_SUB * shift + (value >> shift)
+
+  @staticmethod
+  def _value(idx):
+    shift = idx // HALF_SUB - 1
+    if shift <= 0:
+      return idx
+    # middle of the bucket
+    return ((idx - HALF_SUB * shift) << shift) + (1 << (shift - 1))
+
+  def record(self, value):
+    value = min(max(value, 0), MAX_VALUE_NS)
+    self.counts[self._index(value)] += 1
+    self.count += 1
+    self.total += value
+    self.max = max(self.max, value)
+
+  def percentile(self, p):
+    if self.count == 0:
+      return 0
+    rank = max(1, round(p / 100 * self.count))
+    seen = 0
+    for idx, n in enumerate(self.counts):
+      seen += n
+      if seen >= rank:
+        return min(self._value(idx), self.max)
+    return self.max
+
+  def mean(self):
+    return self.total / self.count if self.count else 0
+
 
 class Profiler():
-  def __init__(self, enabled=False):
-    self.enabled = enabled
-    self.cp = {}
-    self.cp_ignored = []
-    self.iter = 0
-    self.start_time = time.time()
-    self.last_time = self.start_time
-    self.tot = 0.
+  """Time the stages of a loop between checkpoint() calls, display() ends an
+  iteration.
+
+  By default a table of the totals is printed on every display(). With
+  continuous=True every stage and the iteration (excluding ignored stages)
+  go into histograms instead, which are sent to statsd every publish_interval
+  seconds as <name>.<stage>.p50_ms, p99_ms and max_ms gauges. With a
+  deadline in seconds, a background thread records the Python stack of the
+  profiled thread whenever an iteration runs longer than that, which is
+  logged with the stats. Loops that block on their input call start() once it
+  arrived, the deadline then runs from there instead of from display().
+  """
+  def __init__(self, enabled=False, continuous=False, name="profiler", publish_interval=10., deadline=None):
+    self.continuous = continuous
+    self.name = name
+    self.publish_interval_ns = int(publish_interval * 1e9)
+    self.deadline_ns = int(deadline * 1e9) if deadline is not None else None
+    self._watchdog = None
+    self.reset(enabled)
 
   def reset(self, enabled=False):
     self.enabled = enabled
     self.cp = {}
     self.cp_ignored = []
     self.iter = 0
-    self.start_time = time.time()
+    self.start_time = time.monotonic_ns()
     self.last_time = self.start_time
+    self.tot = 0
+    self._clear()
+
+    # the first deadline starts at start() or display()
+    self._iter_start = None
+    self._iter_tot = 0
+    self._last_cp = None
+    self._explicit_start = False
+    if enabled and self.deadline_ns is not None and self._watchdog is None:
+      self._thread_id = threading.get_ident()
+      self._watchdog = threading.Thread(target=self._watch, name=f"{self.name}_profiler", daemon=True)
+      self._watchdog.start()
+
+  def _clear(self):
+    self.hist = {}
+    self.iter_hist = Histogram()
+    self.overruns = 0
+    self.stacks = Counter()
+    self.last_publish = time.monotonic_ns()
 
   def checkpoint(self, name, ignore=False):
     # ignore flag needed when benchmarking threads with ratekeeper
     if not self.enabled:
       return
-    tt = time.time()
+    tt = time.monotonic_ns()
+    dt = tt - self.last_time
     if name not in self.cp:
-      self.cp[name] = 0.
+      self.cp[name] = 0
       if ignore:
         self.cp_ignored.append(name)
-    self.cp[name] += tt - self.last_time
+    self.cp[name] += dt
     if not ignore:
-      self.tot += tt - self.last_time
+      self.tot += dt
+    if self.continuous:
+      if name not in self.hist:
+        self.hist[name] = Histogram()
+      self.hist[name].record(dt)
     self.last_time = tt
+    self._last_cp = name
+
+  def start(self, wait=None):
+    """Starts the deadline of this iteration. The time since the last
+    checkpoint goes into the ignored stage wait, if given."""
+    if not self.enabled:
+      return
+    if wait is not None:
+      self.checkpoint(wait, ignore=True)
+    self._explicit_start = True
+    self._iter_start = time.monotonic_ns()
 
   def display(self):
     if not self.enabled:
       return
     self.iter += 1
+    if self.continuous:
+      self._end_iteration()
+      return
+
     print("******* Profiling %d *******" % self.iter)
-    for n, ms in sorted(self.cp.items(), key=lambda x: -x[1]):
+    for n, ns in sorted(self.cp.items(), key=lambda x: -x[1]):
+      ms = ns / 1e6
       if n in self.cp_ignored:
-        print("%30s: %9.2f  avg: %7.2f  percent: %3.0f   IGNORED" % (n, ms*1000.0, ms*1000.0/self.iter, ms/self.tot*100))
+        print("%30s: %9.2f  avg: %7.2f  percent: %3.0f   IGNORED" % (n, ms, ms/self.iter, ns/self.tot*100))
       else:
-        print("%30s: %9.2f  avg: %7.2f  percent: %3.0f" % (n, ms*1000.0, ms*1000.0/self.iter, ms/self.tot*100))
-    print(f"Iter clock: {self.tot / self.iter:2.6f}   TOTAL: {self.tot:2.2f}")
+        print("%30s: %9.2f  avg: %7.2f  percent: %3.0f" % (n, ms, ms/self.iter, ns/self.tot*100))
+    print(f"Iter clock: {self.tot / 1e9 / self.iter:2.6f}   TOTAL: {self.tot / 1e9:2.2f}")
+
+  def _end_iteration(self):
+    tt = time.monotonic_ns()
+    iter_time = self.tot - self._iter_tot
+    self._iter_tot = self.tot
+    self.iter_hist.record(iter_time)
+    if self.deadline_ns is not None and iter_time > self.deadline_ns:
+      self.overruns += 1
+    # without start() the next deadline runs from here
+    self._iter_start = None if self._explicit_start else tt
+    self._last_cp = None
+
+    if tt - self.last_publish >= self.publish_interval_ns:
+      self.publish()
+      self._clear()
+
+  def summary(self):
+    """{stage: {"count", "p50_ms", "p99_ms", "max_ms", "mean_ms"}} since the
+    last publish, the whole iteration is "iteration"."""
+    ret = {}
+    for n, h in (*self.hist.items(), ("iteration", self.iter_hist)):
+      ret[n] = {"count": h.count, "p50_ms": h.percentile(50) / 1e6, "p99_ms": h.percentile(99) / 1e6,
+                "max_ms": h.max / 1e6, "mean_ms": h.mean() / 1e6}
+    return ret
+
+  def publish(self):
+    from selfdrive.statsd import statlog
+    for n, stats in self.summary().items():
+      key = f"{self.name}.{n.lower().replace(' ', '_')}"
+      for k in ("p50_ms", "p99_ms", "max_ms"):
+        statlog.gauge(f"{key}.{k}", stats[k])
+    if self.deadline_ns is not None:
+      statlog.gauge(f"{self.name}.overruns", self.overruns)
+    if self.stacks:
+      from selfdrive.swaglog import cloudlog
+      cloudlog.event("profiler overrun stacks", name=self.name, stacks=dict(self.stacks.most_common(20)))
+
+  def _stack(self):
+    frame = sys._current_frames().get(self._thread_id)
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+      code = frame.f_code
+      names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+      frame = frame.f_back
+    # folded like flamegraph.pl input, outermost first, after the last stage it finished
+    return ";".join([f"after {self._last_cp or 'start'}", *reversed(names)])
+
+  def _watch(self):
+    while True:
+      it, start = self.iter, self._iter_start
+      if start is None:
+        # waiting for the input of the next iteration
+        time.sleep(self.deadline_ns / 1e9)
+        continue
+      wait = start + self.deadline_ns - time.monotonic_ns()
+      if wait > 0:
+        time.sleep(wait / 1e9)
+        continue
+      if self.enabled and self.iter == it and self._iter_start == start:
+        self.stacks[self._stack()] += 1
+      # sample again every deadline while this iteration is still running
+      time.sleep(self.deadline_ns / 1e9)
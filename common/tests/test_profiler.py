@@ -0,0 +1,104 @@
+import random
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from common.profiler import Histogram, Profiler
+
+
+class TestHistogram(unittest.TestCase):
+  def test_percentiles(self):
+    random.seed(0)
+    values = [random.randint(0, 50_000_000) for _ in range(10000)] + [2, 100, 2**45]
+    h = Histogram()
+    for v in values:
+      h.record(v)
+    self.assertEqual(h.count, len(values))
+    self.assertEqual(h.max, (1 << 40) - 1)
+    for p in (1, 50, 99):
+      expected = np.percentile(values, p)
+      self.assertLess(abs(h.percentile(p) - expected), 0.02 * expected)
+
+  def test_small_values_exact(self):
+    h = Histogram()
+    for v in range(128):
+      h.record(v)
+    self.assertEqual(h.percentile(50), 63)
+    self.assertEqual(h.percentile(100), 127)
+    self.assertEqual(Histogram().percentile(50), 0)
+
+
+class TestProfiler(unittest.TestCase):
+  def test_disabled(self):
+    prof = Profiler(False, continuous=True, deadline=0.01)
+    prof.checkpoint("a")
+    prof.display()
+    self.assertEqual(prof.cp, {})
+    self.assertIsNone(prof._watchdog)
+
+  def test_continuous(self):
+    prof = Profiler(True, continuous=True, name="test", publish_interval=1000.)
+    for _ in range(20):
+      prof.checkpoint("wait", ignore=True)
+      time.sleep(0.001)
+      prof.checkpoint("work")
+      prof.display()
+    summary = prof.summary()
+    self.assertEqual(set(summary), {"wait", "work", "iteration"})
+    self.assertEqual(summary["work"]["count"], 20)
+    self.assertGreater(summary["work"]["p50_ms"], 0.9)
+    # ignored stages are not part of the iteration
+    self.assertAlmostEqual(summary["iteration"]["p50_ms"], summary["work"]["p50_ms"], delta=0.05)
+
+  def test_publish(self):
+    prof = Profiler(True, continuous=True, name="test", publish_interval=0.)
+    with mock.patch("selfdrive.statsd.statlog") as statlog:
+      prof.checkpoint("Sample")
+      prof.display()
+    names = [c.args[0] for c in statlog.gauge.call_args_list]
+    self.assertIn("test.sample.p99_ms", names)
+    self.assertIn("test.iteration.max_ms", names)
+    # histograms start over after publishing
+    self.assertEqual(prof.summary()["iteration"]["count"], 0)
+
+  def test_overrun_stacks(self):
+    prof = Profiler(True, continuous=True, name="test", publish_interval=1000., deadline=0.005)
+    prof.checkpoint("fast")
+    prof.display()
+    prof.checkpoint("fast")
+    time.sleep(0.05)
+    prof.checkpoint("slow")
+    prof.display()
+
+    self.assertEqual(prof.overruns, 1)
+    self.assertTrue(prof.stacks)
+    stack = prof.stacks.most_common(1)[0][0]
+    self.assertTrue(stack.startswith("after fast;"))
+    self.assertIn("test_profiler.py:test_overrun_stacks", stack)
+
+  def test_wait_not_overrun(self):
+    prof = Profiler(True, continuous=True, name="test", publish_interval=1000., deadline=0.01)
+    for _ in range(3):
+      prof.checkpoint("Ratekeeper", ignore=True)
+      time.sleep(0.03)  # blocked on the input
+      prof.start("wait")
+      prof.checkpoint("work")
+      prof.display()
+    self.assertEqual(prof.overruns, 0)
+    self.assertFalse(prof.stacks)
+    self.assertGreater(prof.summary()["wait"]["p50_ms"], 25)
+
+    # the deadline still applies after start()
+    time.sleep(0.03)
+    prof.start("wait")
+    time.sleep(0.03)
+    prof.checkpoint("work")
+    prof.display()
+    self.assertEqual(prof.overruns, 1)
+    self.assertTrue(prof.stacks)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -61,6 +61,7 @@ private:
 
   const DBC *dbc = NULL;
   std::unordered_map<uint32_t, MessageState> message_states;
+  std::vector<uint8_t> frame_buf;
 
 public:
   bool can_valid = false;
@@ -71,17 +72,23 @@ public:
   uint64_t bus_timeout_threshold = 0;
   uint64_t can_invalid_cnt = CAN_INVALID_CNT;
 
+  // frames on our bus, and the ones among them that matched a tracked address
+  uint64_t frames_received = 0;
+  uint64_t frames_parsed = 0;
+
   CANParser(int abus, const std::string& dbc_name,
             const std::vector<MessageParseOptions> &options,
             const std::vector<SignalParseOptions> &sigoptions);
   CANParser(int abus, const std::string& dbc_name, bool ignore_checksum, bool ignore_counter);
   #ifndef DYNAMIC_CAPNP
   void update_string(const std::string &data, bool sendcan);
+  void update_strings(const std::vector<std::string> &data, std::vector<SignalValue> &vals, bool sendcan);
   void UpdateCans(uint64_t sec, const capnp::List<CanData>::Reader& cans);
   #endif
   void UpdateCans(uint64_t sec, const capnp::DynamicStruct::Reader& cans);
   void UpdateValid(uint64_t sec);
   std::vector<SignalValue> query_latest();
+  void query_latest(std::vector<SignalValue> &vals, uint64_t last_ts);
 };
 
 class CANPacker {
@@ -76,8 +76,11 @@ cdef extern from "common.h":
   cdef cppclass CANParser:
     bool can_valid
     bool bus_timeout
+    uint64_t frames_received
+    uint64_t frames_parsed
     CANParser(int, string, vector[MessageParseOptions], vector[SignalParseOptions])
     void update_string(string, bool)
+    void update_strings(vector[string]&, vector[SignalValue]&, bool)
     vector[SignalValue] query_latest()
 
   cdef cppclass CANPacker:
@@ -205,6 +205,21 @@ void CANParser::update_string(const std::string &data, bool sendcan) {
   UpdateValid(last_sec);
 }
 
+void CANParser::update_strings(const std::vector<std::string> &data, std::vector<SignalValue> &vals, bool sendcan) {
+  vals.clear();
+  if (data.empty()) return;
+
+  // every state seen since the start of the batch was updated by it
+  uint64_t batch_start_sec = 0;
+  for (const auto &d : data) {
+    update_string(d, sendcan);
+    if (batch_start_sec == 0) {
+      batch_start_sec = last_sec;
+    }
+  }
+  query_latest(vals, batch_start_sec);
+}
+
 void CANParser::UpdateCans(uint64_t sec, const capnp::List<CanData>::Reader& cans) {
   //DEBUG("got %d messages\n", cans.size());
 
@@ -218,6 +233,7 @@ void CANParser::UpdateCans(uint64_t sec, const capnp::List<CanData>::Reader& can
       continue;
     }
     bus_empty = false;
+    frames_received++;
 
     auto state_it = message_states.find(cmsg.getAddress());
     if (state_it == message_states.end()) {
@@ -238,9 +254,10 @@ void CANParser::UpdateCans(uint64_t sec, const capnp::List<CanData>::Reader& can
     //  continue;
     //}
 
-    std::vector<uint8_t> data(dat.size(), 0);
-    memcpy(data.data(), dat.begin(), dat.size());
-    state_it->second.parse(sec, data);
+    // reuse one buffer instead of allocating per frame
+    frame_buf.assign(dat.begin(), dat.end());
+    state_it->second.parse(sec, frame_buf);
+    frames_parsed++;
   }
 
   // update bus timeout
@@ -323,3 +340,22 @@ std::vector<SignalValue> CANParser::query_latest() {
 
   return ret;
 }
+
+// values of the messages seen at or after last_ts, everything if last_ts is 0
+void CANParser::query_latest(std::vector<SignalValue> &vals, uint64_t last_ts) {
+  for (auto& kv : message_states) {
+    auto& state = kv.second;
+    if (last_ts != 0 && state.last_seen_nanos < last_ts) continue;
+
+    for (int i = 0; i < state.parse_sigs.size(); i++) {
+      const Signal &sig = state.parse_sigs[i];
+      vals.push_back((SignalValue){
+        .address = state.address,
+        .name = sig.name,
+        .value = state.vals[i],
+        .all_values = state.all_vals[i],
+      });
+      state.all_vals[i].clear();
+    }
+  }
+}
@@ -12,6 +12,7 @@ from .common cimport CANParser as cpp_CANParser
 from .common cimport SignalParseOptions, MessageParseOptions, dbc_lookup, SignalValue, DBC
 
 import os
+import time
 import numbers
 from collections import defaultdict
 
@@ -28,6 +29,12 @@ cdef class CANParser:
     dict vl_all
     string dbc_name
 
+    # stats of the last update_strings call
+    uint64_t last_update_ns  # whole call, including filling vl
+    uint64_t last_parse_ns  # decoding and parsing in C++
+    uint64_t last_frames  # CAN frames on our bus
+    uint64_t last_frames_parsed  # frames with a tracked address
+
   def __init__(self, dbc_name, signals, checks=None, bus=0, enforce_checks=True):
     if checks is None:
       checks = []
@@ -97,13 +104,13 @@ cdef class CANParser:
       message_options_v.push_back(mpo)
 
     self.can = new cpp_CANParser(bus, dbc_name, message_options_v, signal_options_v)
+    self.can_values = self.can.query_latest()
     self.update_vl()
 
   cdef unordered_set[uint32_t] update_vl(self):
     cdef unordered_set[uint32_t] updated_addrs
 
-    new_vals = self.can.query_latest()
-    for cv in new_vals:
+    for cv in self.can_values:
       # Cast char * directly to unicode
       cv_name = <unicode>cv.name
       self.vl[cv.address][cv_name] = cv.value
@@ -117,16 +124,31 @@ cdef class CANParser:
       v.clear()
 
     self.can.update_string(dat, sendcan)
+    self.can_values = self.can.query_latest()
     return self.update_vl()
 
   def update_strings(self, strings, sendcan=False):
+    """Parse a list of raw can/sendcan events, as returned by drain_sock_raw.
+
+    All events are decoded in one call and vl is only filled once, with the
+    values of every message seen in the batch."""
+    cdef vector[string] data
+    cdef uint64_t frames_received = self.can.frames_received
+    cdef uint64_t frames_parsed = self.can.frames_parsed
+
+    t_start = time.perf_counter_ns()
     for v in self.vl_all.values():
       v.clear()
 
-    updated_addrs = set()
-    for s in strings:
-      self.can.update_string(s, sendcan)
-      updated_addrs.update(self.update_vl())
+    data = strings
+    self.can.update_strings(data, self.can_values, sendcan)
+    t_parsed = time.perf_counter_ns()
+    updated_addrs = self.update_vl()
+
+    self.last_update_ns = time.perf_counter_ns() - t_start
+    self.last_parse_ns = t_parsed - t_start
+    self.last_frames = self.can.frames_received - frames_received
+    self.last_frames_parsed = self.can.frames_parsed - frames_parsed
     return updated_addrs
 
   @property
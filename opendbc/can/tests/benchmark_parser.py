@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Per-call cost of CANParser.update_strings on a Prius powertrain stream.
+
+boardd publishes one can event every 10 ms and controlsd drains one to three
+of them per loop, BRAKE_MODULE alone is sent at 167 Hz. The batched
+update_strings is compared with parsing the drained strings one at a time.
+
+  python opendbc/can/tests/benchmark_parser.py [seconds]
+"""
+import random
+import statistics
+import sys
+import time
+
+from opendbc.can.parser import CANParser
+from opendbc.can.packer import CANPacker
+from opendbc.can.tests.test_packer_parser import can_list_to_can_capnp
+
+DBC = "toyota_prius_2010_pt"
+
+# message: Hz, tracked messages first
+RATES = {
+  "BRAKE_MODULE": 167,
+  "WHEEL_SPEEDS": 80,
+  "STEER_ANGLE_SENSOR": 80,
+  "STEER_TORQUE_SENSOR": 50,
+  "GAS_PEDAL": 33,
+  "PCM_CRUISE": 33,
+  "GEAR_PACKET": 1,
+  "KINEMATICS": 100,
+  "BRAKE": 100,
+  "POWERTRAIN": 100,
+  "SPEED": 50,
+}
+
+PARSERS = {
+  "BRAKE_MODULE": ([("BRAKE_PRESSED", "BRAKE_MODULE"), ("BRAKE_PRESSURE", "BRAKE_MODULE")],
+                   [("BRAKE_MODULE", 40)]),
+  "carstate": ([("BRAKE_PRESSED", "BRAKE_MODULE"), ("BRAKE_PRESSURE", "BRAKE_MODULE"),
+                ("WHEEL_SPEED_FL", "WHEEL_SPEEDS"), ("WHEEL_SPEED_FR", "WHEEL_SPEEDS"),
+                ("WHEEL_SPEED_RL", "WHEEL_SPEEDS"), ("WHEEL_SPEED_RR", "WHEEL_SPEEDS"),
+                ("STEER_ANGLE", "STEER_ANGLE_SENSOR"), ("STEER_RATE", "STEER_ANGLE_SENSOR"),
+                ("STEER_TORQUE_DRIVER", "STEER_TORQUE_SENSOR"), ("STEER_TORQUE_EPS", "STEER_TORQUE_SENSOR"),
+                ("GAS_PEDAL", "GAS_PEDAL"), ("CRUISE_STATE", "PCM_CRUISE"), ("GEAR", "GEAR_PACKET")],
+               [("BRAKE_MODULE", 40), ("WHEEL_SPEEDS", 80), ("STEER_ANGLE_SENSOR", 80),
+                ("STEER_TORQUE_SENSOR", 50), ("GAS_PEDAL", 33), ("PCM_CRUISE", 33), ("GEAR_PACKET", 1)]),
+}
+
+
+def can_stream(seconds):
+  """One can event per 10 ms, grouped into the batches controlsd would drain."""
+  rnd = random.Random(0)
+  packer = CANPacker(DBC)
+  next_t = {m: 0. for m in RATES}
+  strings = []
+  for i in range(int(seconds * 100)):
+    t = (i + 1) * 0.01
+    msgs = []
+    for m, hz in RATES.items():
+      while next_t[m] <= t:
+        next_t[m] += 1. / hz
+        msgs.append(packer.make_can_msg(m, 0, {}))
+    strings.append(can_list_to_can_capnp(msgs, logMonoTime=int(t * 1e9)))
+
+  batches = []
+  while strings:
+    n = rnd.choice((1, 1, 1, 2, 3))
+    batches.append(strings[:n])
+    strings = strings[n:]
+  return batches
+
+
+def per_string(parser, strings):
+  for v in parser.vl_all.values():
+    v.clear()
+  updated = set()
+  for s in strings:
+    updated |= parser.update_string(s)
+  return updated
+
+
+def percentile(xs, p):
+  return sorted(xs)[int(len(xs) * p / 100)]
+
+
+if __name__ == "__main__":
+  seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 60.
+  batches = can_stream(seconds)
+  print(f"{len(batches)} batches, {sum(len(b) for b in batches)} can events")
+  print(f"{'parser':<14} {'per string us':>14} {'batched us':>11} {'p99 us':>8} {'parse us':>9} "
+        f"{'frames':>7} {'parsed':>7}")
+
+  for name, (signals, checks) in PARSERS.items():
+    single = CANParser(DBC, signals, checks, 0)
+    batched = CANParser(DBC, signals, checks, 0)
+
+    t = time.perf_counter_ns()
+    for b in batches:
+      per_string(single, b)
+    t_single = (time.perf_counter_ns() - t) / len(batches) / 1e3
+
+    total, parse, frames, parsed = [], [], 0, 0
+    for b in batches:
+      batched.update_strings(b)
+      total.append(batched.last_update_ns / 1e3)
+      parse.append(batched.last_parse_ns / 1e3)
+      frames += batched.last_frames
+      parsed += batched.last_frames_parsed
+
+    print(f"{name:<14} {t_single:>14.1f} {statistics.mean(total):>11.1f} {percentile(total, 99):>8.1f} "
+          f"{statistics.mean(parse):>9.1f} {frames / len(batches):>7.1f} {parsed / len(batches):>7.1f}")
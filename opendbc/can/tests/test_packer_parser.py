@@ -12,7 +12,7 @@ TEST_DBC = os.path.abspath(os.path.join(os.path.dirname(__file__), "test.dbc"))
 
 
 # Python implementation so we don't have to depend on boardd
-def can_list_to_can_capnp(can_msgs, msgtype='can'):
+def can_list_to_can_capnp(can_msgs, msgtype='can', logMonoTime=None):
   dat = log.Event.new_message()
   dat.init(msgtype, len(can_msgs))
 
@@ -281,5 +281,53 @@ class TestCanParserPacker(unittest.TestCase):
       if len(user_brake_vals):
         self.assertEqual(vl_all[-1], parser.vl["VSA_STATUS"]["USER_BRAKE"])
 
+  def test_update_strings_batch(self):
+    """A batch gives the same result as parsing its strings one by one"""
+    dbc_file = "toyota_prius_2010_pt"
+
+    signals = [("BRAKE_PRESSED", "BRAKE_MODULE"), ("BRAKE_PRESSURE", "BRAKE_MODULE"), ("GAS_PEDAL", "GAS_PEDAL")]
+    checks = [("BRAKE_MODULE", 40), ("GAS_PEDAL", 33)]
+
+    batched = CANParser(dbc_file, signals, checks, 0)
+    single = CANParser(dbc_file, signals, checks, 0)
+    packer = CANPacker(dbc_file)
+
+    t = 0
+    for _ in range(50):
+      can_strings = []
+      tracked = 0
+      for _ in range(random.randrange(1, 5)):
+        t += int(0.006 * 1e9)
+        msgs = [packer.make_can_msg("BRAKE_MODULE", 0, {"BRAKE_PRESSURE": random.randrange(512)})]
+        if random.random() < 0.3:
+          msgs.append(packer.make_can_msg("GAS_PEDAL", 0, {"GAS_PEDAL": random.randrange(100) / 200}))
+        tracked += len(msgs)
+        # untracked address and a frame on another bus
+        msgs.append((0x3ff, 0, b"\x00" * 8, 0))
+        msgs.append(packer.make_can_msg("BRAKE_MODULE", 1, {}))
+        can_strings.append(can_list_to_can_capnp(msgs, logMonoTime=t))
+
+      updated = set()
+      vl_all = {"BRAKE_MODULE": [], "GAS_PEDAL": []}
+      for s in can_strings:
+        updated |= single.update_string(s)
+        vl_all["BRAKE_MODULE"] += single.vl_all["BRAKE_MODULE"]["BRAKE_PRESSURE"]
+        vl_all["GAS_PEDAL"] += single.vl_all["GAS_PEDAL"]["GAS_PEDAL"]
+
+      self.assertEqual(batched.update_strings(can_strings), updated)
+      self.assertEqual(batched.vl, single.vl)
+      self.assertEqual(batched.vl_all["BRAKE_MODULE"]["BRAKE_PRESSURE"], vl_all["BRAKE_MODULE"])
+      self.assertEqual(batched.vl_all["GAS_PEDAL"]["GAS_PEDAL"], vl_all["GAS_PEDAL"])
+      self.assertEqual(batched.can_valid, single.can_valid)
+
+      self.assertEqual(batched.last_frames_parsed, tracked)
+      self.assertEqual(batched.last_frames, tracked + len(can_strings))
+      self.assertGreater(batched.last_update_ns, 0)
+      self.assertGreaterEqual(batched.last_update_ns, batched.last_parse_ns)
+
+    self.assertEqual(batched.update_strings([]), set())
+    self.assertEqual(batched.last_frames, 0)
+
+
 if __name__ == "__main__":
   unittest.main()
@@ -35,6 +35,7 @@ LANE_DEPARTURE_THRESHOLD = 0.1
 REPLAY = "REPLAY" in os.environ
 SIMULATION = "SIMULATION" in os.environ
 NOSENSOR = "NOSENSOR" in os.environ
+PROFILE = "PROFILE_CONTROLSD" in os.environ
 IGNORE_PROCESSES = {"loggerd", "logmessaged", "gradled", "uploader", "deleter", "proclogd"} # TODO
 
 ThermalStatus = log.DeviceState.ThermalStatus
@@ -188,7 +189,8 @@ class Controls:
 
     # controlsd is driven by can recv, expected at 100Hz
     self.rk = Ratekeeper(100, print_delay_threshold=None)
-    self.prof = Profiler(False)  # off by default
+    # off by default, PROFILE_CONTROLSD sends stage timings to statsd and logs the stacks of late iterations
+    self.prof = Profiler(PROFILE, continuous=True, name="controlsd", deadline=DT_CTRL)
 
   def update_events(self, CS):
     """Compute carEvents from carState"""
@@ -386,6 +388,7 @@ class Controls:
 
     # Update carState from CAN
     can_strs = messaging.drain_sock_raw(self.can_sock, wait_for_one=True)
+    self.prof.start("CAN wait")
     CS = self.CI.update(self.CC, can_strs)
 
     self.sm.update(0)
@@ -741,7 +744,7 @@ class Controls:
     elif lat_tuning == 'indi':
       controlsState.lateralControlState.indiState = lac_log
 
-    self.pm.send('controlsState', dat)
+    self.pm.send('controlsState', dat, trace=self.sm.trace_context('lateralPlan'))
 
     # carState
     car_events = self.events.to_msg()
@@ -768,7 +771,7 @@ class Controls:
     cc_send = messaging.new_message('carControl')
     cc_send.valid = CS.canValid
     cc_send.carControl = CC
-    self.pm.send('carControl', cc_send)
+    self.pm.send('carControl', cc_send, trace=self.sm.trace_context('lateralPlan'))
 
     # copy CarControl to pass to CarInterface on the next iteration
     self.CC = CC
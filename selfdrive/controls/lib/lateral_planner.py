@@ -121,4 +121,4 @@ class LateralPlanner:
     lateralPlan.laneChangeState = self.DH.lane_change_state
     lateralPlan.laneChangeDirection = self.DH.lane_change_direction
 
-    pm.send('lateralPlan', plan_send)
+    pm.send('lateralPlan', plan_send, trace=sm.trace_context('modelV2'))
@@ -130,4 +130,4 @@ class LongitudinalPlanner:
 
     longitudinalPlan.solverExecutionTime = self.mpc.solve_time
 
-    pm.send('longitudinalPlan', plan_send)
+    pm.send('longitudinalPlan', plan_send, trace=sm.trace_context('modelV2'))
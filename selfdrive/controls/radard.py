@@ -193,7 +193,7 @@ def radard_thread(sm=None, pm=None, can_sock=None):
   if can_sock is None:
     can_sock = messaging.sub_sock('can')
   if sm is None:
-    sm = messaging.SubMaster(['modelV2', 'carState'], ignore_avg_freq=['modelV2', 'carState'])  # Can't check average frequency, since radar determines timing
+    sm = messaging.SubMaster(['modelV2', 'carState'], ignore_avg_freq=['modelV2', 'carState'], lazy=True)  # Can't check average frequency, since radar determines timing
   if pm is None:
     pm = messaging.PubMaster(['radarState', 'liveTracks'])
 
@@ -214,7 +214,7 @@ def radard_thread(sm=None, pm=None, can_sock=None):
     dat = RD.update(sm, rr)
     dat.radarState.cumLagMs = -rk.remaining*1000.
 
-    pm.send('radarState', dat)
+    pm.send('radarState', dat, trace=sm.trace_context('modelV2'))
 
     # *** publish tracks for UI debugging (keep last) ***
     tracks = RD.tracks
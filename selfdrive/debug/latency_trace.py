@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Live latency waterfall of the model -> plan -> controls chain.
+
+Run on the device, with the processes started with MESSAGING_TRACE=1:
+
+  python selfdrive/debug/latency_trace.py [--sink controlsState] [--report 10]
+
+modelparsed doesn't trace, modelRaw is matched to the chain by frame id and
+its time to modelV2 includes the transport to modelparsed.
+"""
+import argparse
+import time
+
+import cereal.messaging as messaging
+from cereal.messaging.trace import Hop, LatencyStats, TraceContext, waterfall
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--sink", default="controlsState", help="traced service to follow")
+  parser.add_argument("--report", type=float, default=10., help="seconds between percentile reports")
+  parser.add_argument("--scale", type=float, default=1., help="ms per waterfall character")
+  args = parser.parse_args()
+
+  sm = messaging.SubMaster([args.sink, "modelRaw"], poll=[args.sink])
+  sm.trace = True
+  stats = LatencyStats()
+  model_raw = {}  # frameId -> logMonoTime
+  last_origin = None
+  next_report = time.monotonic() + args.report
+
+  while True:
+    sm.update()
+    if sm.updated["modelRaw"]:
+      model_raw[sm["modelRaw"].frameId] = sm.logMonoTime["modelRaw"]
+      for frame_id in [f for f in model_raw if f < sm["modelRaw"].frameId - 100]:
+        del model_raw[frame_id]
+
+    if not sm.updated[args.sink]:
+      continue
+
+    ctx = sm.trace_context(args.sink)
+    if ctx is None or len(ctx.hops) < 2:
+      continue
+    if ctx.frame_id in model_raw:
+      raw_pub = model_raw[ctx.frame_id]
+      ctx = TraceContext(ctx.frame_id, ctx.origin, [Hop("modelRaw", raw_pub, raw_pub)] + ctx.hops)
+
+    end = int(sm.rcv_time[args.sink] * 1e9)
+    stats.add(ctx, end)
+    # the sink repeats a trace until its input updates, draw each chain once
+    if ctx.origin != last_origin:
+      last_origin = ctx.origin
+      print(f"\nframe {ctx.frame_id}: {ctx.latency(end):.2f} ms")
+      print(waterfall(ctx.stages(end), args.scale))
+
+    if time.monotonic() >= next_report:
+      next_report = time.monotonic() + args.report
+      print("\n" + stats.report())
+
+
+if __name__ == "__main__":
+  main()
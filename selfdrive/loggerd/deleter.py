@@ -1,43 +1,200 @@
 #!/usr/bin/env python3
 import os
+import queue
 import shutil
 import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+from common.inotify import Inotify, IN_CLOSE_WRITE, IN_CREATE, IN_DELETE, IN_MOVED_FROM, IN_MOVED_TO, IN_Q_OVERFLOW
 from selfdrive.swaglog import cloudlog
-from selfdrive.loggerd.config import ROOT, get_available_bytes, get_available_percent
-from selfdrive.loggerd.uploader import listdir_by_creation
+from selfdrive.loggerd.config import ROOT
+from selfdrive.loggerd.uploader import get_directory_sort
 
+# deleting starts below either minimum and frees space up to the high watermark
 MIN_BYTES = 2 * 1024 * 1024 * 1024
 MIN_PERCENT = 7
+HIGH_BYTES = 3 * 1024 * 1024 * 1024
+HIGH_PERCENT = 10
 
 DELETE_LAST = ['boot', 'crash']
 
+# the free space is checked on every change in ROOT, and at least this often
+CHECK_INTERVAL = 30.
+ROOT_EVENTS = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+SEGMENT_EVENTS = ROOT_EVENTS | IN_CLOSE_WRITE
+
+
+def bytes_to_reclaim(root: str) -> int:
+  """Bytes to delete to get back to the high watermark, 0 if above both minimums"""
+  try:
+    st = os.statvfs(root)
+  except OSError:
+    return 0
+  available = st.f_bavail * st.f_frsize
+  total = st.f_blocks * st.f_frsize
+  if available >= MIN_BYTES and (total == 0 or 100. * available / total >= MIN_PERCENT):
+    return 0
+  return max(int(max(HIGH_BYTES, total * HIGH_PERCENT / 100.) - available), 1)
+
+
+class SegmentIndex:
+  """The entries of ROOT with their size and lock files, kept up to date from
+  inotify events. Without inotify the index is rescanned before every use.
+  Paths in deleting are left out until they are gone."""
+  def __init__(self, root: str, deleting: Optional[Set[str]] = None):
+    self.root = root
+    self.deleting = deleting if deleting is not None else set()
+    self.sizes: Dict[str, int] = {}
+    self.locks: Dict[str, Set[str]] = {}
+    try:
+      self.inotify: Optional[Inotify] = Inotify()
+      self.inotify.add_watch(root, ROOT_EVENTS)
+    except OSError:
+      cloudlog.warning("deleter: inotify not available, rescanning instead")
+      self.inotify = None
+    self.scan()
+
+  def scan(self) -> None:
+    names = set(os.listdir(self.root))
+    for name in list(self.sizes):
+      if name not in names:
+        self.remove(name)
+    for name in names:
+      self.scan_entry(name)
+
+  def scan_entry(self, name: str) -> None:
+    path = os.path.join(self.root, name)
+    if path in self.deleting:
+      self.remove(name)
+      return
+    try:
+      if not os.path.isdir(path):
+        self.sizes[name] = os.path.getsize(path)
+        self.locks[name] = set()
+        return
+      if self.inotify is not None and path not in self.inotify.wds:
+        self.inotify.add_watch(path, SEGMENT_EVENTS)
+      size, locks = 0, set()
+      with os.scandir(path) as it:
+        for entry in it:
+          if entry.name.endswith(".lock"):
+            locks.add(entry.name)
+          elif entry.is_file(follow_symlinks=False):
+            size += entry.stat(follow_symlinks=False).st_size
+      self.sizes[name], self.locks[name] = size, locks
+    except OSError:
+      self.remove(name)
+
+  def remove(self, name: str) -> None:
+    self.sizes.pop(name, None)
+    self.locks.pop(name, None)
+    if self.inotify is not None:
+      self.inotify.rm_watch(os.path.join(self.root, name))
+
+  def update(self, timeout: float) -> bool:
+    """Apply the changes of the next timeout seconds, True if there were any"""
+    if self.inotify is None:
+      return False
+
+    events = self.inotify.read(timeout)
+    dirty = set()
+    for evt in events:
+      if evt.mask & IN_Q_OVERFLOW:
+        self.scan()
+        return True
+      # an entry of ROOT changed, or a file in one of them
+      dirty.add(evt.name if evt.path == self.root else os.path.basename(evt.path))
+    for name in dirty:
+      if os.path.lexists(os.path.join(self.root, name)):
+        self.scan_entry(name)
+      else:
+        self.remove(name)
+    return bool(events)
+
+  def pick(self, nbytes: int) -> List[Tuple[str, int]]:
+    """Oldest unlocked entries of at least nbytes in total, DELETE_LAST last"""
+    if self.inotify is None:
+      self.scan()
+    ret = []
+    for name in sorted(self.sizes, key=lambda d: (d in DELETE_LAST, get_directory_sort(d))):
+      if nbytes <= 0:
+        break
+      path = os.path.join(self.root, name)
+      if path in self.deleting:
+        continue
+      # the index may lag a lock taken just now
+      if self.locks[name] or (os.path.isdir(path) and any(f.endswith(".lock") for f in os.listdir(path))):
+        continue
+      ret.append((name, self.sizes[name]))
+      nbytes -= self.sizes[name]
+    return ret
+
+
+class DeleteWorker:
+  """Deletes in a background thread, pending_bytes will be freed once it's done.
+  deleting holds the paths queued or being deleted."""
+  def __init__(self):
+    self.queue: queue.Queue = queue.Queue()
+    self.pending_bytes = 0
+    self.deleting: Set[str] = set()
+    self.lock = threading.Lock()
+    self.thread = threading.Thread(target=self._run, daemon=True)
+    self.thread.start()
+
+  def delete(self, path: str, size: int) -> None:
+    with self.lock:
+      self.pending_bytes += size
+      self.deleting.add(path)
+    self.queue.put((path, size))
+
+  def stop(self) -> None:
+    self.queue.put(None)
+    self.thread.join()
+
+  def _run(self) -> None:
+    while True:
+      item = self.queue.get()
+      if item is None:
+        return
+      path, size = item
+      try:
+        cloudlog.info(f"deleting {path}")
+        if os.path.isdir(path):
+          shutil.rmtree(path)
+        else:
+          os.remove(path)
+      except OSError:
+        cloudlog.exception(f"issue deleting {path}")
+      finally:
+        with self.lock:
+          self.pending_bytes -= size
+          self.deleting.discard(path)
+
 
 def deleter_thread(exit_event):
-  while not exit_event.is_set():
-    out_of_bytes = get_available_bytes(default=MIN_BYTES + 1) < MIN_BYTES
-    out_of_percent = get_available_percent(default=MIN_PERCENT + 1) < MIN_PERCENT
-
-    if out_of_percent or out_of_bytes:
-      # remove the earliest directory we can
-      dirs = sorted(listdir_by_creation(ROOT), key=lambda x: x in DELETE_LAST)
-      for delete_dir in dirs:
-        delete_path = os.path.join(ROOT, delete_dir)
-
-        if any(name.endswith(".lock") for name in os.listdir(delete_path)):
-          continue
-
-        try:
-          cloudlog.info(f"deleting {delete_path}")
-          if os.path.isfile(delete_path):
-            os.remove(delete_path)
-          else:
-            shutil.rmtree(delete_path)
+  worker = DeleteWorker()
+  index = SegmentIndex(ROOT, worker.deleting)
+  try:
+    while not exit_event.is_set():
+      reclaim = bytes_to_reclaim(ROOT) - worker.pending_bytes
+      if reclaim > 0:
+        for name, size in index.pick(reclaim):
+          index.remove(name)
+          worker.delete(os.path.join(ROOT, name), size)
+
+      # wait for a change in ROOT, checking for exit every second
+      waited = 0.
+      timeout = 1. if worker.pending_bytes or reclaim > 0 else CHECK_INTERVAL
+      while not exit_event.is_set() and waited < timeout:
+        if index.update(min(1., timeout - waited)):
           break
-        except OSError:
-          cloudlog.exception(f"issue deleting {delete_path}")
-      exit_event.wait(.1)
-    else:
-      exit_event.wait(30)
+        if index.inotify is None:
+          exit_event.wait(min(1., timeout - waited))
+        waited += 1.
+  finally:
+    worker.stop()
+    if index.inotify is not None:
+      index.inotify.close()
 
 
 def main():
@@ -31,8 +31,9 @@ class MockResponse():
     self.status_code = status_code
 
 class MockApi():
-  def __init__(self, dongle_id):
-    pass
+  def __init__(self, dongle_id=None):
+    self.user_id = "0000000000000000"
+    self.dongle_id = "0000000000000000"
 
   def get(self, *args, **kwargs):
     return MockResponse('{"url": "http://localhost/does/not/exist", "headers": {}}', 200)
@@ -40,16 +41,13 @@ class MockApi():
   def get_token(self):
     return "fake-token"
 
-class MockApiIgnore():
-  def __init__(self, dongle_id):
-    pass
+  def get_credentials(self):
+    return {"access_key": "testing", "secret_access_key": "testing", "session_token": "testing"}
 
+class MockApiIgnore(MockApi):
   def get(self, *args, **kwargs):
     return MockResponse('', 412)
 
-  def get_token(self):
-    return "fake-token"
-
 class MockParams():
   def __init__(self):
     self.params = {
@@ -14,14 +14,22 @@ Stats = namedtuple("Stats", ['f_bavail', 'f_blocks', 'f_frsize'])
 
 class TestDeleter(UploaderTestCase):
   def fake_statvfs(self, d):
+    if self.free_after is not None and not os.path.exists(self.free_after):
+      return self.fake_stats_after
     return self.fake_stats
 
   def setUp(self):
     self.f_type = "fcamera.hevc"
     super().setUp()
     self.fake_stats = Stats(f_bavail=0, f_blocks=10, f_frsize=4096)
+    self.free_after = None
     deleter.os.statvfs = self.fake_statvfs
     deleter.ROOT = self.root
+    self.high_bytes = deleter.HIGH_BYTES
+
+  def tearDown(self):
+    deleter.HIGH_BYTES = self.high_bytes
+    super().tearDown()
 
   def start_thread(self):
     self.end_event = threading.Event()
@@ -52,6 +60,12 @@ class TestDeleter(UploaderTestCase):
     self.seg_dir = self.seg_format.format(self.seg_num)
     f_path_2 = self.make_file_with_data(self.seg_dir, self.f_type)
 
+    # one byte short of the high watermark until the older file is gone
+    deleter.HIGH_BYTES = deleter.MIN_BYTES
+    self.fake_stats = Stats(f_bavail=deleter.MIN_BYTES - 1, f_blocks=deleter.MIN_BYTES * 2, f_frsize=1)
+    self.fake_stats_after = Stats(f_bavail=deleter.MIN_BYTES * 2, f_blocks=deleter.MIN_BYTES * 2, f_frsize=1)
+    self.free_after = f_path_1
+
     self.start_thread()
 
     with Timeout(5, "Timeout waiting for file to be deleted"):
@@ -100,6 +114,50 @@ class TestDeleter(UploaderTestCase):
 
     self.assertTrue(os.path.exists(f_path), "File deleted when locked")
 
+  def test_index(self):
+    index = deleter.SegmentIndex(self.root)
+    if index.inotify is None:
+      self.skipTest("inotify not available")
+
+    f_path_1 = self.make_file_with_data(self.seg_dir, self.f_type, 1, lock=True)
+    self.seg_num += 1
+    self.seg_dir = self.seg_format.format(self.seg_num)
+    f_path_2 = self.make_file_with_data(self.seg_dir, self.f_type, 1)
+    self.make_file_with_data("boot", "bootlog", 1)
+    while index.update(0.1):
+      pass
+
+    seg_1, seg_2 = os.path.basename(os.path.dirname(f_path_1)), os.path.basename(os.path.dirname(f_path_2))
+    self.assertEqual(index.sizes[seg_2], 1024 * 1024)
+    self.assertEqual(index.locks[seg_1], {self.f_type + ".lock"})
+    # locked segments are skipped, boot and crash logs go last
+    self.assertEqual([name for name, _ in index.pick(1)], [seg_2])
+    self.assertEqual([name for name, _ in index.pick(2 * 1024 * 1024)], [seg_2, "boot"])
+
+    os.remove(f_path_1 + ".lock")
+    while index.update(0.1):
+      pass
+    self.assertEqual([name for name, _ in index.pick(1)], [seg_1])
+    index.inotify.close()
+
+  def test_index_skips_deleting(self):
+    f_path = self.make_file_with_data(self.seg_dir, self.f_type)
+    seg_path = os.path.dirname(f_path)
+
+    # still queued or being deleted by the worker
+    deleting = {seg_path}
+    index = deleter.SegmentIndex(self.root, deleting)
+    self.assertNotIn(self.seg_dir, index.sizes)
+    self.assertEqual(index.pick(1), [])
+    if index.inotify is not None:
+      index.inotify.close()
+
+    worker = deleter.DeleteWorker()
+    worker.delete(seg_path, 100)
+    worker.stop()
+    self.assertFalse(os.path.exists(seg_path))
+    self.assertEqual(worker.deleting, set())
+    self.assertEqual(worker.pending_bytes, 0)
 
 if __name__ == "__main__":
   unittest.main()
@@ -1,12 +1,20 @@
 #!/usr/bin/env python3
+import bz2
+import io
 import os
 import time
 import threading
 import unittest
 import logging
 import json
+from unittest import mock
 
-from system.swaglog import cloudlog
+import boto3
+from boto3.s3.transfer import TransferConfig
+from moto import mock_s3
+
+from cereal import log
+from selfdrive.swaglog import cloudlog
 import selfdrive.loggerd.uploader as uploader
 
 from selfdrive.loggerd.tests.loggerd_tests_common import UploaderTestCase
@@ -86,6 +94,7 @@ class TestUploader(UploaderTestCase):
 
     self.assertTrue(log_handler.upload_order == exp_order, "Files uploaded in wrong order")
 
+  @unittest.skip("uploads go straight to S3 with the STS credentials, there is no upload url request to answer 412")
   def test_upload_ignored(self):
     self.set_ignore()
     self.gen_files(lock=False)
@@ -144,6 +153,19 @@ class TestUploader(UploaderTestCase):
       uploaded = uploader.UPLOAD_ATTR_NAME in os.listxattr(f_path.replace('.bz2', ''))
       self.assertFalse(uploaded, "File upload when locked")
 
+  def test_upload_when_unlocked(self):
+    self.start_thread()
+    time.sleep(0.25)
+    f_paths = self.gen_files(lock=True, boot=False)
+    time.sleep(1)
+    # loggerd moved on to the next segment
+    for f_path in f_paths:
+      os.remove(f_path + ".lock")
+    time.sleep(2)
+    self.join_thread()
+
+    self.assertEqual(log_handler.upload_order, self.gen_order([self.seg_num], [], boot=False))
+
   def test_clear_locks_on_startup(self):
     f_paths = self.gen_files(lock=True, boot=False)
     self.start_thread()
@@ -154,5 +176,74 @@ class TestUploader(UploaderTestCase):
       self.assertFalse(os.path.isfile(f_path + ".lock"), "File lock not cleared on startup")
 
 
+class TestUploadIndex(UploaderTestCase):
+  def test_updates(self):
+    up = uploader.Uploader("0000000000000000", self.root)
+    if up.index.inotify is None:
+      self.skipTest("inotify not available")
+    self.assertIsNone(up.next_file_to_upload())
+
+    qlog = self.make_file_with_data(self.seg_dir, "qlog", lock=True)
+    up.index.update(0.1)
+    self.assertIsNone(up.next_file_to_upload(), "Locked log indexed")
+
+    os.remove(qlog + ".lock")
+    up.index.update(0.1)
+    self.assertEqual(up.next_file_to_upload(), ("qlog", os.path.join(self.seg_dir, "qlog"), qlog))
+    self.assertEqual(up.immediate_count, 1)
+
+    self.assertTrue(up.upload("qlog", os.path.join(self.seg_dir, "qlog.bz2"), qlog, log.DeviceState.NetworkType.wifi, False))
+    self.assertIsNone(up.next_file_to_upload())
+    up.index.close()
+
+  def test_compressed_reader(self):
+    dat = os.urandom(100_000) * 50
+    reader = uploader.CompressedReader(io.BytesIO(dat), frame_size=1_000_000)
+    compressed = b"".join(iter(lambda: reader.read(12345), b""))
+    self.assertEqual(compressed, uploader.compress_frames(dat, frame_size=1_000_000))
+    self.assertEqual(bz2.decompress(compressed), dat)
+
+
+@mock_s3
+class TestMultipartUpload(UploaderTestCase):
+  def setUp(self):
+    super().setUp()
+    uploader.fake_upload = False
+    self.s3 = boto3.client("s3", region_name="us-east-1")
+    self.s3.create_bucket(Bucket=uploader.UPLOAD_BUCKET)
+
+  def tearDown(self):
+    uploader.fake_upload = True
+    super().tearDown()
+
+  def get_object(self, key):
+    return self.s3.get_object(Bucket=uploader.UPLOAD_BUCKET, Key=f"unprocessed/0000000000000000/0000000000000000/{key}")
+
+  def test_multipart_upload(self):
+    for fn, key in (("rlog", "rlog.bz2"), ("fcamera.hevc", "fcamera.hevc")):
+      with self.subTest(key=key):
+        f_path = self.make_file_with_data(self.seg_dir, fn, 2.5 * uploader.UPLOAD_PART_SIZE / 1024 / 1024)
+        up = uploader.Uploader("0000000000000000", self.root)
+        self.assertTrue(up.upload(fn, f"{self.seg_dir}/{key}", f_path, log.DeviceState.NetworkType.wifi, False))
+        up.index.close()
+
+        obj = self.get_object(f"{self.seg_dir}/{key}")
+        if not key.endswith(".bz2"):
+          self.assertTrue(obj["ETag"].endswith('-3"'), "Not uploaded in parts")
+        with open(f_path, "rb") as f:
+          dat = f.read()
+        body = obj["Body"].read()
+        self.assertEqual(bz2.decompress(body) if key.endswith(".bz2") else body, dat)
+
+  def test_bandwidth_limit(self):
+    f_path = self.make_file_with_data(self.seg_dir, "fcamera.hevc")
+    up = uploader.Uploader("0000000000000000", self.root)
+    for network_type, bandwidth in uploader.UPLOAD_BANDWIDTH.items():
+      with mock.patch.object(uploader, "TransferConfig", wraps=TransferConfig) as config:
+        self.assertTrue(up.upload("fcamera.hevc", f"{self.seg_dir}/fcamera.hevc", f_path, network_type, False))
+      self.assertEqual(config.call_args.kwargs["max_bandwidth"], bandwidth)
+    up.index.close()
+
+
 if __name__ == "__main__":
   unittest.main()
@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 import bz2
-import io
 import os
 import argparse
 import random
@@ -9,10 +8,13 @@ import time
 import traceback
 import boto3
 import logging
+from typing import Dict, List, Optional, Tuple
+from boto3.s3.transfer import TransferConfig
 
 from cereal import log
 import cereal.messaging as messaging
 from common.api import Api
+from common.inotify import Inotify, IN_CLOSE_WRITE, IN_CREATE, IN_DELETE, IN_MOVED_FROM, IN_MOVED_TO, IN_Q_OVERFLOW
 from common.params import Params
 from common.realtime import set_core_affinity
 from selfdrive.loggerd.xattr_cache import getxattr, setxattr
@@ -27,10 +29,34 @@ UPLOAD_ATTR_NAME = 'user.upload'
 UPLOAD_ATTR_VALUE = b'1'
 
 UPLOAD_QLOG_QCAM_MAX_SIZE = 100 * 1e6  # MB
+# logs are compressed as independent bz2 streams of this size, so readers can
+# seek to a frame without decompressing what's before (tools/lib/logreader.py LogIndex)
+BZ2_FRAME_SIZE = 4 * 900_000
+
+# files above UPLOAD_PART_SIZE are sent as a multipart upload, UPLOAD_CONCURRENCY parts at a time
+UPLOAD_PART_SIZE = 8 * 1024 * 1024
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOADER_CONCURRENCY", "4"))
+UPLOAD_BUCKET = "fdusermedia"
+# bytes/s, None is unlimited
+UPLOAD_BANDWIDTH = {
+  NetworkType.none: 250_000,
+  NetworkType.wifi: None,
+  NetworkType.cell2G: 25_000,
+  NetworkType.cell3G: 250_000,
+  NetworkType.cell4G: 1_000_000,
+  NetworkType.cell5G: 2_000_000,
+  NetworkType.ethernet: None,
+}
+
+# ROOT is watched for new and removed logs, the logs for new, removed and unlocked files
+ROOT_EVENTS = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+LOG_EVENTS = ROOT_EVENTS | IN_CLOSE_WRITE
 
 allow_sleep = bool(os.getenv("UPLOADER_SLEEP", "1"))
 force_wifi = os.getenv("FORCEWIFI") is not None
 fake_upload = os.getenv("FAKEUPLOAD") is not None
+# e.g. a local minio
+s3_endpoint = os.getenv("UPLOADER_S3_ENDPOINT")
 
 
 def get_directory_sort(d):
@@ -46,6 +72,30 @@ def listdir_by_creation(d):
     logger.warning("listdir_by_creation failed")
     return list()
 
+def compress_frames(dat, frame_size=BZ2_FRAME_SIZE):
+  return b"".join(bz2.compress(dat[i:i + frame_size]) for i in range(0, len(dat), frame_size))
+
+class CompressedReader():
+  """Reads f compressed as compress_frames(f.read()) would, one frame at a time"""
+  def __init__(self, f, frame_size=BZ2_FRAME_SIZE):
+    self.f = f
+    self.frame_size = frame_size
+    self.buf = bytearray()
+    self.eof = False
+
+  def read(self, size=-1):
+    while not self.eof and (size < 0 or len(self.buf) < size):
+      dat = self.f.read(self.frame_size)
+      if dat:
+        self.buf += bz2.compress(dat)
+      else:
+        self.eof = True
+    if size < 0:
+      size = len(self.buf)
+    ret = bytes(self.buf[:size])
+    del self.buf[:size]
+    return ret
+
 def clear_locks(root):
   for logname in os.listdir(root):
     path = os.path.join(root, logname)
@@ -61,6 +111,118 @@ class FakeResponse():
         def __init__(self):
           self.status_code = 200
 
+class UploadIndex():
+  """Files not uploaded yet, by log. ROOT and the upload xattrs are read once,
+  then only the logs inotify reports changes in are read again, e.g. when
+  loggerd removes the lock of a finished segment. Without inotify everything is
+  read again on every update()."""
+  def __init__(self, root, sort_key):
+    self.root = root
+    self.sort_key = sort_key
+    # unlocked logs: [(name, size)] in upload order
+    self.pending: Dict[str, List[Tuple[str, int]]] = {}
+    self._order: Optional[List[str]] = None
+    try:
+      self.inotify: Optional[Inotify] = Inotify()
+      self.inotify.add_watch(root, ROOT_EVENTS)
+    except OSError:
+      cloudlog.warning("uploader: inotify not available, rescanning instead")
+      self.inotify = None
+    self.scan()
+
+  def lognames(self):
+    """The unlocked logs, oldest first"""
+    if self._order is None:
+      self._order = sorted(self.pending, key=get_directory_sort)
+    return self._order
+
+  def scan(self):
+    try:
+      lognames = set(os.listdir(self.root))
+    except OSError:
+      cloudlog.exception("uploader: listing root failed")
+      lognames = set()
+    for logname in list(self.pending):
+      if logname not in lognames:
+        self.remove(logname)
+    for logname in lognames:
+      self.scan_log(logname)
+
+  def scan_log(self, logname):
+    path = os.path.join(self.root, logname)
+    if self.inotify is not None and path not in self.inotify.wds:
+      try:
+        self.inotify.add_watch(path, LOG_EVENTS)
+      except OSError:
+        pass  # not a directory, or already deleted
+    try:
+      names = os.listdir(path)
+    except OSError:
+      self.remove(logname)
+      return
+
+    # locked logs are still being written
+    if any(name.endswith(".lock") for name in names):
+      if self.pending.pop(logname, None) is not None:
+        self._order = None
+      return
+
+    files = []
+    for name in sorted(names, key=self.sort_key):
+      # log indexes are rebuilt wherever the log is read
+      if name.endswith(".idx"):
+        continue
+      fn = os.path.join(path, name)
+      # skip files already uploaded
+      try:
+        if getxattr(fn, UPLOAD_ATTR_NAME):
+          continue
+        files.append((name, os.path.getsize(fn)))
+      except OSError:
+        cloudlog.event("uploader_getxattr_failed", key=os.path.join(logname, name), fn=fn)  # deleter could have deleted
+    if logname not in self.pending:
+      self._order = None
+    self.pending[logname] = files
+
+  def remove(self, logname):
+    if self.pending.pop(logname, None) is not None:
+      self._order = None
+    if self.inotify is not None:
+      self.inotify.rm_watch(os.path.join(self.root, logname))
+
+  def done(self, fn):
+    """fn was uploaded"""
+    logname, name = os.path.basename(os.path.dirname(fn)), os.path.basename(fn)
+    if logname in self.pending:
+      self.pending[logname] = [f for f in self.pending[logname] if f[0] != name]
+
+  def update(self, timeout=0.):
+    """Waits up to timeout seconds for changes, True if there were any"""
+    if self.inotify is None:
+      if timeout > 0:
+        time.sleep(timeout)
+      self.scan()
+      return True
+
+    events = self.inotify.read(timeout)
+    dirty = set()
+    for evt in events:
+      if evt.mask & IN_Q_OVERFLOW:
+        self.scan()
+        return True
+      # a log was created or removed, or a file in one of them changed
+      dirty.add(evt.name if evt.path == self.root else os.path.basename(evt.path))
+    for logname in dirty:
+      if os.path.lexists(os.path.join(self.root, logname)):
+        self.scan_log(logname)
+      else:
+        self.remove(logname)
+    return bool(events)
+
+  def close(self):
+    if self.inotify is not None:
+      self.inotify.close()
+
 class Uploader():
   def __init__(self, dongle_id, root):
     self.dongle_id = dongle_id
@@ -85,48 +247,24 @@ class Uploader():
     self.immediate_folders = ["crash/", "boot/"]
     self.immediate_priority = {"qlog": 0, "qlog.bz2": 0, "fcam.mp4": 0, "ecam.mp4": 0}
 
+    self.index = UploadIndex(root, self.get_upload_sort)
+
   def get_upload_sort(self, name):
     if name in self.immediate_priority:
       return self.immediate_priority[name]
     return 1000
 
   def list_upload_files(self):
-    if not os.path.isdir(self.root):
-      return
-
     self.immediate_size = 0
     self.immediate_count = 0
 
-    for logname in listdir_by_creation(self.root):
-      path = os.path.join(self.root, logname)
-      try:
-        names = os.listdir(path)
-      except OSError:
-        continue
+    for logname in self.index.lognames():
+      for name, size in self.index.pending[logname]:
+        if name in self.immediate_priority:
+          self.immediate_count += 1
+          self.immediate_size += size
 
-      if any(name.endswith(".lock") for name in names):
-        continue
-
-      for name in sorted(names, key=self.get_upload_sort):
-        key = os.path.join(logname, name)
-        fn = os.path.join(path, name)
-        # skip files already uploaded
-        try:
-          is_uploaded = getxattr(fn, UPLOAD_ATTR_NAME)
-        except OSError:
-          cloudlog.event("uploader_getxattr_failed", exc=self.last_exc, key=key, fn=fn)
-          is_uploaded = True  # deleter could have deleted
-        if is_uploaded:
-          continue
-
-        try:
-          if name in self.immediate_priority:
-            self.immediate_count += 1
-            self.immediate_size += os.path.getsize(fn)
-        except OSError:
-          pass
-        
-        yield (name, key, fn)
+        yield (name, os.path.join(logname, name), os.path.join(self.root, logname, name))
 
   def next_file_to_upload(self):
     upload_files = list(self.list_upload_files())
@@ -141,7 +279,7 @@ class Uploader():
 
     return None
 
-  def do_upload(self, key, fn):
+  def do_upload(self, key, fn, network_type=NetworkType.wifi):
     try:
       if self.credentials is None:
         self.credentials = self.api.get_credentials()
@@ -156,6 +294,7 @@ class Uploader():
             aws_access_key_id=access_key,
             aws_secret_access_key=secret_access_key,
             aws_session_token=session_token,
+            endpoint_url=s3_endpoint,
         )
 
       if fake_upload:
@@ -165,8 +304,8 @@ class Uploader():
       else:
         with open(fn, "rb") as f:
           if key.endswith('.bz2') and not fn.endswith('.bz2'):
-            data = bz2.compress(f.read())
-            data = io.BytesIO(data)
+            # compressed while uploading, parts are sent as they fill up
+            data = CompressedReader(f)
           else:
             data = f
 
@@ -175,22 +314,23 @@ class Uploader():
 
           # api.get_credentials should populate api.email field, saving us a DB call
           object_name = f"unprocessed/{user_id_san}/{dongle_id_san}/{key}"
-          bucket = "fdusermedia"
+          config = TransferConfig(multipart_threshold=UPLOAD_PART_SIZE, multipart_chunksize=UPLOAD_PART_SIZE,
+                                  max_concurrency=UPLOAD_CONCURRENCY, max_bandwidth=UPLOAD_BANDWIDTH.get(network_type))
 
           self.last_resp = FakeResponse()
-          self.s3.upload_fileobj(data, bucket, object_name)
+          self.s3.upload_fileobj(data, UPLOAD_BUCKET, object_name, Config=config)
 
     except Exception as e:
       self.last_exc = (e, traceback.format_exc())
       logger.debug(e)
       raise e
 
-  def normal_upload(self, key, fn):
+  def normal_upload(self, key, fn, network_type=NetworkType.wifi):
     self.last_resp = None
     self.last_exc = None
 
     try:
-      self.do_upload(key, fn)
+      self.do_upload(key, fn, network_type)
       logger.debug(f"S3 event successful for {key}")
     except Exception as e:
       logger.warning(f"S3 event failed for {key}: {e}")
@@ -215,7 +355,7 @@ class Uploader():
       success = True
     else:
       start_time = time.monotonic()
-      stat = self.normal_upload(key, fn)
+      stat = self.normal_upload(key, fn, network_type)
       if stat is not None and stat.status_code in (200, 201, 401, 403, 412):
         self.last_filename = fn
         self.last_time = time.monotonic() - start_time
@@ -234,6 +374,7 @@ class Uploader():
       except OSError:
         logger.warning(f"Successfully set attr on {key}")
         cloudlog.event("uploader_setxattr_failed", exc=self.last_exc, key=key, fn=fn, sz=sz)
+      self.index.done(fn)
 
     return success
 
@@ -269,7 +410,13 @@ def uploader_fn(exit_event):
   uploader = Uploader(dongle_id, ROOT)
 
   backoff = 0.1
+  offroad = True
+  idle = False
   while not exit_event.is_set():
+    # waits for new or finished logs when there was nothing to upload
+    uploader.index.update((60 if offroad else 5) if idle and allow_sleep else 0)
+    idle = False
+
     sm.update(0)
     offroad = params.get_bool("IsOffroad")
     
@@ -280,8 +427,7 @@ def uploader_fn(exit_event):
    
     d = uploader.next_file_to_upload()
     if d is None:  # Nothing to upload
-      if allow_sleep:
-        time.sleep(60 if offroad else 5)
+      idle = True
       continue
 
     name, key, fn = d
@@ -302,6 +448,8 @@ def uploader_fn(exit_event):
 
     pm.send("uploaderState", uploader.get_msg())
 
+  uploader.index.close()
+
 
 def main():
   parser = argparse.ArgumentParser(prog='Flowpilot uploader')
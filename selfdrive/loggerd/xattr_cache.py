@@ -1,22 +1,31 @@
 import os
 import errno
-from typing import Dict, Tuple, Optional
+from collections import OrderedDict
+from typing import Tuple, Optional
 
-_cached_attributes: Dict[Tuple, Optional[bytes]] = {}
+# least recently used attributes are evicted past this many
+MAX_CACHED_ATTRIBUTES = 4096
+
+_cached_attributes: "OrderedDict[Tuple, Optional[bytes]]" = OrderedDict()
 
 def getxattr(path: str, attr_name: str) -> Optional[bytes]:
   key = (path, attr_name)
-  if key not in _cached_attributes:
-    try:
-      response = os.getxattr(path, attr_name)
-    except OSError as e:
-      # ENODATA means attribute hasn't been set
-      if e.errno == errno.ENODATA:
-        response = None
-      else:
-        raise
-    _cached_attributes[key] = response
-  return _cached_attributes[key]
+  if key in _cached_attributes:
+    _cached_attributes.move_to_end(key)
+    return _cached_attributes[key]
+
+  try:
+    response = os.getxattr(path, attr_name)
+  except OSError as e:
+    # ENODATA means attribute hasn't been set
+    if e.errno == errno.ENODATA:
+      response = None
+    else:
+      raise
+  _cached_attributes[key] = response
+  if len(_cached_attributes) > MAX_CACHED_ATTRIBUTES:
+    _cached_attributes.popitem(last=False)
+  return response
 
 def setxattr(path: str, attr_name: str, attr_value: bytes) -> None:
   _cached_attributes.pop((path, attr_name), None)
@@ -33,7 +33,7 @@ POSSIBLE_PNAME_MATRIX = [
 ANDROID_APP = "ai.flow.app"
 ENV_VARS = ["USE_GPU", "ZMQ_MESSAGING_PROTOCOL", "ZMQ_MESSAGING_ADDRESS",
             "SIMULATION", "FINGERPRINT", "MSGQ", "PASSIVE", "DISCOVERABLE_PUBLISHERS",
-            "DEVICE_ADDR"]
+            "DEVICE_ADDR", "SHM_TRANSPORT", "MESSAGING_TRACE"]
 UNREGISTERED_DONGLE_ID = "UnregisteredDevice"
 
 params = Params()
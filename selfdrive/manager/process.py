@@ -86,24 +86,6 @@ class ManagerProcess:
         self.phandler = None
         self.proc = None
 
-    def get_proc_msg(self):
-        """Packages a Capn'Proto message for proc logs"""
-        proc_msg = log.ProcLog.Process.new_message()
-        if self.is_alive():
-            proc_msg.pid=self.pid
-            proc_msg.name=self.name
-            proc_msg.state=self.phandler.status()
-            proc_msg.nice=self.phandler.nice()
-            proc_msg.numThreads=self.phandler.num_threads()
-            proc_msg.startTime=self.phandler.create_time()
-            proc_msg.processor=self.phandler.cpu_affinity()
-            proc_msg.cpuPercent=self.phandler.cpu_percent()
-            proc_msg.cpuTimes=self.phandler.cpu_times().user
-            proc_msg.memoryUsage=self.phandler.memory_percent()
-            proc_msg.cmdline=self.phandler.cmdline()
-            proc_msg.exe=self.phandler.exe()
-        return proc_msg
-
     def get_process_state_msg(self):
         state = log.ManagerState.ProcessState.new_message()
         state.name = self.name
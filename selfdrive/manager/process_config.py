@@ -28,7 +28,7 @@ procs = [
   ManagerProcess("radard", "radard"),
   ManagerProcess("calibrationd", "calibrationd"),
   ManagerProcess("modelparsed", "./selfdrive/modeld/modelparsed", enabled=is_f3()),
-  ManagerProcess("proclogd", "./system/proclogd/proclogd"),
+  ManagerProcess("proclogd", "proclogd"),
   ManagerProcess("logmessaged", "logmessaged", offroad=True),
   ManagerProcess("thermald_", "thermald_", offroad=True),
   ManagerProcess("statsd", "statsd", offroad=True, enabled=False),
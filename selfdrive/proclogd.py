@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""Resource usage of the managed processes, published on procLog at 2 Hz.
+
+The pids come from managerState, plus the flowpilot app. The /proc/<pid>/stat
+and status files of a process are kept open while its pid lives. cpuPercent,
+the context switches and the major faults are deltas since the previous
+sample, cpuTimes and mem are system wide like before.
+"""
+import os
+import time
+from typing import Dict, List, Optional
+
+import cereal.messaging as messaging
+from cereal import log
+from common.params import Params
+from common.realtime import Ratekeeper
+from system.hardware.hw_stats import SysFile
+
+PROCLOG_FREQ = 2.
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+MEM_FIELDS = {"total": "MemTotal", "free": "MemFree", "available": "MemAvailable", "buffers": "Buffers",
+              "cached": "Cached", "active": "Active", "inactive": "Inactive", "shared": "Shmem"}
+
+
+def parse_stat(dat: str) -> List[str]:
+  """Fields of /proc/<pid>/stat from the state on, field n of proc(5) is at n - 3"""
+  # the command name can contain spaces and parentheses
+  return dat[dat.rindex(")") + 2:].split()
+
+
+def parse_status(dat: str) -> Dict[str, str]:
+  ret = {}
+  for line in dat.splitlines():
+    key, _, value = line.partition(":")
+    ret[key] = value.strip()
+  return ret
+
+
+class TrackedProcess:
+  def __init__(self, name: str, pid: int, proc: str = "/proc"):
+    self.name = name
+    self.pid = pid
+    path = os.path.join(proc, str(pid))
+    self.stat = SysFile(os.path.join(path, "stat"))
+    self.status = SysFile(os.path.join(path, "status"), 8192)
+    try:
+      with open(os.path.join(path, "cmdline"), "rb") as f:
+        self.cmdline = [arg.decode(errors="replace") for arg in f.read().split(b"\0") if arg]
+      self.exe = os.readlink(os.path.join(path, "exe"))
+    except OSError:
+      self.cmdline, self.exe = [], ""
+    self.prev: Optional[tuple] = None
+
+  def close(self) -> None:
+    self.stat.close()
+    self.status.close()
+
+  def sample(self, proc_msg, t: float) -> None:
+    """Fill a ProcLog.Process, raises OSError if the process is gone"""
+    stat = parse_stat(self.stat.read())
+    status = parse_status(self.status.read())
+
+    cpu_ticks = int(stat[11]) + int(stat[12])
+    counters = (int(status.get("voluntary_ctxt_switches", 0)), int(status.get("nonvoluntary_ctxt_switches", 0)), int(stat[9]))
+    if self.prev is not None:
+      prev_t, prev_ticks, prev_counters = self.prev
+      proc_msg.cpuPercent = 100. * (cpu_ticks - prev_ticks) / CLK_TCK / max(t - prev_t, 1e-3)
+      proc_msg.ctxSwitchesVoluntary, proc_msg.ctxSwitchesInvoluntary, proc_msg.majorFaults = \
+        (max(c - p, 0) for c, p in zip(counters, prev_counters))
+    self.prev = (t, cpu_ticks, counters)
+
+    proc_msg.pid = self.pid
+    proc_msg.name = self.name
+    proc_msg.state = ord(stat[0][0])
+    proc_msg.ppid = int(stat[1])
+    proc_msg.cpuUser = int(stat[11]) / CLK_TCK
+    proc_msg.cpuSystem = int(stat[12]) / CLK_TCK
+    proc_msg.cpuChildrenUser = int(stat[13]) / CLK_TCK
+    proc_msg.cpuChildrenSystem = int(stat[14]) / CLK_TCK
+    proc_msg.priority = int(stat[15])
+    proc_msg.nice = int(stat[16])
+    proc_msg.numThreads = int(stat[17])
+    proc_msg.startTime = int(stat[19]) / CLK_TCK
+    proc_msg.memVms = int(stat[20])
+    proc_msg.memRss = int(stat[21]) * PAGE_SIZE
+    proc_msg.processor = int(stat[36])
+    proc_msg.cmdline = self.cmdline
+    proc_msg.exe = self.exe
+
+
+class ProcLogger:
+  def __init__(self, proc: str = "/proc"):
+    self.proc = proc
+    self.tracked: Dict[str, TrackedProcess] = {}
+    self.stat = SysFile(os.path.join(proc, "stat"), 256 * ((os.cpu_count() or 1) + 2))
+    self.meminfo = SysFile(os.path.join(proc, "meminfo"))
+
+  def set_pids(self, pids: Dict[str, int]) -> None:
+    for name, p in list(self.tracked.items()):
+      if pids.get(name) != p.pid:
+        p.close()
+        del self.tracked[name]
+    for name, pid in pids.items():
+      if name not in self.tracked:
+        try:
+          self.tracked[name] = TrackedProcess(name, pid, self.proc)
+        except OSError:
+          pass
+
+  def update(self, proc_log, t: float) -> None:
+    procs = []
+    for name, p in list(self.tracked.items()):
+      proc_msg = log.ProcLog.Process.new_message()
+      try:
+        p.sample(proc_msg, t)
+        procs.append(proc_msg)
+      except (OSError, ValueError, IndexError):
+        # exited, dropped until the manager reports a new pid
+        p.close()
+        del self.tracked[name]
+    proc_log.procs = procs
+
+    cpu_lines = [line.split() for line in self.stat.read().splitlines()[1:]]
+    cpu_lines = [line for line in cpu_lines if line and line[0].startswith("cpu")]
+    cpu_times = proc_log.init("cpuTimes", len(cpu_lines))
+    for c, line in zip(cpu_times, cpu_lines):
+      c.cpuNum = int(line[0][3:])
+      c.user, c.nice, c.system, c.idle, c.iowait, c.irq, c.softirq = (int(x) / CLK_TCK for x in line[1:8])
+
+    meminfo = parse_status(self.meminfo.read())
+    for field, key in MEM_FIELDS.items():
+      if key in meminfo:
+        setattr(proc_log.mem, field, int(meminfo[key].split()[0]) * 1024)
+
+
+def get_pids(manager_state, params: Params) -> Dict[str, int]:
+  pids = {p.name: p.pid for p in manager_state.processes if p.running and p.pid > 0}
+  app_pid = params.get("FlowpilotPID")
+  if app_pid is not None:
+    pids.setdefault("flowpilot", int.from_bytes(app_pid, "little"))
+  return pids
+
+
+def main():
+  sm = messaging.SubMaster(['managerState'])
+  pm = messaging.PubMaster(['procLog'])
+  params = Params()
+  logger = ProcLogger()
+  rk = Ratekeeper(PROCLOG_FREQ, print_delay_threshold=None)
+
+  while True:
+    sm.update(0)
+    if sm.updated['managerState']:
+      logger.set_pids(get_pids(sm['managerState'], params))
+
+    msg = messaging.new_message('procLog')
+    logger.update(msg.procLog, time.monotonic())
+    pm.send('procLog', msg)
+    rk.keep_time()
+
+
+if __name__ == "__main__":
+  main()
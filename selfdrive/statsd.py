@@ -1,11 +1,15 @@
 #!/usr/bin/env python3
 import os
 import zmq
+import math
 import time
+import struct
+import atexit
+import threading
 from pathlib import Path
 from collections import defaultdict
 from datetime import datetime, timezone
-from typing import NoReturn, Union, List, Dict
+from typing import NoReturn, Optional, Union, List, Dict, Iterator, Tuple
 
 from common.params import Params
 from cereal.messaging import SubMaster
@@ -13,59 +17,230 @@ from selfdrive.swaglog import cloudlog
 from common.system import get_platform
 from common.file_helpers import atomic_write_in_dir
 from selfdrive.version import get_normalized_origin, get_short_branch, get_short_version, is_dirty
-from selfdrive.loggerd.config import STATS_DIR, STATS_DIR_FILE_LIMIT, STATS_SOCKET, STATS_FLUSH_TIME_S
+from selfdrive.loggerd.config import STATS_DIR, STATS_DIR_FILE_LIMIT, STATS_SOCKET, STATS_FLUSH_TIME_S, \
+                                     STATS_CLIENT_FLUSH_TIME_S
+
+PROTOCOL_VERSION = 1
+# quantiles are within 1% of the true value
+RELATIVE_ACCURACY = 0.01
+LOG_GAMMA = math.log((1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY))
+MIN_VALUE = 1e-9  # smaller magnitudes are counted as zero
+MAX_KEY = 2**15 - 1
+MAX_BUCKETS = 2048
+PERCENTILES = (0.05, 0.5, 0.95)
 
 
 class METRIC_TYPE:
   GAUGE = 'g'
   SAMPLE = 'sa'
 
+_TYPE_IDS = {METRIC_TYPE.GAUGE: 0, METRIC_TYPE.SAMPLE: 1}
+_TYPES = {v: k for k, v in _TYPE_IDS.items()}
+
+
+class QuantileSketch:
+  """DDSketch: samples are counted in logarithmically sized buckets, so memory
+  and merge cost depend on the range of the values, not on how many there are."""
+  _header = struct.Struct("<IdddHHI")
+
+  def __init__(self):
+    self.count = 0
+    self.sum = 0.
+    self.min = math.inf
+    self.max = -math.inf
+    self.zero = 0
+    self.pos: Dict[int, int] = defaultdict(int)
+    self.neg: Dict[int, int] = defaultdict(int)
+
+  @staticmethod
+  def _key(value: float) -> int:
+    return max(-MAX_KEY, min(MAX_KEY, math.ceil(math.log(value) / LOG_GAMMA)))
+
+  @staticmethod
+  def _value(key: int) -> float:
+    # the middle of the bucket in relative terms
+    return 2 * math.exp(key * LOG_GAMMA) / (1 + math.exp(LOG_GAMMA))
+
+  @staticmethod
+  def _collapse(store: Dict[int, int]) -> None:
+    # merge the smallest magnitudes, their quantiles are the least interesting
+    while len(store) > MAX_BUCKETS:
+      n = store.pop(min(store))
+      store[min(store)] += n
+
+  def add(self, value: float) -> None:
+    self.count += 1
+    self.sum += value
+    self.min = min(self.min, value)
+    self.max = max(self.max, value)
+    if value > MIN_VALUE:
+      self.pos[self._key(value)] += 1
+      if len(self.pos) > MAX_BUCKETS:
+        self._collapse(self.pos)
+    elif value < -MIN_VALUE:
+      self.neg[self._key(-value)] += 1
+      if len(self.neg) > MAX_BUCKETS:
+        self._collapse(self.neg)
+    else:
+      self.zero += 1
+
+  def merge(self, other: "QuantileSketch") -> None:
+    self.count += other.count
+    self.sum += other.sum
+    self.min = min(self.min, other.min)
+    self.max = max(self.max, other.max)
+    self.zero += other.zero
+    for store, other_store in ((self.pos, other.pos), (self.neg, other.neg)):
+      for k, n in other_store.items():
+        store[k] += n
+      self._collapse(store)
+
+  def quantile(self, q: float) -> float:
+    rank = q * (self.count - 1)
+    seen = 0
+    ret = self.max
+    for k in sorted(self.neg, reverse=True):
+      seen += self.neg[k]
+      if seen > rank:
+        ret = -self._value(k)
+        break
+    else:
+      seen += self.zero
+      if seen > rank:
+        ret = 0.
+      else:
+        for k in sorted(self.pos):
+          seen += self.pos[k]
+          if seen > rank:
+            ret = self._value(k)
+            break
+    return min(max(ret, self.min), self.max)
+
+  def to_bytes(self) -> bytes:
+    keys = list(self.pos) + list(self.neg)
+    counts = list(self.pos.values()) + list(self.neg.values())
+    return self._header.pack(self.count, self.sum, self.min, self.max, len(self.pos), len(self.neg), self.zero) + \
+           struct.pack(f"<{len(keys)}h{len(keys)}I", *keys, *counts)
+
+  @classmethod
+  def from_bytes(cls, dat: memoryview, off: int = 0) -> Tuple["QuantileSketch", int]:
+    """The sketch at off and the offset after it"""
+    sketch = cls()
+    sketch.count, sketch.sum, sketch.min, sketch.max, n_pos, n_neg, sketch.zero = cls._header.unpack_from(dat, off)
+    off += cls._header.size
+    n = n_pos + n_neg
+    vals = struct.unpack_from(f"<{n}h{n}I", dat, off)
+    sketch.pos.update(zip(vals[:n_pos], vals[n:n + n_pos]))
+    sketch.neg.update(zip(vals[n_pos:n], vals[n + n_pos:]))
+    return sketch, off + struct.calcsize(f"<{n}h{n}I")
+
+
+def encode_metrics(gauges: Dict[str, float], samples: Dict[str, QuantileSketch]) -> bytes:
+  """One message per flush: the version, then type, name and value of every
+  metric. A gauge value is a double and a sample value a QuantileSketch."""
+  dat = [struct.pack("<B", PROTOCOL_VERSION)]
+  for metrics, metric_type in ((gauges, METRIC_TYPE.GAUGE), (samples, METRIC_TYPE.SAMPLE)):
+    for name, value in metrics.items():
+      name_b = name.encode()
+      dat.append(struct.pack("<BH", _TYPE_IDS[metric_type], len(name_b)) + name_b)
+      dat.append(struct.pack("<d", value) if metric_type == METRIC_TYPE.GAUGE else value.to_bytes())
+  return b"".join(dat)
+
+
+def decode_metrics(dat: bytes) -> Iterator[Tuple[str, str, Union[float, QuantileSketch]]]:
+  """(type, name, value) of the metrics in a message"""
+  dat = memoryview(dat)
+  if dat[0] != PROTOCOL_VERSION:
+    raise ValueError(f"unknown protocol version {dat[0]}")
+  off = 1
+  while off < len(dat):
+    type_id, name_len = struct.unpack_from("<BH", dat, off)
+    off += 3
+    name = bytes(dat[off:off + name_len]).decode()
+    off += name_len
+    value: Union[float, QuantileSketch]
+    if _TYPES[type_id] == METRIC_TYPE.GAUGE:
+      value, = struct.unpack_from("<d", dat, off)
+      off += 8
+    else:
+      value, off = QuantileSketch.from_bytes(dat, off)
+    yield _TYPES[type_id], name, value
+
+
 class StatLog:
+  """Metrics are aggregated in the process and sent to statsd together, by a
+  timer started with the first metric after a flush, so at most
+  STATS_CLIENT_FLUSH_TIME_S after they were recorded."""
   def __init__(self):
     self.pid = None
+    self.gauges: Dict[str, float] = {}
+    self.samples: Dict[str, QuantileSketch] = {}
+    self.lock = threading.Lock()
+    self.timer: Optional[threading.Timer] = None
 
   def connect(self) -> None:
     self.zctx = zmq.Context()
     self.sock = self.zctx.socket(zmq.PUSH)
     self.sock.setsockopt(zmq.LINGER, 10)
     self.sock.connect(STATS_SOCKET)
+    if self.pid is None:
+      atexit.register(self.flush)
     self.pid = os.getpid()
+    # metrics from before a fork belong to the parent, and so do its lock and timer
+    self.gauges.clear()
+    self.samples.clear()
+    self.lock = threading.Lock()
+    self.timer = None
 
-  def _send(self, metric: str) -> None:
-    if os.getpid() != self.pid:
-      self.connect()
+  def _arm(self) -> None:
+    if self.timer is None:
+      self.timer = threading.Timer(STATS_CLIENT_FLUSH_TIME_S, self.flush)
+      self.timer.daemon = True
+      self.timer.start()
 
-    try:
-      self.sock.send_string(metric, zmq.NOBLOCK)
-    except zmq.error.Again:
-      # drop :/
-      pass
+  def flush(self) -> None:
+    with self.lock:
+      if self.timer is not None and self.timer is not threading.current_thread():
+        self.timer.cancel()
+      self.timer = None
+      if os.getpid() != self.pid or not (self.gauges or self.samples):
+        return
+      try:
+        self.sock.send(encode_metrics(self.gauges, self.samples), zmq.NOBLOCK)
+      except zmq.error.Again:
+        # drop :/
+        pass
+      self.gauges.clear()
+      self.samples.clear()
 
   def gauge(self, name: str, value: float) -> None:
-    self._send(f"{name}:{value}|{METRIC_TYPE.GAUGE}")
+    if os.getpid() != self.pid:
+      self.connect()
+    with self.lock:
+      self.gauges[name] = float(value)
+      self._arm()
 
-  # Samples will be recorded in a buffer and at aggregation time,
+  # Samples will be recorded in a sketch and at aggregation time,
   # statistical properties will be logged (mean, count, percentiles, ...)
   def sample(self, name: str, value: float):
-    self._send(f"{name}:{value}|{METRIC_TYPE.SAMPLE}")
+    if os.getpid() != self.pid:
+      self.connect()
+    with self.lock:
+      if name not in self.samples:
+        self.samples[name] = QuantileSketch()
+      self.samples[name].add(float(value))
+      self._arm()
 
 
 def main() -> NoReturn:
   dongle_id = Params().get("DongleId", encoding='utf-8')
   def get_influxdb_line(measurement: str, value: Union[float, Dict[str, float]],  timestamp: datetime, tags: dict) -> str:
-    res = f"{measurement}"
-    for k, v in tags.items():
-      res += f",{k}={str(v)}"
-    res += " "
-
     if isinstance(value, float):
       value = {'value': value}
 
-    for k, v in value.items():
-      res += f"{k}={v},"
-
-    res += f"dongle_id=\"{dongle_id}\" {int(timestamp.timestamp() * 1e9)}\n"
-    return res
+    tag_str = "".join(f",{k}={v}" for k, v in tags.items())
+    field_str = "".join(f"{k}={v}," for k, v in value.items())
+    return f"{measurement}{tag_str} {field_str}dongle_id=\"{dongle_id}\" {int(timestamp.timestamp() * 1e9)}\n"
 
   # open statistics socket
   ctx = zmq.Context().instance()
@@ -90,8 +265,8 @@ def main() -> NoReturn:
 
   idx = 0
   last_flush_time = time.monotonic()
-  gauges = {}
-  samples: Dict[str, List[float]] = defaultdict(list)
+  gauges: Dict[str, float] = {}
+  samples: Dict[str, QuantileSketch] = defaultdict(QuantileSketch)
   while True:
     started_prev = sm['deviceState'].started
     sm.update()
@@ -99,48 +274,38 @@ def main() -> NoReturn:
     # Update metrics
     while True:
       try:
-        metric = sock.recv_string(zmq.NOBLOCK)
+        metrics = sock.recv(zmq.NOBLOCK)
         try:
-          metric_type = metric.split('|')[1]
-          metric_name = metric.split(':')[0]
-          metric_value = float(metric.split('|')[0].split(':')[1])
-
-          if metric_type == METRIC_TYPE.GAUGE:
-            gauges[metric_name] = metric_value
-          elif metric_type == METRIC_TYPE.SAMPLE:
-            samples[metric_name].append(metric_value)
-          else:
-            cloudlog.event("unknown metric type", metric_type=metric_type)
+          for metric_type, metric_name, metric_value in decode_metrics(metrics):
+            if metric_type == METRIC_TYPE.GAUGE:
+              gauges[metric_name] = metric_value
+            else:
+              samples[metric_name].merge(metric_value)
         except Exception:
-          cloudlog.event("malformed metric", metric=metric)
+          cloudlog.event("malformed metrics", size=len(metrics))
       except zmq.error.Again:
         break
 
     # flush when started state changes or after FLUSH_TIME_S
     if (time.monotonic() > last_flush_time + STATS_FLUSH_TIME_S) or (sm['deviceState'].started != started_prev):
-      result = ""
+      result: List[str] = []
       current_time = datetime.utcnow().replace(tzinfo=timezone.utc)
       tags['started'] = sm['deviceState'].started
 
       for key, value in gauges.items():
-        result += get_influxdb_line(f"gauge.{key}", value, current_time, tags)
-
-      for key, values in samples.items():
-        values.sort()
-        sample_count = len(values)
-        sample_sum = sum(values)
+        result.append(get_influxdb_line(f"gauge.{key}", value, current_time, tags))
 
+      for key, sketch in samples.items():
         stats = {
-          'count': sample_count,
-          'min': values[0],
-          'max': values[-1],
-          'mean': sample_sum / sample_count,
+          'count': sketch.count,
+          'min': sketch.min,
+          'max': sketch.max,
+          'mean': sketch.sum / sketch.count,
         }
-        for percentile in [0.05, 0.5, 0.95]:
-          value = values[int(round(percentile * (sample_count - 1)))]
-          stats[f"p{int(percentile * 100)}"] = value
+        for percentile in PERCENTILES:
+          stats[f"p{int(percentile * 100)}"] = sketch.quantile(percentile)
 
-        result += get_influxdb_line(f"sample.{key}", stats, current_time, tags)
+        result.append(get_influxdb_line(f"sample.{key}", stats, current_time, tags))
 
       # clear intermediate data
       gauges.clear()
@@ -152,7 +317,7 @@ def main() -> NoReturn:
         if len(result) > 0:
           stats_path = os.path.join(STATS_DIR, f"{current_time.timestamp():.0f}_{idx}")
           with atomic_write_in_dir(stats_path) as f:
-            f.write(result)
+            f.write("".join(result))
           idx += 1
       else:
         cloudlog.error("stats dir full")
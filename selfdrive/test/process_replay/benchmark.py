@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Step latency, allocations and output equivalence of controlsd, plannerd and
+radard replayed on logs.
+
+  python selfdrive/test/process_replay/benchmark.py rlog.bz2 --ref-dir ref/ --update-ref
+  python selfdrive/test/process_replay/benchmark.py rlog.bz2 --ref-dir ref/
+
+Without --update-ref, the outputs are compared to the reference of the same
+process and log, and so is the p50 and p99 step time. Exits with 1 on a
+difference in the outputs or a slowdown of more than --max-regression.
+"""
+import argparse
+import bz2
+import json
+import os
+import sys
+
+from selfdrive.test.process_replay.process_replay import CONFIGS, CONFIGS_BY_NAME, compare_outputs, read_inputs, \
+                                                         replay_process
+from tools.lib.logreader import LogReader
+
+
+def ref_path(ref_dir, process, log_path):
+  name = os.path.basename(log_path).split(".")[0]
+  return os.path.join(ref_dir, f"{process}_{name}")
+
+
+def save_outputs(path, outputs):
+  with open(path, "wb") as f:
+    f.write(bz2.compress(b"".join(dat for _, dat in outputs)))
+
+
+def load_outputs(path):
+  return [(which, bytes(msg)) for which, msg in LogReader(path, stream=True).iter_raw()]
+
+
+def format_summary(summary):
+  ret = f"{summary['steps']:6d} steps"
+  if "wall_ms_p50" in summary:
+    ret += f"  wall p50 {summary['wall_ms_p50']:.3f} p99 {summary['wall_ms_p99']:.3f} max {summary['wall_ms_max']:.3f} ms"
+    ret += f"  cpu p50 {summary['cpu_ms_p50']:.3f} p99 {summary['cpu_ms_p99']:.3f} ms"
+  if "alloc_kib_p50" in summary:
+    ret += f"  alloc p50 {summary['alloc_kib_p50']:.1f} max {summary['alloc_kib_max']:.1f} KiB"
+    ret += f"  {summary['blocks_per_step']:+.2f} blocks/step"
+  return ret
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("logs", nargs="+", help="rlogs with the inputs and a carParams")
+  parser.add_argument("--process", nargs="+", default=[cfg.name for cfg in CONFIGS], choices=[cfg.name for cfg in CONFIGS])
+  parser.add_argument("--ref-dir", help="reference outputs and step times")
+  parser.add_argument("--update-ref", action="store_true", help="write the reference instead of comparing to it")
+  parser.add_argument("--allocs", action="store_true", help="also measure allocations, in a second run")
+  parser.add_argument("--max-regression", type=float, default=0.2, help="allowed relative slowdown of p50/p99")
+  args = parser.parse_args()
+
+  # as when re-run on a route, see controlsd
+  os.environ.setdefault("REPLAY", "1")
+  if args.ref_dir:
+    os.makedirs(args.ref_dir, exist_ok=True)
+
+  failed = False
+  for log_path in args.logs:
+    for name in args.process:
+      cfg = CONFIGS_BY_NAME[name]
+      inputs = read_inputs(log_path, set(cfg.services) | {"carParams"})
+      outputs, stats = replay_process(cfg, inputs)
+      summary = stats.summary()
+      if args.allocs:
+        summary.update({k: v for k, v in replay_process(cfg, inputs, allocs=True)[1].summary().items() if "alloc" in k or "blocks" in k})
+      print(f"{name:10s} {os.path.basename(log_path)}: {format_summary(summary)}")
+
+      if not args.ref_dir:
+        continue
+      ref = ref_path(args.ref_dir, name, log_path)
+      if args.update_ref:
+        save_outputs(ref + ".bz2", outputs)
+        with open(ref + ".json", "w") as f:
+          json.dump(summary, f, indent=2)
+        continue
+
+      diffs = compare_outputs(load_outputs(ref + ".bz2"), outputs, cfg.ignore)
+      for d in diffs[:20]:
+        print("  ", d)
+      if diffs:
+        print(f"  {len(diffs)} differences to the reference")
+        failed = True
+
+      with open(ref + ".json") as f:
+        ref_summary = json.load(f)
+      for key in ("wall_ms_p50", "wall_ms_p99"):
+        if summary[key] > ref_summary[key] * (1 + args.max_regression):
+          print(f"  {key} regressed: {ref_summary[key]:.3f} -> {summary[key]:.3f} ms")
+          failed = True
+
+  sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+  main()
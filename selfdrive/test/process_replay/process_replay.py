@@ -0,0 +1,327 @@
+"""Run controlsd, plannerd and radard in-process on logged inputs.
+
+The process gets a FakeSubMaster, FakePubMaster and fake can socket and runs
+its own loop. Every time it waits for its trigger (can for controlsd and
+radard, modelV2 for plannerd) it gets the next logged trigger message and
+everything logged since the previous one. sec_since_boot follows the
+logMonoTime of the inputs, so outputs are deterministic and can be compared
+against a reference.
+
+The time between two waits is one step, measured in wall and thread CPU time,
+and with allocs=True in peak traced memory and retained blocks (tracemalloc
+slows the steps down, so time and allocations are measured in separate runs).
+"""
+import importlib
+import sys
+import time
+import tracemalloc
+from collections import deque
+from contextlib import ExitStack
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+from unittest import mock
+
+import numpy as np
+
+import cereal.messaging as messaging
+from cereal import log
+from cereal.converter import service_converter
+from cereal.event_header import event_header
+from tools.lib.logreader import LogReader
+
+# (which, logMonoTime, serialized log.Event)
+Input = Tuple[str, int, bytes]
+
+
+class ReplayDone(Exception):
+  """Raised inside the replayed process when the inputs ran out."""
+
+
+class FakeClock:
+  def __init__(self):
+    self.t = 0.
+
+  def __call__(self) -> float:
+    return self.t
+
+
+class StepStats:
+  def __init__(self):
+    self.wall_ns: List[int] = []
+    self.cpu_ns: List[int] = []
+    self.alloc_peak: List[int] = []  # bytes above the start of the step
+    self.blocks: List[int] = []  # allocated blocks retained by the step
+
+  def __len__(self) -> int:
+    return len(self.wall_ns)
+
+  def summary(self) -> Dict[str, float]:
+    ret = {"steps": len(self)}
+    for name, values in (("wall_ms", self.wall_ns), ("cpu_ms", self.cpu_ns)):
+      if values:
+        ms = np.array(values) / 1e6
+        ret.update({f"{name}_p50": float(np.percentile(ms, 50)), f"{name}_p99": float(np.percentile(ms, 99)),
+                    f"{name}_max": float(ms.max())})
+    if self.alloc_peak:
+      ret["alloc_kib_p50"] = float(np.percentile(self.alloc_peak, 50)) / 1024
+      ret["alloc_kib_max"] = max(self.alloc_peak) / 1024
+      ret["blocks_per_step"] = float(np.mean(self.blocks))
+    return ret
+
+
+class Harness:
+  """Hands the logged inputs to the fake sockets one step at a time."""
+
+  def __init__(self, inputs: Iterable[Input], trigger: str, allocs: bool = False):
+    self.frames = self._frames(inputs, trigger)
+    self.clock = FakeClock()
+    self.can: deque = deque()
+    self.msgs: List[bytes] = []
+    self.stats = StepStats()
+    self.allocs = allocs
+    self._start: Optional[Tuple[int, int, int]] = None
+
+  @staticmethod
+  def _frames(inputs: Iterable[Input], trigger: str):
+    frame = []
+    for inp in inputs:
+      frame.append(inp)
+      if inp[0] == trigger:
+        yield frame
+        frame = []
+
+  def advance(self) -> None:
+    """End the current step and deliver the next frame of inputs."""
+    if self._start is not None:
+      wall, cpu, blocks = self._start
+      self.stats.wall_ns.append(time.perf_counter_ns() - wall)
+      self.stats.cpu_ns.append(time.thread_time_ns() - cpu)
+      if self.allocs:
+        _, peak = tracemalloc.get_traced_memory()
+        self.stats.alloc_peak.append(peak - self._alloc_base)
+        self.stats.blocks.append(sys.getallocatedblocks() - blocks)
+
+    frame = next(self.frames, None)
+    if frame is None:
+      raise ReplayDone
+    self.clock.t = frame[-1][1] / 1e9
+    for which, _, dat in frame:
+      (self.can if which == "can" else self.msgs).append(dat)
+
+    if self.allocs:
+      tracemalloc.reset_peak()
+      self._alloc_base = tracemalloc.get_traced_memory()[0]
+    self._start = (time.perf_counter_ns(), time.thread_time_ns(), sys.getallocatedblocks() if self.allocs else 0)
+
+
+class FakeSocket:
+  def __init__(self, harness: Harness, trigger: bool):
+    self.harness = harness
+    self.trigger = trigger
+
+  def receive(self, non_blocking: bool = False) -> Optional[bytes]:
+    if not non_blocking and self.trigger:
+      self.harness.advance()
+    return self.harness.can.popleft() if self.harness.can else None
+
+
+class FakeSubMaster(messaging.SubMaster):
+  def __init__(self, services: List[str], harness: Harness, trigger: bool, **kwargs):
+    super().__init__(services, addr=None, **kwargs)
+    self.harness = harness
+    self.trigger = trigger
+
+  def update(self, timeout: int = 1000) -> None:
+    if self.trigger:
+      self.harness.advance()
+    msgs = [messaging.LazyEvent(dat) if self.lazy else messaging.log_from_bytes(dat) for dat in self.harness.msgs]
+    self.harness.msgs.clear()
+    self.update_msgs(self.harness.clock(), [m for m in msgs if m.which() in self.data])
+
+
+class FakePubSocket:
+  def __init__(self, service: str, pm: "FakePubMaster"):
+    self.service = service
+    self.pm = pm
+
+  def send(self, dat: bytes) -> None:
+    self.pm.outputs.append((self.service, dat))
+
+  def all_readers_updated(self) -> bool:
+    return True
+
+
+class FakePubMaster:
+  def __init__(self, services: List[str]):
+    self.outputs: List[Tuple[str, bytes]] = []
+    self.sock = {s: FakePubSocket(s, self) for s in services}
+
+  def send(self, s: str, dat, trace=None) -> None:
+    if not isinstance(dat, bytes):
+      dat = dat.to_bytes()
+    self.sock[s].send(dat)
+
+  def all_readers_updated(self, s: str) -> bool:
+    return True
+
+
+def run_controlsd(CP, sm, pm, can_sock):
+  from selfdrive.car.car_helpers import interfaces
+  from selfdrive.controls.controlsd import Controls
+
+  CarInterface, CarController, CarState = interfaces[CP.carFingerprint]
+  controls = Controls(sm, pm, can_sock, CarInterface(CP.as_builder(), CarController, CarState))
+  while True:
+    controls.step()
+
+
+def run_plannerd(CP, sm, pm, can_sock):
+  from common.params import Params
+  from selfdrive.controls.plannerd import plannerd_thread
+  Params().put("CarParams", CP.as_builder().to_bytes())
+  plannerd_thread(sm, pm)
+
+
+def run_radard(CP, sm, pm, can_sock):
+  from common.params import Params
+  from selfdrive.controls.radard import radard_thread
+  Params().put("CarParams", CP.as_builder().to_bytes())
+  radard_thread(sm, pm, can_sock)
+
+
+class ProcessConfig(NamedTuple):
+  name: str
+  run: Callable[[Any, FakeSubMaster, FakePubMaster, FakeSocket], None]
+  modules: List[str]  # imported before the clock is patched
+  subs: List[str]
+  sm_kwargs: Dict[str, Any]  # as the process builds its SubMaster
+  trigger: str
+  outputs: List[str]
+  ignore: List[str]  # output fields that aren't deterministic, "service.field"
+
+  @property
+  def services(self) -> List[str]:
+    """The services replayed to the process, only the can triggered ones read can_sock"""
+    return self.subs + ["can"] if self.trigger == "can" else self.subs
+
+
+CONFIGS = [
+  ProcessConfig(
+    name="controlsd",
+    run=run_controlsd,
+    modules=["selfdrive.controls.controlsd", "selfdrive.car.car_helpers"],
+    subs=['deviceState', 'pandaStates', 'peripheralState', 'modelV2', 'liveCalibration', 'driverMonitoringState',
+          'longitudinalPlan', 'lateralPlan', 'liveLocationKalman', 'managerState', 'liveParameters', 'radarState'],
+    sm_kwargs={"ignore_avg_freq": ['radarState', 'longitudinalPlan', 'liveParameters', 'liveLocationKalman']},
+    trigger="can",
+    outputs=['sendcan', 'controlsState', 'carState', 'carControl', 'carEvents', 'carParams'],
+    ignore=[],
+  ),
+  ProcessConfig(
+    name="plannerd",
+    run=run_plannerd,
+    modules=["selfdrive.controls.plannerd"],
+    subs=['carState', 'controlsState', 'modelV2', 'radarState'],
+    sm_kwargs={"poll": ['modelV2'], "ignore_avg_freq": ['radarState']},
+    trigger="modelV2",
+    outputs=['longitudinalPlan', 'lateralPlan'],
+    ignore=['lateralPlan.solverExecutionTime', 'longitudinalPlan.solverExecutionTime'],
+  ),
+  ProcessConfig(
+    name="radard",
+    run=run_radard,
+    modules=["selfdrive.controls.radard"],
+    subs=['modelV2', 'carState'],
+    sm_kwargs={"ignore_avg_freq": ['modelV2', 'carState'], "lazy": True},
+    trigger="can",
+    outputs=['radarState', 'liveTracks'],
+    ignore=[],
+  ),
+]
+CONFIGS_BY_NAME = {cfg.name: cfg for cfg in CONFIGS}
+
+
+def read_inputs(log_path: str, services: Iterable[str]) -> List[Input]:
+  ret = []
+  for which, msg in LogReader(log_path, stream=True, services=set(services)).iter_raw():
+    dat = bytes(msg)
+    header = event_header(dat)
+    ret.append((which, header[1] if header is not None else log.Event.from_bytes(dat).logMonoTime, dat))
+  return ret
+
+
+def _patch_clock(clock: FakeClock) -> ExitStack:
+  """Point every imported sec_since_boot at the fake clock."""
+  from common.clock import sec_since_boot
+  stack = ExitStack()
+  for name, module in list(sys.modules.items()):
+    if name.startswith(("cereal.", "common.", "selfdrive.")) and getattr(module, "sec_since_boot", None) is sec_since_boot:
+      stack.enter_context(mock.patch.object(module, "sec_since_boot", clock))
+  return stack
+
+
+def replay_process(cfg: ProcessConfig, inputs: List[Input], CP=None, allocs: bool = False) -> Tuple[List[Tuple[str, bytes]], StepStats]:
+  """Run a process on the inputs, returns its (service, message) outputs and
+  the stats of its steps. CP defaults to the carParams in the inputs."""
+  if CP is None:
+    CP = next(log.Event.from_bytes(dat).carParams for which, _, dat in inputs if which == "carParams")
+  for module in cfg.modules:
+    importlib.import_module(module)
+
+  harness = Harness([i for i in inputs if i[0] in cfg.services], cfg.trigger, allocs)
+  sm = FakeSubMaster(cfg.subs, harness, cfg.trigger != "can", **cfg.sm_kwargs)
+  pm = FakePubMaster(cfg.outputs)
+  can_sock = FakeSocket(harness, cfg.trigger == "can")
+
+  if allocs:
+    tracemalloc.start()
+  try:
+    with _patch_clock(harness.clock):
+      cfg.run(CP, sm, pm, can_sock)
+  except ReplayDone:
+    pass
+  finally:
+    if allocs:
+      tracemalloc.stop()
+  return pm.outputs, harness.stats
+
+
+def _diff(a, b, path: str, tolerance: float) -> List[str]:
+  if isinstance(a, dict) and isinstance(b, dict):
+    return [d for k in sorted(set(a) | set(b)) for d in _diff(a.get(k), b.get(k), f"{path}.{k}", tolerance)]
+  if isinstance(a, list) and isinstance(b, list) and len(a) == len(b):
+    return [d for i, (x, y) in enumerate(zip(a, b)) for d in _diff(x, y, f"{path}[{i}]", tolerance)]
+  if isinstance(a, float) and isinstance(b, float):
+    close = abs(a - b) <= tolerance * max(1., abs(a), abs(b)) or (a != a and b != b)
+    return [] if close else [f"{path}: {a} != {b}"]
+  return [] if a == b else [f"{path}: {a} != {b}"]
+
+
+def _strip(d: Dict[str, Any], field: str) -> None:
+  head, _, rest = field.partition(".")
+  if rest and isinstance(d.get(head), dict):
+    _strip(d[head], rest)
+  else:
+    d.pop(head, None)
+
+
+def compare_outputs(ref: List[Tuple[str, bytes]], new: List[Tuple[str, bytes]], ignore: Iterable[str] = (),
+                    tolerance: float = 1e-5) -> List[str]:
+  """Differences between two runs, per service and message. logMonoTime and
+  the ignored "service.field"s are not compared."""
+  diffs = []
+  for s in sorted({s for s, _ in ref} | {s for s, _ in new}):
+    ref_msgs = [dat for which, dat in ref if which == s]
+    new_msgs = [dat for which, dat in new if which == s]
+    if len(ref_msgs) != len(new_msgs):
+      diffs.append(f"{s}: {len(ref_msgs)} messages in the reference, {len(new_msgs)} now")
+    conv = service_converter(s)
+    for i, (a, b) in enumerate(zip(ref_msgs, new_msgs)):
+      dicts = []
+      for dat in (a, b):
+        evt = log.Event.from_bytes(dat)
+        d = {s: conv(getattr(evt, s)), "valid": evt.valid}
+        for field in ignore:
+          _strip(d, field)
+        dicts.append(d)
+      diffs += _diff(dicts[0], dicts[1], f"{s}[{i}]", tolerance)
+  return diffs
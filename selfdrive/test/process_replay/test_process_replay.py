@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+import unittest
+
+import cereal.messaging as messaging
+from cereal import log
+from selfdrive.test.process_replay.process_replay import Harness, ProcessConfig, ReplayDone, compare_outputs, \
+                                                         replay_process
+
+
+def make_inputs(n=50):
+  """carState at 50 Hz, can at 100 Hz and a carParams"""
+  inputs = []
+  evt = log.Event.new_message(logMonoTime=0)
+  evt.init("carParams").carFingerprint = "MOCK"
+  inputs.append(("carParams", 0, evt.to_bytes()))
+  for i in range(n):
+    t = (i + 1) * 10_000_000
+    if i % 2 == 0:
+      evt = log.Event.new_message(logMonoTime=t)
+      evt.init("carState").vEgo = i
+      inputs.append(("carState", t, evt.to_bytes()))
+    evt = log.Event.new_message(logMonoTime=t)
+    evt.init("can", 1)[0].address = i
+    inputs.append(("can", t, evt.to_bytes()))
+  return inputs
+
+
+def run_echo(CP, sm, pm, can_sock):
+  """publishes the speed, the time and the can address every can frame"""
+  from common.realtime import sec_since_boot
+  while True:
+    can = messaging.drain_sock_raw(can_sock, wait_for_one=True)
+    sm.update(0)
+    dat = messaging.new_message("controlsState")
+    dat.controlsState.vCruise = sm['carState'].vEgo
+    dat.controlsState.vTargetLead = sec_since_boot()
+    dat.controlsState.cumLagMs = log.Event.from_bytes(can[-1]).can[0].address
+    pm.send("controlsState", dat)
+
+
+def run_can_count(CP, sm, pm, can_sock):
+  """publishes how much can is queued every carState"""
+  while True:
+    sm.update()
+    dat = messaging.new_message("controlsState")
+    dat.controlsState.cumLagMs = len(messaging.drain_sock_raw(can_sock))
+    pm.send("controlsState", dat)
+
+
+ECHO = ProcessConfig(name="echo", run=run_echo, modules=["common.realtime"], subs=["carState"], sm_kwargs={},
+                     trigger="can", outputs=["controlsState"], ignore=[])
+CAN_COUNT = ProcessConfig(name="can_count", run=run_can_count, modules=[], subs=["carState"], sm_kwargs={},
+                          trigger="carState", outputs=["controlsState"], ignore=[])
+
+
+class TestProcessReplay(unittest.TestCase):
+
+  def test_harness_frames(self):
+    harness = Harness(make_inputs(4), "can")
+    harness.advance()
+    self.assertEqual(len(harness.can), 1)
+    self.assertEqual(len(harness.msgs), 2)  # carParams and carState
+    self.assertEqual(harness.clock(), 0.01)
+    harness.advance()
+    self.assertEqual((len(harness.can), len(harness.msgs)), (2, 2))
+    self.assertEqual(len(harness.stats), 1)
+    harness.advance()
+    harness.advance()
+    with self.assertRaises(ReplayDone):
+      harness.advance()
+    self.assertEqual(len(harness.stats), 4)
+
+  def test_replay(self):
+    outputs, stats = replay_process(ECHO, make_inputs())
+    self.assertEqual(len(outputs), 50)
+    self.assertEqual(len(stats), 50)
+    self.assertEqual(stats.summary()["steps"], 50)
+    self.assertNotIn("alloc_kib_p50", stats.summary())
+
+    msgs = [log.Event.from_bytes(dat).controlsState for _, dat in outputs]
+    self.assertEqual([m.cumLagMs for m in msgs], list(range(50)))
+    self.assertEqual([m.vCruise for m in msgs], [i - i % 2 for i in range(50)])
+    # the clock follows the inputs
+    self.assertAlmostEqual(msgs[-1].vTargetLead, 0.5)
+
+  def test_no_can_without_can_trigger(self):
+    outputs, _ = replay_process(CAN_COUNT, make_inputs())
+    self.assertEqual(len(outputs), 25)
+    self.assertEqual([log.Event.from_bytes(dat).controlsState.cumLagMs for _, dat in outputs], [0] * 25)
+
+  def test_allocs(self):
+    _, stats = replay_process(ECHO, make_inputs(), allocs=True)
+    summary = stats.summary()
+    self.assertEqual(len(stats.alloc_peak), 50)
+    self.assertGreater(summary["alloc_kib_max"], 0)
+
+  def test_compare(self):
+    inputs = make_inputs()
+    ref, _ = replay_process(ECHO, inputs)
+    new, _ = replay_process(ECHO, inputs)
+    self.assertEqual(compare_outputs(ref, new), [])
+
+    # one carState missing changes the speed of two steps
+    new, _ = replay_process(ECHO, [i for i in inputs if i[1] != 210_000_000 or i[0] != "carState"])
+    diffs = compare_outputs(ref, new)
+    self.assertEqual(len(diffs), 2)
+    self.assertTrue(diffs[0].startswith("controlsState[20].controlsState.vCruise"))
+    self.assertEqual(compare_outputs(ref, new, ignore=["controlsState.vCruise"]), [])
+
+    self.assertEqual(len(compare_outputs(ref, new[:-1], ignore=["controlsState.vCruise"])), 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
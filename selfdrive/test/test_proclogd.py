@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import unittest
+
+import cereal.messaging as messaging
+from selfdrive.proclogd import CLK_TCK, PAGE_SIZE, ProcLogger, parse_stat
+
+STAT = "cpu  10 0 10 100 0 0 0 0 0 0\ncpu0 5 0 5 50 0 0 0 0 0 0\ncpu1 5 0 5 50 0 0 0 0 0 0\nintr 1 2 3\n"
+MEMINFO = "MemTotal: 1000 kB\nMemFree: 200 kB\nMemAvailable: 500 kB\nShmem: 10 kB\n"
+
+
+def pid_stat(pid, utime, stime, majflt, rss):
+  fields = ["S", "1", str(pid), str(pid), "0", "-1", "4194560", "100", "0", str(majflt), "0", str(utime), str(stime),
+            "0", "0", "20", "0", "4", "0", "5000", "123456", str(rss)] + ["0"] * 14 + ["3"] + ["0"] * 15
+  return f"{pid} (plan (ner)d) " + " ".join(fields) + "\n"
+
+
+def pid_status(vol, invol):
+  return f"Name:\tplannerd\nState:\tS (sleeping)\nvoluntary_ctxt_switches:\t{vol}\nnonvoluntary_ctxt_switches:\t{invol}\n"
+
+
+class TestProcLogd(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.proc = self.tmp.name
+    self.write("stat", STAT)
+    self.write("meminfo", MEMINFO)
+    self.write("42/stat", pid_stat(42, 100, 50, 3, 1000))
+    self.write("42/status", pid_status(10, 1))
+    self.write("42/cmdline", "plannerd\0--flag\0")
+    os.symlink("/usr/bin/python3", os.path.join(self.proc, "42/exe"))
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def write(self, path, dat):
+    path = os.path.join(self.proc, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "r+" if os.path.exists(path) else "w") as f:
+      f.write(dat)
+      f.truncate()
+
+  def sample(self, logger, t):
+    msg = messaging.new_message("procLog")
+    logger.update(msg.procLog, t)
+    return msg.procLog
+
+  def test_parse_stat(self):
+    stat = parse_stat(pid_stat(42, 1, 2, 3, 4))
+    self.assertEqual((stat[0], stat[11], stat[12], stat[36]), ("S", "1", "2", "3"))
+
+  def test_deltas(self):
+    logger = ProcLogger(self.proc)
+    logger.set_pids({"plannerd": 42, "missing": 43})
+    self.assertEqual(list(logger.tracked), ["plannerd"])
+
+    proc_log = self.sample(logger, 0.)
+    p = proc_log.procs[0]
+    self.assertEqual((p.name, p.pid, list(p.cmdline), p.exe), ("plannerd", 42, ["plannerd", "--flag"], "/usr/bin/python3"))
+    self.assertEqual((p.cpuPercent, p.ctxSwitchesVoluntary, p.majorFaults), (0, 0, 0))
+    self.assertEqual((p.memRss, p.numThreads, p.processor, p.state), (1000 * PAGE_SIZE, 4, 3, ord("S")))
+    self.assertAlmostEqual(p.cpuUser, 100 / CLK_TCK, places=5)
+    self.assertEqual([c.cpuNum for c in proc_log.cpuTimes], [0, 1])
+    self.assertEqual((proc_log.mem.total, proc_log.mem.available, proc_log.mem.shared), (1024000, 512000, 10240))
+
+    # half a core over 0.5 s
+    self.write("42/stat", pid_stat(42, 100 + CLK_TCK // 4, 50, 5, 1000))
+    self.write("42/status", pid_status(30, 4))
+    p = self.sample(logger, 0.5).procs[0]
+    self.assertAlmostEqual(p.cpuPercent, 50., places=3)
+    self.assertEqual((p.ctxSwitchesVoluntary, p.ctxSwitchesInvoluntary, p.majorFaults), (20, 3, 2))
+
+  def test_restart(self):
+    logger = ProcLogger(self.proc)
+    logger.set_pids({"plannerd": 42})
+    self.sample(logger, 0.)
+
+    # exited (reads of the open files fail), then restarted with a new pid
+    self.write("42/stat", "")
+    self.assertEqual(len(self.sample(logger, 0.5).procs), 0)
+    self.assertEqual(logger.tracked, {})
+
+    self.write("44/stat", pid_stat(44, 1, 1, 0, 10))
+    self.write("44/status", pid_status(0, 0))
+    logger.set_pids({"plannerd": 44})
+    p = self.sample(logger, 1.).procs[0]
+    self.assertEqual((p.pid, p.cpuPercent, list(p.cmdline)), (44, 0, []))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+import random
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+from parameterized import parameterized
+
+import selfdrive.statsd as statsd
+from selfdrive.statsd import METRIC_TYPE, QuantileSketch, StatLog, decode_metrics, encode_metrics
+
+
+class TestQuantileSketch(unittest.TestCase):
+
+  @parameterized.expand([("uniform", lambda: random.uniform(0, 100)),
+                         ("lognormal", lambda: random.lognormvariate(0, 3)),
+                         ("signed", lambda: random.gauss(0, 10)),
+                         ("zeros", lambda: random.choice([0., 0., 1.5]))])
+  def test_quantiles(self, _, dist):
+    random.seed(0)
+    values = [dist() for _ in range(20000)]
+    sketch = QuantileSketch()
+    for v in values:
+      sketch.add(v)
+    self.assertEqual(sketch.count, len(values))
+    self.assertEqual((sketch.min, sketch.max), (min(values), max(values)))
+    for q in statsd.PERCENTILES:
+      # a sample of rank q * (n - 1), within the relative accuracy
+      expected = np.percentile(values, q * 100, method="lower")
+      self.assertLessEqual(abs(sketch.quantile(q) - expected), 2 * statsd.RELATIVE_ACCURACY * abs(expected) + 1e-6)
+
+  def test_bounded(self):
+    sketch = QuantileSketch()
+    for i in range(1, 100000):
+      sketch.add(i * 1e-3)
+      sketch.add(float(i))
+    self.assertLess(len(sketch.pos), 2000)
+
+    with mock.patch.object(statsd, "MAX_BUCKETS", 100):
+      sketch.add(1e300)
+      self.assertEqual(len(sketch.pos), 100)
+    self.assertEqual(sketch.count, 2 * 99999 + 1)
+    # only the small values lost their accuracy
+    self.assertAlmostEqual(sketch.quantile(0.99), 98000, delta=98000 * 2 * statsd.RELATIVE_ACCURACY)
+
+  def test_merge(self):
+    a, b, both = QuantileSketch(), QuantileSketch(), QuantileSketch()
+    for i in range(1000):
+      (a if i % 3 else b).add(i - 200)
+      both.add(i - 200)
+    a.merge(b)
+    for q in (0., 0.1, 0.5, 0.9, 1.):
+      self.assertEqual(a.quantile(q), both.quantile(q))
+    self.assertEqual((a.count, a.sum, a.min, a.max), (both.count, both.sum, both.min, both.max))
+
+
+class TestProtocol(unittest.TestCase):
+
+  def test_roundtrip(self):
+    sketch = QuantileSketch()
+    for v in (-3., 0., 0.5, 2., 1000.):
+      sketch.add(v)
+    dat = encode_metrics({"cpu0_usage_percent": 12.5, "ünïcode": 1.}, {"power_draw": sketch, "empty": QuantileSketch()})
+    metrics = list(decode_metrics(dat))
+    self.assertEqual([(t, n) for t, n, _ in metrics], [(METRIC_TYPE.GAUGE, "cpu0_usage_percent"), (METRIC_TYPE.GAUGE, "ünïcode"),
+                                                       (METRIC_TYPE.SAMPLE, "power_draw"), (METRIC_TYPE.SAMPLE, "empty")])
+    self.assertEqual(metrics[0][2], 12.5)
+    decoded = metrics[2][2]
+    self.assertEqual((decoded.count, decoded.sum, decoded.zero), (5, sketch.sum, 1))
+    self.assertEqual([decoded.quantile(q) for q in (0, .25, .5, .75, 1)], [sketch.quantile(q) for q in (0, .25, .5, .75, 1)])
+
+    with self.assertRaises(ValueError):
+      list(decode_metrics(b"\x00" + dat[1:]))
+
+  def test_client_aggregates(self):
+    statlog = StatLog()
+    with mock.patch.object(statsd.zmq, "Context"), mock.patch.object(statsd.atexit, "register"), \
+         mock.patch.object(statsd, "STATS_CLIENT_FLUSH_TIME_S", 0.2):
+      for i in range(100):
+        statlog.gauge("free_space_percent", i)
+        statlog.sample("power_draw", i)
+      statlog.sock.send.assert_not_called()
+
+      # sent by the timer, without further metrics
+      time.sleep(0.5)
+      statlog.sock.send.assert_called_once()
+      metrics = {name: value for _, name, value in decode_metrics(statlog.sock.send.call_args.args[0])}
+      self.assertEqual(metrics["free_space_percent"], 99.)
+      self.assertEqual(metrics["power_draw"].count, 100)
+      self.assertEqual(statlog.samples, {})
+
+      # a single metric after going quiet is sent too
+      statlog.gauge("free_space_percent", 5)
+      time.sleep(0.5)
+      self.assertEqual(statlog.sock.send.call_count, 2)
+      self.assertIsNone(statlog.timer)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -6,8 +6,6 @@ import time
 from collections import OrderedDict, namedtuple
 from typing import Dict, Optional, Tuple
 
-import psutil
-
 import cereal.messaging as messaging
 from cereal import log
 from common.dict_helpers import strip_deprecated_keys
@@ -17,7 +15,8 @@ from common.realtime import DT_TRML, sec_since_boot
 from common.system import is_android, is_android_rooted
 from selfdrive.controls.lib.alertmanager import set_offroad_alert
 from system.hardware import HARDWARE
-from selfdrive.loggerd.config import get_available_percent
+from system.hardware.hw_stats import HardwareStats
+from selfdrive.loggerd.config import ROOT
 from selfdrive.statsd import statlog
 from selfdrive.swaglog import cloudlog
 
@@ -46,29 +45,29 @@ OFFROAD_DANGER_TEMP = 79.5
 
 prev_offroad_states: Dict[str, Tuple[bool, Optional[str]]] = {}
 
-def get_device_state():
+def get_device_state(hw_stats: HardwareStats):
   # System utilization
   msg = messaging.new_message("deviceState")
   
-  msg.deviceState.freeSpacePercent = get_available_percent(default=100.0)
-  msg.deviceState.memoryUsagePercent = int(round(psutil.virtual_memory().percent))
-  msg.deviceState.cpuUsagePercent = [int(round(n)) for n in psutil.cpu_percent(percpu=True)]
+  msg.deviceState.freeSpacePercent = hw_stats.free_space_percent(default=100.0)
+  msg.deviceState.memoryUsagePercent = int(round(hw_stats.memory_usage_percent()))
+  msg.deviceState.cpuUsagePercent = [int(round(n)) for n in hw_stats.cpu_usage_percent()]
 
   # Power
   if (not is_android()) or (is_android_rooted()):
     try: # TODO: causes crash on android when providing power via panda.
-      battery = psutil.sensors_battery()
+      battery = hw_stats.battery()
       msg.deviceState.batteryPercent = int(battery.percent)
       msg.deviceState.chargingDisabled = not battery.power_plugged
     except:
       pass
 
   # Device Thermals
-  temps = psutil.sensors_temperatures()
+  temps = hw_stats.temperatures()
   if temps.get("coretemp", None) is not None:
-    msg.deviceState.cpuTempC = [cpu.current for cpu in temps['coretemp']]
+    msg.deviceState.cpuTempC = temps['coretemp']
   elif temps.get("battery", None) is not None:
-    msg.deviceState.cpuTempC = [bms.current for bms in temps['battery']]
+    msg.deviceState.cpuTempC = temps['battery']
   else:
     msg.deviceState.cpuTempC = [0.0]*8 # TODO: find a better way to get temps that works across platforms.
   
@@ -115,6 +114,7 @@ def thermald_thread(end_event, hw_queue):
   params = Params()
 
   fan_controller = None
+  hw_stats = HardwareStats(disk_path=ROOT)
 
   while not end_event.is_set():
     sm.update(PANDA_STATES_TIMEOUT)
@@ -122,7 +122,7 @@ def thermald_thread(end_event, hw_queue):
     pandaStates = sm['pandaStates']
     peripheralState = sm['peripheralState']
 
-    msg = get_device_state()
+    msg = get_device_state(hw_stats)
 
     if sm.updated['pandaStates'] and len(pandaStates) > 0:
 
@@ -22,6 +22,7 @@ setup(name="flowpilot",
                                         "uploader=selfdrive.loggerd.uploader:main",
                                         "deleter=selfdrive.loggerd.deleter:main",
                                         "statsd=selfdrive.statsd:main",
+                                        "proclogd=selfdrive.proclogd:main",
                                         "thermald_=selfdrive.thermald.thermald:main", # thermald name is reserverd
                                         "flowinit=selfdrive.manager.flowinitd:main"]}
      )
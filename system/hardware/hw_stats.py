@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""CPU, memory, temperature, battery and disk stats for deviceState.
+
+The same values as psutil.cpu_percent(percpu=True), virtual_memory().percent,
+sensors_temperatures() and sensors_battery(), but the files are found once and
+kept open, and every update is a pread. Battery and disk space change slowly
+and are only read every slow_interval seconds.
+
+  python system/hardware/hw_stats.py  # time an update against psutil
+"""
+import glob
+import os
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+READ_SIZE = 4096
+
+
+class Battery(NamedTuple):
+  percent: float
+  power_plugged: Optional[bool]
+
+
+class SysFile:
+  """A /proc or /sys file kept open, read from the start on every read()."""
+  def __init__(self, path: str, size: int = READ_SIZE):
+    self.path = path
+    self.size = size
+    self.fd = os.open(path, os.O_RDONLY)
+
+  def read(self) -> str:
+    return os.pread(self.fd, self.size, 0).decode()
+
+  def read_int(self) -> int:
+    return int(self.read())
+
+  def close(self) -> None:
+    os.close(self.fd)
+
+
+def _open(path: str, size: int = READ_SIZE) -> Optional[SysFile]:
+  try:
+    f = SysFile(path, size)
+    f.read()
+    return f
+  except (OSError, ValueError):
+    return None
+
+
+def _read_str(path: str) -> Optional[str]:
+  try:
+    with open(path) as f:
+      return f.read().strip()
+  except OSError:
+    return None
+
+
+class HardwareStats:
+  def __init__(self, disk_path: str = "/", slow_interval: float = 10., proc: str = "/proc", sys: str = "/sys"):
+    self.disk_path = disk_path
+    self.slow_interval = slow_interval
+    self.sys = sys
+
+    ncpu = os.cpu_count() or 1
+    # the interrupt counters after the cpu lines can be long, only read up to them
+    self.stat = SysFile(os.path.join(proc, "stat"), 256 * (ncpu + 2))
+    self.meminfo = SysFile(os.path.join(proc, "meminfo"))
+    self.cpu_times: Dict[str, Tuple[int, int]] = self._cpu_times()
+    self.temp_files = self._find_temperatures()
+    self.battery_files = self._find_battery()
+    self._slow: Dict[str, Tuple[float, object]] = {}
+
+  def _find_temperatures(self) -> Dict[str, List[SysFile]]:
+    # like psutil: hwmon sensors grouped by name, then thermal zones by type
+    ret: Dict[str, List[SysFile]] = {}
+    for hwmon in sorted(glob.glob(os.path.join(self.sys, "class/hwmon/hwmon*"))):
+      name = _read_str(os.path.join(hwmon, "name")) or _read_str(os.path.join(hwmon, "device/name"))
+      inputs = glob.glob(os.path.join(hwmon, "temp*_input")) or glob.glob(os.path.join(hwmon, "device/temp*_input"))
+      files = [f for f in (_open(path) for path in sorted(inputs)) if f is not None]
+      if name is not None and files:
+        ret.setdefault(name, []).extend(files)
+
+    zones: Dict[str, List[SysFile]] = {}
+    for zone in sorted(glob.glob(os.path.join(self.sys, "class/thermal/thermal_zone*"))):
+      name = _read_str(os.path.join(zone, "type"))
+      f = _open(os.path.join(zone, "temp"))
+      if name is not None and name not in ret and f is not None:
+        zones.setdefault(name, []).append(f)
+    ret.update(zones)
+    return ret
+
+  def _find_battery(self) -> Dict[str, SysFile]:
+    supplies = glob.glob(os.path.join(self.sys, "class/power_supply/*"))
+    batteries = [p for p in sorted(supplies) if os.path.basename(p).startswith("BAT") or
+                 "battery" in os.path.basename(p).lower() or _read_str(os.path.join(p, "type")) == "Battery"]
+    ret = {}
+    if batteries:
+      for name in ("capacity", "energy_now", "energy_full", "charge_now", "charge_full", "status"):
+        f = _open(os.path.join(batteries[0], name))
+        if f is not None:
+          ret[name] = f
+    for ac in ("AC0", "AC"):
+      f = _open(os.path.join(self.sys, "class/power_supply", ac, "online"))
+      if f is not None:
+        ret["online"] = f
+        break
+    return ret
+
+  def _cpu_times(self) -> Dict[str, Tuple[int, int]]:
+    """{cpuN: (busy, total)} in jiffies"""
+    ret = {}
+    for line in self.stat.read().splitlines()[1:]:
+      if not line.startswith("cpu"):
+        break
+      name, *fields = line.split()
+      times = [int(x) for x in fields[:8]]  # guest time is already part of user and nice
+      idle = times[3] + (times[4] if len(times) > 4 else 0)
+      ret[name] = (sum(times) - idle, sum(times))
+    return ret
+
+  def _cached(self, name: str, fn):
+    now = time.monotonic()
+    if name not in self._slow or now - self._slow[name][0] >= self.slow_interval:
+      self._slow[name] = (now, fn())
+    return self._slow[name][1]
+
+  def cpu_usage_percent(self) -> List[float]:
+    """Per online cpu, since the previous call"""
+    times = self._cpu_times()
+    ret = []
+    for name, (busy, total) in times.items():
+      prev_busy, prev_total = self.cpu_times.get(name, (0, 0))
+      dt = total - prev_total
+      ret.append(min(max(100. * (busy - prev_busy) / dt, 0.), 100.) if dt > 0 else 0.)
+    self.cpu_times = times
+    return ret
+
+  def memory_usage_percent(self) -> float:
+    mem = {}
+    for line in self.meminfo.read().splitlines():
+      key, _, value = line.partition(":")
+      mem[key] = int(value.split()[0])
+    total = mem["MemTotal"]
+    available = mem.get("MemAvailable", mem["MemFree"] + mem.get("Buffers", 0) + mem.get("Cached", 0))
+    return 100. * (total - available) / total
+
+  def temperatures(self) -> Dict[str, List[float]]:
+    """{sensor name: [degrees C]}"""
+    ret = {}
+    for name, files in self.temp_files.items():
+      temps = []
+      for f in files:
+        try:
+          temps.append(f.read_int() / 1000.)
+        except (OSError, ValueError):
+          pass
+      if temps:
+        ret[name] = temps
+    return ret
+
+  def _battery(self) -> Optional[Battery]:
+    files = self.battery_files
+    try:
+      if "capacity" in files:
+        percent = float(files["capacity"].read_int())
+      elif "energy_now" in files and "energy_full" in files:
+        percent = 100. * files["energy_now"].read_int() / files["energy_full"].read_int()
+      elif "charge_now" in files and "charge_full" in files:
+        percent = 100. * files["charge_now"].read_int() / files["charge_full"].read_int()
+      else:
+        return None
+
+      plugged = None
+      if "online" in files:
+        plugged = files["online"].read_int() == 1
+      elif "status" in files:
+        status = files["status"].read().strip().lower()
+        plugged = True if status in ("charging", "full") else (False if status == "discharging" else None)
+    except (OSError, ValueError, ZeroDivisionError):
+      return None
+    return Battery(min(percent, 100.), plugged)
+
+  def battery(self) -> Optional[Battery]:
+    return self._cached("battery", self._battery)
+
+  def _free_space_percent(self) -> Optional[float]:
+    try:
+      statvfs = os.statvfs(self.disk_path)
+      return 100.0 * statvfs.f_bavail / statvfs.f_blocks
+    except OSError:
+      return None
+
+  def free_space_percent(self, default: Optional[float] = None) -> Optional[float]:
+    ret = self._cached("free_space", self._free_space_percent)
+    return default if ret is None else ret
+
+
+def main():
+  import psutil
+
+  def update_psutil():
+    psutil.virtual_memory()
+    psutil.cpu_percent(percpu=True)
+    psutil.sensors_battery()
+    psutil.sensors_temperatures()
+    os.statvfs("/")
+
+  hw = HardwareStats()
+  def update_hw_stats():
+    hw.memory_usage_percent()
+    hw.cpu_usage_percent()
+    hw.battery()
+    hw.temperatures()
+    hw.free_space_percent()
+
+  n = 200
+  for name, fn in (("psutil", update_psutil), ("HardwareStats", update_hw_stats)):
+    fn()
+    start, cpu_start = time.perf_counter(), time.process_time()
+    for _ in range(n):
+      fn()
+    wall, cpu = (time.perf_counter() - start) / n, (time.process_time() - cpu_start) / n
+    print(f"{name:15s} {wall * 1e6:9.1f} us/update  cpu {cpu * 1e6:9.1f} us/update")
+  print(f"{sum(len(f) for f in hw.temp_files.values())} temperature sensors, battery: {hw.battery()}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import psutil
+
+from system.hardware.hw_stats import Battery, HardwareStats
+
+STAT = """cpu  400 0 200 1000 100 0 0 0 0 0
+cpu0 100 0 100 500 50 0 0 0 0 0
+cpu1 300 0 100 500 50 0 0 0 0 0
+intr 12345 0 0 0
+"""
+MEMINFO = "MemTotal:        8000000 kB\nMemFree:         1000000 kB\nMemAvailable:    2000000 kB\n"
+
+
+class TestHardwareStats(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.proc = os.path.join(self.tmp.name, "proc")
+    self.sys = os.path.join(self.tmp.name, "sys")
+    self.write("proc/stat", STAT)
+    self.write("proc/meminfo", MEMINFO)
+    self.write("sys/class/hwmon/hwmon0/name", "coretemp\n")
+    self.write("sys/class/hwmon/hwmon0/temp1_input", "45000\n")
+    self.write("sys/class/hwmon/hwmon0/temp2_input", "47500\n")
+    self.write("sys/class/thermal/thermal_zone0/type", "battery\n")
+    self.write("sys/class/thermal/thermal_zone0/temp", "31000\n")
+    self.write("sys/class/thermal/thermal_zone1/type", "coretemp\n")  # already seen in hwmon
+    self.write("sys/class/thermal/thermal_zone1/temp", "99000\n")
+    self.write("sys/class/power_supply/battery/capacity", "87\n")
+    self.write("sys/class/power_supply/battery/status", "Discharging\n")
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def write(self, path, dat):
+    path = os.path.join(self.tmp.name, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # in place, like sysfs updates the open file
+    with open(path, "r+" if os.path.exists(path) else "w") as f:
+      f.write(dat)
+      f.truncate()
+
+  def stats(self, **kwargs):
+    return HardwareStats(proc=self.proc, sys=self.sys, **kwargs)
+
+  def test_cpu_memory(self):
+    hw = self.stats()
+    self.assertEqual(hw.memory_usage_percent(), 75.)
+    self.assertEqual(hw.cpu_usage_percent(), [0., 0.])
+
+    # cpu0 busy for 50 of 100 jiffies, cpu1 idle, with guest time that is already in user
+    self.write("proc/stat", STAT.replace("cpu0 100 0 100 500 50", "cpu0 150 0 100 530 70 0 0 0 10")
+                                .replace("cpu1 300 0 100 500 50", "cpu1 300 0 100 600 50"))
+    self.assertEqual(hw.cpu_usage_percent(), [50., 0.])
+
+  def test_temperatures(self):
+    hw = self.stats()
+    self.assertEqual(hw.temperatures(), {"coretemp": [45., 47.5], "battery": [31.]})
+    self.write("sys/class/hwmon/hwmon0/temp1_input", "50000\n")
+    self.assertEqual(hw.temperatures()["coretemp"], [50., 47.5])
+
+  def test_slow_probes(self):
+    with mock.patch("system.hardware.hw_stats.time.monotonic", return_value=0.):
+      hw = self.stats(slow_interval=10.)
+      self.assertEqual(hw.battery(), Battery(87., False))
+      self.write("sys/class/power_supply/battery/capacity", "86\n")
+      self.assertEqual(hw.battery().percent, 87.)
+      free = hw.free_space_percent()
+      self.assertTrue(0 <= free <= 100)
+
+      with mock.patch("system.hardware.hw_stats.os.statvfs") as statvfs:
+        hw.free_space_percent()
+        statvfs.assert_not_called()
+
+    with mock.patch("system.hardware.hw_stats.time.monotonic", return_value=10.):
+      self.assertEqual(hw.battery().percent, 86.)
+
+    hw = self.stats(disk_path=os.path.join(self.tmp.name, "missing"))
+    self.assertEqual(hw.free_space_percent(default=100.), 100.)
+
+  def test_no_sensors(self):
+    hw = HardwareStats(proc=self.proc, sys=os.path.join(self.tmp.name, "empty"))
+    self.assertEqual(hw.temperatures(), {})
+    self.assertIsNone(hw.battery())
+
+  def test_matches_psutil(self):
+    hw = HardwareStats()
+    self.assertAlmostEqual(hw.memory_usage_percent(), psutil.virtual_memory().percent, delta=2.)
+    self.assertEqual(len(hw.cpu_usage_percent()), len(psutil.cpu_percent(percpu=True)))
+    self.assertEqual(set(hw.temperatures()), set(psutil.sensors_temperatures()))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -17,6 +17,13 @@ Usage:
   # Custom WebSocket port:
   WS_PORT=8867 python bridge_ws.py
 
+  # Decimated remote subscriber class (publishers run with REMOTE_SERVICES set):
+  WS_REMOTE_CLASS=1 DEVICE_ADDR=192.168.1.100 python bridge_ws.py
+
+  # Print latency percentiles of traced topics up to the websocket send
+  # (on the device, with the publishers also running MESSAGING_TRACE=1):
+  MESSAGING_TRACE=1 python bridge_ws.py
+
 Clients connect to ws://<bridge-ip>:8867 and receive JSON messages like:
   {"topic": "modelV2", "timestamp": 1234567890123, "data": {...}}
 
@@ -24,17 +31,61 @@ Clients can also send a subscription filter:
   {"subscribe": ["modelV2", "carState", "radarState"]}
 
 If no filter is sent, all topics are broadcast to the client.
+
+Streaming mode
+--------------
+A client can opt into delta-encoded streaming with per-topic rate limits:
+  {"subscribe": ["modelV2", "deviceState"], "mode": "stream",
+   "rates": {"modelV2": 20, "deviceState": 1}}
+
+Every topic update is converted and JSON-encoded once in the ZMQ worker and the
+same string is shared by all clients. Each topic periodically emits a keyframe
+(full data); the updates in between carry only the fields that differ from that
+keyframe:
+  {"type": "key", "topic": "modelV2", "key": 12, "seq": 480, "timestamp": ..., "valid": true, "data": {...}}
+  {"type": "delta", "topic": "modelV2", "key": 12, "seq": 481, "timestamp": ..., "valid": true,
+   "data": {"frameId": 1234, "position": {"x": [...]}}}
+
+Deltas are always relative to the keyframe, never to the previous delta, so a
+client that skips updates because of its rate limit can still apply any delta.
+Nested structs are diffed recursively, lists are replaced as a whole and keys
+that disappeared (e.g. a switched union) are listed under "__del__". A client
+always receives the current keyframe before the first delta built on top of it.
+
+Binary formats
+--------------
+The subscribe handshake also negotiates the wire format:
+  {"subscribe": ["modelV2"], "format": "msgpack"}
+
+  json     text frames as above (default)
+  msgpack  binary frames with the same structure as json, float lists are
+           packed as little-endian float32 arrays in msgpack ext type 1.
+           Works in both batch and stream mode. Needs the msgpack package,
+           without it the bridge falls back to json.
+  capnp    binary frames with the raw log.Event buffers exactly as received
+           from the SubSocket, each prefixed with its uint32 little-endian
+           length. The bridge does no dict conversion for these clients at all.
+
+The "subscribed" reply is always JSON text and carries the negotiated format.
+Rate limits apply to all formats. See tools/bridge_ws_client.py (Python) and
+tools/bridge_ws_client.js (browser) for reference decoders.
 """
 
 import os
 import sys
 import json
+import math
 import time
 import asyncio
 import signal
-import threading
+import struct
 from collections import defaultdict
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 # Add flowpilot to path
 BASEDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, BASEDIR)
@@ -44,12 +95,32 @@ os.chdir(BASEDIR)
 os.environ.setdefault("ZMQ_MESSAGING_PROTOCOL", "TCP")
 
 import cereal.messaging as messaging
+from cereal.messaging.aio import async_sub_sock
+from cereal.messaging.trace import TRACE, LatencyStats, TraceContext
+from cereal.converter import service_converter
 from cereal.services import service_list
 
 # WebSocket port - configurable via env
 WS_PORT = int(os.environ.get("WS_PORT", "8867"))
 WS_HOST = os.environ.get("WS_HOST", "0.0.0.0")
 
+# Streaming mode: seconds between keyframes of a topic
+KEYFRAME_INTERVAL = float(os.environ.get("WS_KEYFRAME_INTERVAL", "2.0"))
+# Max batches per second sent to one client, faster updates are coalesced.
+# Also the upper bound of client rates.
+SEND_RATE_HZ = float(os.environ.get("WS_SEND_RATE_HZ", "20"))
+# Subscribe to the decimated remote subscriber class (see REMOTE_SERVICES in
+# cereal.messaging) instead of the full rate publishers
+REMOTE_CLASS = os.environ.get("WS_REMOTE_CLASS", "0") == "1"
+# With MESSAGING_TRACE=1, seconds between latency reports of traced topics
+TRACE_REPORT_INTERVAL = float(os.environ.get("WS_TRACE_REPORT_INTERVAL", "10"))
+
+# Wire formats a client can negotiate in the subscribe handshake
+WIRE_FORMATS = ("json", "msgpack", "capnp")
+# msgpack format: float lists of at least this length are sent as float32 blobs
+PACKED_FLOATS_MIN_LEN = 4
+EXT_FLOAT32_ARRAY = 1
+
 # Topics relevant for visualization - grouped by purpose
 VISUALIZATION_TOPICS = [
     # Model output: lane lines, road edges, lead cars, path prediction
@@ -77,87 +148,275 @@ VISUALIZATION_TOPICS = [
     "driverMonitoringState",
     # Panda state
     "pandaStates",
+    # Per process CPU, memory and context switches (bridge_ws_client.py --procs)
+    "procLog",
 ]
 
 
-def capnp_to_dict(reader):
-    """Convert a capnp reader to a JSON-serializable dict."""
-    return _convert(reader)
+_MISSING = object()
 
 
-def _convert(obj):
-    """Recursively convert capnp objects to JSON-serializable types."""
-    if hasattr(obj, 'to_dict'):
-        try:
-            return obj.to_dict()
-        except Exception:
-            pass
+def dict_delta(base, new):
+    """Return the fields of `new` that differ from `base`.
 
-    if isinstance(obj, (bool, int, float, str, type(None))):
-        return obj
+    Nested dicts are diffed recursively, any other value (including lists) is
+    taken from `new` as a whole. Keys present in `base` but not in `new` are
+    listed under "__del__".
+    """
+    delta = {}
+    for k, v in new.items():
+        b = base.get(k, _MISSING)
+        if b is _MISSING:
+            delta[k] = v
+        elif isinstance(v, dict) and isinstance(b, dict):
+            sub = dict_delta(b, v)
+            if sub:
+                delta[k] = sub
+        elif v != b:
+            delta[k] = v
 
-    if isinstance(obj, bytes):
-        return None  # skip raw binary blobs
+    removed = [k for k in base if k not in new]
+    if removed:
+        delta["__del__"] = removed
+    return delta
 
-    if isinstance(obj, (list, tuple)):
-        return [_convert(item) for item in obj]
 
-    if hasattr(obj, 'items'):
-        return {k: _convert(v) for k, v in obj.items()}
+def _pack_floats(obj):
+    """Replace float lists by little-endian float32 blobs (msgpack ext type 1)."""
+    if isinstance(obj, dict):
+        return {k: _pack_floats(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        if len(obj) >= PACKED_FLOATS_MIN_LEN and all(type(v) is float for v in obj):
+            return msgpack.ExtType(EXT_FLOAT32_ARRAY, struct.pack("<%df" % len(obj), *obj))
+        return [_pack_floats(v) for v in obj]
+    return obj
 
-    # capnp list-like objects
-    if hasattr(obj, '__len__') and hasattr(obj, '__getitem__'):
-        try:
-            return [_convert(obj[i]) for i in range(len(obj))]
-        except Exception:
-            pass
 
-    return str(obj)
+def pack_msgpack(msg):
+    return msgpack.packb(_pack_floats(msg), use_bin_type=True)
 
 
-class ZMQBridgeWorker(threading.Thread):
-    """Background thread that subscribes to ZMQ and queues messages."""
+ENCODERS = {
+    "json": json.dumps,
+    "msgpack": pack_msgpack,
+}
+
+
+def parse_rates(rates):
+    """Rate limits of a subscribe request, entries that are not a positive number are skipped."""
+    ret = {}
+    if not isinstance(rates, dict):
+        return ret
+    for topic, hz in rates.items():
+        try:
+            hz = float(hz)
+        except (TypeError, ValueError):
+            continue
+        if hz > 0 and math.isfinite(hz):
+            ret[topic] = hz
+    return ret
+
+
+def encode_batch(frames, fmt="json"):
+    """Wrap pre-encoded messages into a batch without re-encoding them."""
+    if fmt == "json":
+        return '{"type": "batch", "count": %d, "messages": [%s]}' % (len(frames), ", ".join(frames))
+    if fmt == "msgpack":
+        packer = msgpack.Packer(use_bin_type=True)
+        return b"".join([packer.pack_map_header(3),
+                         packer.pack("type"), packer.pack("batch"),
+                         packer.pack("count"), packer.pack(len(frames)),
+                         packer.pack("messages"), packer.pack_array_header(len(frames)),
+                         *frames])
+    # capnp: raw log.Event buffers, each prefixed with its uint32 little-endian length
+    return b"".join(struct.pack("<I", len(f)) + f for f in frames)
+
+
+class Frame:
+    """A message dict plus its wire encodings, each produced on first use.
+
+    Frames are shared by all clients, so a message is encoded at most once per format.
+    The dict itself can be built on first use too, by passing build instead of msg.
+    """
+    __slots__ = ("_msg", "_build", "_encoded")
+
+    def __init__(self, msg=None, build=None):
+        self._msg = msg
+        self._build = build
+        self._encoded = {}
+
+    @property
+    def msg(self):
+        if self._msg is None:
+            self._msg = self._build()
+            self._build = None
+        return self._msg
+
+    def encode(self, fmt):
+        enc = self._encoded.get(fmt)
+        if enc is None:
+            enc = self._encoded[fmt] = ENCODERS[fmt](self.msg)
+        return enc
+
+
+class EncodedUpdate:
+    """Latest update of one topic, shared by all clients. Never modified once published."""
+    __slots__ = ("seq", "key_seq", "timestamp", "raw", "full", "keyframe", "frame")
+
+    def __init__(self, seq, key_seq, timestamp, raw, full=None, keyframe=None, frame=None):
+        self.seq = seq            # increments on every update of the topic
+        self.key_seq = key_seq    # seq of the keyframe `frame` is based on
+        self.timestamp = timestamp
+        self.raw = raw            # capnp format: log.Event bytes as received
+        self.full = full          # batch mode: complete message
+        self.keyframe = keyframe  # streaming mode: current keyframe
+        self.frame = frame        # streaming mode: keyframe or delta for this update
+
+    @property
+    def converted(self):
+        return self.full is not None
+
+
+class TopicEncoder:
+    """Keeps the keyframe state of one topic and builds its updates."""
+
+    def __init__(self, topic, keyframe_interval=KEYFRAME_INTERVAL):
+        self.topic = topic
+        self.keyframe_interval = keyframe_interval
+        self.seq = 0
+        self.key_seq = 0
+        self.key_data = None
+        self.key_time = 0.
+        self.keyframe = None
+
+    def raw_update(self, timestamp, raw):
+        """Update without dict conversion, used while only capnp clients are connected."""
+        self.seq += 1
+        return EncodedUpdate(self.seq, self.key_seq, timestamp, raw)
+
+    def convert(self, upd, valid, data, now=None):
+        """Return a copy of an update produced by raw_update with its dict frames attached."""
+        if now is None:
+            now = time.monotonic()
+
+        header = {"topic": self.topic, "seq": upd.seq, "timestamp": upd.timestamp, "valid": valid}
+
+        if self.key_data is None or (now - self.key_time) >= self.keyframe_interval:
+            self.key_seq = upd.seq
+            self.key_data = data
+            self.key_time = now
+            self.keyframe = Frame({"type": "key", "key": self.key_seq, **header, "data": data})
+            frame = self.keyframe
+        else:
+            # only diffed once a stream client sends it
+            key_seq, key_data = self.key_seq, self.key_data
+            frame = Frame(build=lambda: {"type": "delta", "key": key_seq, **header,
+                                         "data": dict_delta(key_data, data)})
+
+        return EncodedUpdate(upd.seq, self.key_seq, upd.timestamp, upd.raw,
+                             Frame({**header, "data": data}), self.keyframe, frame)
+
+    def encode(self, timestamp, valid, data, raw=None, now=None):
+        return self.convert(self.raw_update(timestamp, raw), valid, data, now=now)
+
+
+class ZMQBridgeWorker:
+    """Subscribes to ZMQ on the event loop and keeps the latest update per topic.
+
+    Sockets are awaited through their file descriptors (cereal.messaging.aio),
+    so updates reach the client send loops without a polling hop.
+    """
 
     def __init__(self, topics, addr="127.0.0.1"):
-        super().__init__(daemon=True)
         self.topics = topics
         self.addr = addr
-        self.latest = {}  # topic -> latest JSON-serializable data
-        self.lock = threading.Lock()
-        self.running = True
-
-    def run(self):
-        sm = messaging.SubMaster(self.topics, addr=self.addr)
-
-        while self.running:
-            sm.update(100)
-            updated = {}
-
-            for topic in self.topics:
-                if sm.updated[topic]:
+        self.latest = {}  # topic -> latest EncodedUpdate
+        self.encoders = {t: TopicEncoder(t) for t in topics}
+        # schema-compiled converters, built once at startup
+        self.converters = {t: service_converter(t) for t in topics}
+        self.changed = None  # asyncio.Event, replaced after every set to wake all waiters
+        self.tasks = []
+        # With only capnp clients (or none) connected the worker forwards raw
+        # bytes and skips the dict conversion entirely
+        self._need_dicts = True
+        # Latency of traced topics up to the websocket send. The hops are timed
+        # on the device clock, so only when running on the device itself
+        self.trace_stats = LatencyStats() if TRACE and addr == "127.0.0.1" else None
+        self.traces = {}  # topic -> (seq, TraceContext) of the latest update
+        self.next_trace_report = 0.
+
+    @property
+    def need_dicts(self):
+        return self._need_dicts
+
+    @need_dicts.setter
+    def need_dicts(self, need):
+        if need and not self._need_dicts:
+            # A client that needs dicts joined, convert what was only kept raw
+            # so slow topics (e.g. carParams) are available right away
+            for topic, upd in list(self.latest.items()):
+                if not upd.converted:
                     try:
-                        data = capnp_to_dict(sm[topic])
-                        msg = {
-                            "topic": topic,
-                            "timestamp": sm.logMonoTime[topic],
-                            "valid": sm.valid[topic],
-                            "data": data,
-                        }
-                        updated[topic] = msg
+                        self._publish(topic, self._convert(topic, upd))
                     except Exception as e:
+                        # left raw, the next update of the topic is converted
                         print(f"Error converting {topic}: {e}")
+        self._need_dicts = need
+
+    def _convert(self, topic, upd, evt=None):
+        if evt is None:
+            evt = messaging.log_from_bytes(upd.raw)
+        data = self.converters[topic](getattr(evt, topic))
+        return self.encoders[topic].convert(upd, evt.valid, data)
 
-            if updated:
-                with self.lock:
-                    self.latest.update(updated)
+    def _publish(self, topic, upd):
+        self.latest[topic] = upd
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    async def _topic_loop(self, topic):
+        sock = async_sub_sock(topic, addr=self.addr, conflate=True, raw=True, remote=REMOTE_CLASS)
+        try:
+            async for raw in sock:
+                try:
+                    # Building the reader is cheap, the dict conversion is what costs
+                    evt = messaging.log_from_bytes(raw)
+                    upd = self.encoders[topic].raw_update(evt.logMonoTime, raw)
+                    if self.trace_stats is not None and evt.trace.originMonoTime:
+                        self.traces[topic] = (upd.seq, TraceContext.received(evt, time.monotonic_ns()))
+                    if self._need_dicts:
+                        upd = self._convert(topic, upd, evt)
+                    self._publish(topic, upd)
+                except Exception as e:
+                    print(f"Error converting {topic}: {e}")
+        finally:
+            sock.close()
+
+    def start(self):
+        """Start receiving, must be called from the running event loop."""
+        self.changed = asyncio.Event()
+        self.tasks = [asyncio.create_task(self._topic_loop(t)) for t in self.topics]
 
     def get_latest(self):
-        with self.lock:
-            snapshot = dict(self.latest)
-        return snapshot
+        return dict(self.latest)
+
+    def record_sent(self, sent):
+        """Add the traces of the (topic, seq) updates that were just sent to a client."""
+        if self.trace_stats is None:
+            return
+        now = time.monotonic_ns()
+        for topic, seq in sent:
+            trace = self.traces.get(topic)
+            if trace is not None and trace[0] == seq:
+                self.trace_stats.add(trace[1], now, end_name="bridge_ws")
+
+        if now / 1e9 >= self.next_trace_report and self.trace_stats.samples:
+            self.next_trace_report = now / 1e9 + TRACE_REPORT_INTERVAL
+            print(self.trace_stats.report())
 
     def stop(self):
-        self.running = False
+        for task in self.tasks:
+            task.cancel()
 
 
 class WebSocketBridge:
@@ -166,12 +425,23 @@ class WebSocketBridge:
     def __init__(self, worker):
         self.worker = worker
         self.clients = {}  # websocket -> set of subscribed topics (empty = all)
+        self.modes = {}  # websocket -> "batch" or "stream"
+        self.rates = {}  # websocket -> {topic: max Hz}
+        self.formats = {}  # websocket -> one of WIRE_FORMATS
+        self.worker.need_dicts = False
+
+    def _update_need_dicts(self):
+        self.worker.need_dicts = any(fmt != "capnp" for fmt in self.formats.values())
 
     async def handler(self, websocket):
         """Handle a WebSocket client connection."""
         client_addr = websocket.remote_address
         print(f"Client connected: {client_addr}")
         self.clients[websocket] = set()  # empty = subscribe to all
+        self.modes[websocket] = "batch"
+        self.rates[websocket] = {}
+        self.formats[websocket] = "json"
+        self._update_need_dicts()
 
         try:
             # Start sending task
@@ -183,12 +453,33 @@ class WebSocketBridge:
                     msg = json.loads(message)
                     if "subscribe" in msg:
                         topics = set(msg["subscribe"])
+                        mode = msg.get("mode", "batch")
+                        if mode not in ("batch", "stream"):
+                            mode = "batch"
+                        rates = parse_rates(msg.get("rates", {}))
+                        fmt = msg.get("format", "json")
+                        if fmt not in WIRE_FORMATS or (fmt == "msgpack" and msgpack is None):
+                            fmt = "json"
+                        if fmt == "capnp":
+                            mode = "batch"  # raw events are never diffed
                         self.clients[websocket] = topics
-                        print(f"Client {client_addr} subscribed to: {topics}")
-                        # Send confirmation
+                        self.modes[websocket] = mode
+                        self.rates[websocket] = rates
+                        self.formats[websocket] = fmt
+                        self._update_need_dicts()
+                        # Restart the send loop so the new subscription starts from a clean
+                        # state, e.g. a stream client gets keyframes of topics already sent
+                        send_task.cancel()
+                        send_task = asyncio.create_task(self._send_loop(websocket))
+                        print(f"Client {client_addr} subscribed to: {topics} ({mode}, {fmt})")
+                        # Send confirmation, always as JSON text so the client can check the
+                        # negotiated format before the first binary frame arrives
                         await websocket.send(json.dumps({
                             "type": "subscribed",
-                            "topics": list(topics)
+                            "topics": list(topics),
+                            "mode": mode,
+                            "rates": rates,
+                            "format": fmt,
                         }))
                     elif "ping" in msg:
                         await websocket.send(json.dumps({"type": "pong"}))
@@ -207,36 +498,81 @@ class WebSocketBridge:
         finally:
             send_task.cancel()
             del self.clients[websocket]
+            del self.modes[websocket]
+            del self.rates[websocket]
+            del self.formats[websocket]
+            self._update_need_dicts()
             print(f"Client disconnected: {client_addr}")
 
     async def _send_loop(self, websocket):
-        """Send ZMQ data to a WebSocket client at ~20Hz."""
-        prev_timestamps = {}
+        """Send ZMQ data to a WebSocket client as it arrives, at most SEND_RATE_HZ batches/s."""
+        prev_seq = {}    # topic -> seq of the last update sent
+        prev_key = {}    # topic -> keyframe seq the client holds (stream mode)
+        last_sent = {}   # topic -> monotonic time of the last send
+        last_batch = 0.
         while True:
             try:
+                # Grab the event before reading the state, so updates that
+                # arrive while this batch is being built wake us up again
+                changed = self.worker.changed
                 latest = self.worker.get_latest()
                 subs = self.clients.get(websocket, set())
+                stream = self.modes.get(websocket) == "stream"
+                rates = self.rates.get(websocket, {})
+                fmt = self.formats.get(websocket, "json")
+                now = time.monotonic()
+                next_due = None  # earliest time a rate limited update may go out
 
                 batch = []
-                for topic, msg in latest.items():
+                sent = []
+                for topic, upd in latest.items():
                     # Filter by subscription
                     if subs and topic not in subs:
                         continue
                     # Only send if updated since last send
-                    ts = msg["timestamp"]
-                    if prev_timestamps.get(topic) == ts:
+                    if prev_seq.get(topic) == upd.seq:
+                        continue
+                    # Converted by the worker as soon as a non-capnp client joins
+                    if fmt != "capnp" and not upd.converted:
                         continue
-                    prev_timestamps[topic] = ts
-                    batch.append(msg)
+
+                    # Per-topic rate limit, skipped updates are never queued
+                    rate = rates.get(topic)
+                    if rate is not None and (now - last_sent.get(topic, 0.)) < (1. / rate):
+                        due = last_sent[topic] + 1. / rate
+                        next_due = due if next_due is None else min(next_due, due)
+                        continue
+                    prev_seq[topic] = upd.seq
+                    last_sent[topic] = now
+                    sent.append((topic, upd.seq))
+
+                    if fmt == "capnp":
+                        batch.append(upd.raw)
+                    elif not stream:
+                        batch.append(upd.full.encode(fmt))
+                    else:
+                        if prev_key.get(topic) != upd.key_seq:
+                            prev_key[topic] = upd.key_seq
+                            batch.append(upd.keyframe.encode(fmt))
+                            if upd.seq == upd.key_seq:
+                                continue
+                        batch.append(upd.frame.encode(fmt))
 
                 if batch:
-                    await websocket.send(json.dumps({
-                        "type": "batch",
-                        "count": len(batch),
-                        "messages": batch,
-                    }))
+                    await websocket.send(encode_batch(batch, fmt))
+                    last_batch = time.monotonic()
+                    self.worker.record_sent(sent)
+
+                # Updates arriving faster than SEND_RATE_HZ are coalesced into the next batch
+                delay = last_batch + 1. / SEND_RATE_HZ - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
 
-                await asyncio.sleep(0.05)  # 20 Hz
+                timeout = None if next_due is None else max(0., next_due - time.monotonic())
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
             except asyncio.CancelledError:
                 return
             except Exception:
@@ -250,6 +586,7 @@ class WebSocketBridge:
         print(f"Subscribing to {len(VISUALIZATION_TOPICS)} ZMQ topics")
         print(f"ZMQ target: {os.environ.get('DEVICE_ADDR', '127.0.0.1')}")
 
+        self.worker.start()
         async with websockets.serve(self.handler, WS_HOST, WS_PORT):
             print(f"Bridge ready. Connect clients to ws://<this-ip>:{WS_PORT}")
             await asyncio.Future()  # run forever
@@ -263,8 +600,6 @@ def main():
     print(f"Starting ZMQ subscriber for {len(topics)} topics -> {addr}")
 
     worker = ZMQBridgeWorker(topics, addr=addr)
-    worker.start()
-
     bridge = WebSocketBridge(worker)
 
     def signal_handler(sig, frame):
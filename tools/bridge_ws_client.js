@@ -0,0 +1,100 @@
+// Reference browser decoder for the PriusPilot WebSocket bridge (tools/bridge_ws.py).
+//
+// json and stream mode need nothing else. msgpack needs @msgpack/msgpack, capnp
+// frames are split here and can be read with the classes generated by
+// cereal/generate_javascript.sh (capnp-ts).
+//
+//   import { BridgeClient } from "./bridge_ws_client.js";
+//   const client = new BridgeClient("ws://192.168.1.100:8867", {
+//     topics: ["modelV2", "carState"], mode: "stream", format: "msgpack",
+//     rates: { modelV2: 20, carState: 10 },
+//   });
+//   client.onmessage = (topic, data, msg) => { ... };
+
+import { decode, ExtensionCodec } from "@msgpack/msgpack";
+
+const EXT_FLOAT32_ARRAY = 1;
+
+const extensionCodec = new ExtensionCodec();
+extensionCodec.register({
+  type: EXT_FLOAT32_ARRAY,
+  encode: () => null,
+  // copy, the view handed to the decoder is not guaranteed to be 4-byte aligned
+  decode: (data) => new Float32Array(data.slice().buffer),
+});
+
+// Split a capnp frame into the raw log.Event buffers.
+export function splitCapnpFrame(buffer) {
+  const view = new DataView(buffer);
+  const events = [];
+  let i = 0;
+  while (i < buffer.byteLength) {
+    const n = view.getUint32(i, true);
+    i += 4;
+    events.push(buffer.slice(i, i + n));
+    i += n;
+  }
+  return events;
+}
+
+export function decodeFrame(payload, format) {
+  if (format === "capnp") return splitCapnpFrame(payload);
+  const msg = format === "msgpack"
+    ? decode(new Uint8Array(payload), { extensionCodec })
+    : JSON.parse(payload);
+  return msg.type === "batch" ? msg.messages : [msg];
+}
+
+// Return base with a bridge delta applied, base itself is left untouched.
+export function applyDelta(base, delta) {
+  const out = { ...base };
+  for (const k of delta.__del__ || []) delete out[k];
+  for (const [k, v] of Object.entries(delta)) {
+    if (k === "__del__") continue;
+    const isStruct = (x) => x !== null && typeof x === "object" && !Array.isArray(x) && !ArrayBuffer.isView(x);
+    out[k] = isStruct(v) && isStruct(out[k]) ? applyDelta(out[k], v) : v;
+  }
+  return out;
+}
+
+export class BridgeClient {
+  constructor(url, { topics = [], mode = "batch", format = "json", rates = {} } = {}) {
+    this.keyframes = {};
+    this.format = format;
+    this.mode = mode;
+    this.onmessage = () => {};
+
+    this.ws = new WebSocket(url);
+    this.ws.binaryType = "arraybuffer";
+    this.ws.onopen = () => this.ws.send(JSON.stringify({ subscribe: topics, mode, format, rates }));
+    this.ws.onmessage = (ev) => this._handle(ev.data);
+  }
+
+  _handle(payload) {
+    if (typeof payload === "string" && this.format !== "json") {
+      const msg = JSON.parse(payload);  // control messages are always JSON text
+      if (msg.type === "subscribed") {
+        this.format = msg.format;
+        this.mode = msg.mode;
+      }
+      return;
+    }
+
+    for (const msg of decodeFrame(payload, this.format)) {
+      if (this.format === "capnp") {
+        this.onmessage(null, msg, msg);
+      } else if (msg.type === "subscribed") {
+        this.format = msg.format;
+        this.mode = msg.mode;
+      } else if (msg.type === "key") {
+        this.keyframes[msg.topic] = msg;
+        this.onmessage(msg.topic, msg.data, msg);
+      } else if (msg.type === "delta") {
+        const key = this.keyframes[msg.topic];
+        if (key && key.key === msg.key) this.onmessage(msg.topic, applyDelta(key.data, msg.data), msg);
+      } else if (msg.topic !== undefined) {
+        this.onmessage(msg.topic, msg.data, msg);
+      }
+    }
+  }
+}
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Reference client for the PriusPilot WebSocket bridge
+=====================================================
+Decodes every wire format and mode of tools/bridge_ws.py and prints a short
+summary of each received message.
+
+Usage:
+  python bridge_ws_client.py ws://192.168.1.100:8867 --topics modelV2 carState
+  python bridge_ws_client.py ws://192.168.1.100:8867 --format msgpack --mode stream \\
+      --rate modelV2=20 --rate deviceState=1
+  python bridge_ws_client.py ws://192.168.1.100:8867 --format capnp --topics carState
+  python bridge_ws_client.py ws://192.168.1.100:8867 --procs  # top of the managed processes
+
+The capnp format needs pycapnp and the cereal schemas on the path, msgpack
+needs the msgpack package. The json format has no extra dependencies.
+"""
+
+import os
+import sys
+import json
+import struct
+import asyncio
+import argparse
+
+EXT_FLOAT32_ARRAY = 1
+
+
+def _ext_hook(code, data):
+    import msgpack
+    if code == EXT_FLOAT32_ARRAY:
+        return list(struct.unpack("<%df" % (len(data) // 4), data))
+    return msgpack.ExtType(code, data)
+
+
+def decode_frame(payload, fmt):
+    """Decode one WebSocket frame into a list of messages."""
+    if fmt == "json":
+        msg = json.loads(payload)
+        return msg["messages"] if msg.get("type") == "batch" else [msg]
+
+    if fmt == "msgpack":
+        import msgpack
+        msg = msgpack.unpackb(payload, ext_hook=_ext_hook, raw=False)
+        return msg["messages"] if msg.get("type") == "batch" else [msg]
+
+    # capnp: sequence of uint32 length prefixed log.Event buffers
+    from cereal import log
+    msgs = []
+    i = 0
+    while i < len(payload):
+        n, = struct.unpack_from("<I", payload, i)
+        i += 4
+        msgs.append(log.Event.from_bytes(payload[i:i + n]))
+        i += n
+    return msgs
+
+
+def apply_delta(base, delta):
+    """Return `base` with a bridge delta applied, `base` itself is left untouched."""
+    out = dict(base)
+    for k in delta.get("__del__", []):
+        out.pop(k, None)
+    for k, v in delta.items():
+        if k == "__del__":
+            continue
+        if isinstance(v, dict) and isinstance(out.get(k), dict):
+            out[k] = apply_delta(out[k], v)
+        else:
+            out[k] = v
+    return out
+
+
+class StreamState:
+    """Rebuilds full topic data from stream mode keyframes and deltas."""
+
+    def __init__(self):
+        self.keyframes = {}  # topic -> (key seq, data)
+
+    def apply(self, msg):
+        """Return the full data for a stream message, None if its keyframe is missing."""
+        topic = msg["topic"]
+        if msg["type"] == "key":
+            self.keyframes[topic] = (msg["key"], msg["data"])
+            return msg["data"]
+
+        key = self.keyframes.get(topic)
+        if key is None or key[0] != msg["key"]:
+            return None
+        return apply_delta(key[1], msg["data"])
+
+
+def format_procs(proc_log, sort="cpuPercent"):
+    """A top like table of a procLog, busiest process first."""
+    lines = [f"{'PROCESS':<16} {'PID':>7} {'CPU%':>6} {'RSS MB':>8} {'THR':>4} "
+             f"{'VCSW/s':>7} {'ICSW/s':>7} {'MAJFLT':>6}"]
+    # deltas are per procLog, published at 2 Hz
+    for p in sorted(proc_log.get("procs", []), key=lambda p: -p.get(sort, 0)):
+        lines.append(f"{p.get('name', ''):<16} {p.get('pid', 0):>7} {p.get('cpuPercent', 0):>6.1f} "
+                     f"{p.get('memRss', 0) / 2**20:>8.1f} {p.get('numThreads', 0):>4} "
+                     f"{p.get('ctxSwitchesVoluntary', 0) * 2:>7} {p.get('ctxSwitchesInvoluntary', 0) * 2:>7} "
+                     f"{p.get('majorFaults', 0):>6}")
+    mem = proc_log.get("mem", {})
+    if mem.get("total"):
+        used = mem["total"] - mem.get("available", 0)
+        lines.append(f"memory {used / 2**20:.0f}/{mem['total'] / 2**20:.0f} MB")
+    return "\n".join(lines)
+
+
+async def run(url, topics, mode, fmt, rates, procs=False):
+    import websockets
+
+    async with websockets.connect(url, max_size=None) as ws:
+        await ws.send(json.dumps({"subscribe": topics, "mode": mode, "format": fmt, "rates": rates}))
+        # Data sent before the subscription took effect is skipped
+        while True:
+            payload = await ws.recv()
+            if isinstance(payload, str):
+                reply = json.loads(payload)
+                if reply.get("type") == "subscribed":
+                    break
+        fmt, mode = reply["format"], reply["mode"]
+        print(f"Subscribed: {reply}")
+
+        state = StreamState()
+        async for payload in ws:
+            if isinstance(payload, str) and fmt != "json":
+                print(payload)  # control messages are always JSON text
+                continue
+
+            for msg in decode_frame(payload, fmt):
+                if fmt == "capnp":
+                    print(f"{msg.which():<24} {msg.logMonoTime} ({len(msg.to_bytes())} bytes)")
+                    continue
+                if "topic" not in msg:
+                    print(msg)
+                    continue
+
+                data = state.apply(msg) if mode == "stream" else msg["data"]
+                if procs and msg["topic"] == "procLog" and data is not None:
+                    print("\033[2J\033[H" + format_procs(data), flush=True)
+                    continue
+                kind = msg.get("type", "full")
+                print(f"{msg['topic']:<24} {msg['timestamp']} {kind:<5} "
+                      f"{len(msg['data'])}/{len(data) if data is not None else '-'} fields")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reference client for tools/bridge_ws.py")
+    parser.add_argument("url", nargs="?", default="ws://127.0.0.1:8867")
+    parser.add_argument("--topics", nargs="*", default=[])
+    parser.add_argument("--mode", choices=["batch", "stream"], default="batch")
+    parser.add_argument("--format", choices=["json", "msgpack", "capnp"], default="json")
+    parser.add_argument("--rate", action="append", default=[], help="topic=Hz, can be repeated")
+    parser.add_argument("--procs", action="store_true", help="show procLog as a table of the managed processes")
+    args = parser.parse_args()
+
+    if args.procs:
+        args.topics, args.format = ["procLog"], "json"
+
+    if args.format == "capnp":
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    rates = {}
+    for r in args.rate:
+        topic, hz = r.split("=")
+        rates[topic] = float(hz)
+
+    try:
+        asyncio.run(run(args.url, args.topics, args.mode, args.format, rates, args.procs))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""Columnar export of rlogs and qlogs for vectorized analysis.
+
+Every service of a log becomes a table with one row per event, or one per
+frame for can and sendcan. Nested structs are flattened into dotted column
+names, and lists into fixed width array columns, padded to the longest row:
+
+  cols = load_columns(export_segment("rlog.bz2", ["carState", "modelV2"]), "modelV2")
+  cols["logMonoTime"], cols["laneLineProbs"]  # shapes (n,) and (n, 4)
+  cols["laneLines.y"]                          # (n, 4, 33)
+
+Columns are saved as .npy files in <log>.columns/<service>/ (the download
+cache for urls) and memory mapped when loaded, an export is only redone when
+the log changed. With format="parquet" a <service>.parquet file per service
+is written instead, which needs pyarrow.
+
+Padding and missing values are NaN for floats, 0 for integers, False for
+bools and "" for text and enums. Data fields are left out, except the frame
+bytes of can and sendcan, and so are columns wider than MAX_ELEMENTS.
+
+  python tools/lib/columnar.py <route, segment or log> --services carState modelV2 -j 8
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from cereal.converter import service_converter
+from tools.lib.logreader import LogReader
+from tools.lib.url_file import CACHE_DIR, hash_256
+
+VERSION = 1
+# elements per row, wider columns (e.g. raw model outputs) are not exported
+MAX_ELEMENTS = 4096
+CAN_SERVICES = ("can", "sendcan")
+FORMATS = ("npy", "parquet")
+
+
+def flatten(d: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+  """Flatten a converted struct into {column: value}. A list of structs becomes
+  one list valued column per field."""
+  out = {}
+  for k, v in d.items():
+    name = f"{prefix}{k}"
+    if isinstance(v, dict):
+      out.update(flatten(v, name + "."))
+    elif isinstance(v, list) and len(v) and isinstance(v[0], dict):
+      elems = [flatten(e) for e in v]
+      for key in dict.fromkeys(key for e in elems for key in e):
+        out[f"{name}.{key}"] = [e.get(key) for e in elems]
+    elif v is not None:
+      out[name] = v
+  return out
+
+
+def _shape(v) -> tuple:
+  if not isinstance(v, list):
+    return ()
+  inner: tuple = ()
+  for x in v:
+    inner = tuple(max(a, b) for a, b in itertools.zip_longest(inner, _shape(x), fillvalue=0))
+  return (len(v),) + inner
+
+
+def _scalar(v):
+  while isinstance(v, list):
+    v = next((x for x in v if x is not None and x != []), None)
+  return v
+
+
+def _fill(out, idx, v) -> None:
+  if v is None:
+    return
+  if not isinstance(v, list):
+    out[idx] = v
+  elif out.ndim == len(idx) + 1 and None not in v:
+    out[idx + (slice(0, len(v)),)] = v
+  else:
+    for i, x in enumerate(v):
+      _fill(out, idx + (i,), x)
+
+
+def to_column(values: List[Any]) -> Optional[np.ndarray]:
+  """Stack the values of one column into an array, padding lists. None if the
+  column is empty or too wide."""
+  shape: tuple = ()
+  sample = None
+  for v in values:
+    shape = tuple(max(a, b) for a, b in itertools.zip_longest(shape, _shape(v), fillvalue=0))
+    if sample is None:
+      sample = _scalar(v)
+  if sample is None or int(np.prod(shape)) > MAX_ELEMENTS:
+    return None
+
+  if isinstance(sample, str):
+    out = np.full((len(values),) + shape, "", dtype=object)
+  elif isinstance(sample, bool):
+    out = np.zeros((len(values),) + shape, dtype=bool)
+  elif isinstance(sample, int) and not any(isinstance(_scalar(v), float) for v in values):
+    out = np.zeros((len(values),) + shape, dtype=np.uint64 if sample >= 2**63 else np.int64)
+  else:
+    out = np.full((len(values),) + shape, np.nan)
+
+  for i, v in enumerate(values):
+    _fill(out, (i,), v)
+  return out.astype(str) if out.dtype == object else out
+
+
+def _can_rows(evt, service: str):
+  for frame in getattr(evt, service):
+    yield {"address": frame.address, "busTime": frame.busTime, "src": frame.src, "dat": list(frame.dat)}
+
+
+def extract(events: Iterable[Any], services: Iterable[str]) -> Dict[str, Dict[str, np.ndarray]]:
+  """{service: {column: array}} of the given services in events."""
+  services = set(services)
+  rows: Dict[str, List[Dict[str, Any]]] = {s: [] for s in services}
+  for evt in events:
+    s = evt.which()
+    if s not in services:
+      continue
+    if s in CAN_SERVICES:
+      rows[s] += [{"logMonoTime": evt.logMonoTime, **r} for r in _can_rows(evt, s)]
+    else:
+      row = flatten(service_converter(s)(getattr(evt, s)))
+      rows[s].append({"logMonoTime": evt.logMonoTime, "valid": evt.valid, **row})
+
+  tables = {}
+  for s, service_rows in rows.items():
+    names = dict.fromkeys(k for r in service_rows for k in r)
+    columns = {k: to_column([r.get(k) for r in service_rows]) for k in names}
+    tables[s] = {k: v for k, v in columns.items() if v is not None}
+  return tables
+
+
+def columns_dir(log_path: str) -> str:
+  if log_path.startswith(("http://", "https://", "cd:/")):
+    return os.path.join(CACHE_DIR, hash_256(log_path) + ".columns")
+  return log_path + ".columns"
+
+
+def _log_size(log_path: str) -> Optional[int]:
+  return None if log_path.startswith(("http://", "https://", "cd:/")) else os.path.getsize(log_path)
+
+
+def _read_meta(out_dir: str) -> Dict[str, Any]:
+  try:
+    with open(os.path.join(out_dir, "meta.json")) as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return {}
+
+
+def write_parquet(columns: Dict[str, np.ndarray], path: str) -> None:
+  import pyarrow as pa
+  import pyarrow.parquet as pq
+
+  arrays = {}
+  for name, col in columns.items():
+    arr = pa.array(col.reshape(-1))
+    for width in reversed(col.shape[1:]):
+      arr = pa.FixedSizeListArray.from_arrays(arr, width)
+    arrays[name] = arr
+  pq.write_table(pa.table(arrays), path)
+
+
+def export_segment(log_path: str, services: Iterable[str], out_dir: Optional[str] = None,
+                   fmt: str = "npy", force: bool = False) -> str:
+  """Export services of one log, returns the output directory. Services that
+  are already exported from the same log are skipped."""
+  if fmt not in FORMATS:
+    raise ValueError(f"unknown format {fmt}, expected one of {FORMATS}")
+  out_dir = out_dir or columns_dir(log_path)
+  size = _log_size(log_path)
+
+  meta = _read_meta(out_dir)
+  if force or meta.get("version") != VERSION or meta.get("source_size") != size:
+    shutil.rmtree(out_dir, ignore_errors=True)
+    meta = {"version": VERSION, "source_size": size, "services": {}}
+  todo = [s for s in services if f"{s}.{fmt}" not in meta["services"]]
+  if not todo:
+    return out_dir
+
+  lr = LogReader(log_path, stream=True, services=set(todo))
+  for s, columns in extract(lr, todo).items():
+    if fmt == "parquet":
+      os.makedirs(out_dir, exist_ok=True)
+      write_parquet(columns, os.path.join(out_dir, f"{s}.parquet"))
+    else:
+      service_dir = os.path.join(out_dir, s)
+      shutil.rmtree(service_dir, ignore_errors=True)
+      os.makedirs(service_dir)
+      for name, col in columns.items():
+        np.save(os.path.join(service_dir, f"{name}.npy"), col)
+    meta["services"][f"{s}.{fmt}"] = list(columns)
+
+  # written last, an interrupted export is redone
+  os.makedirs(out_dir, exist_ok=True)
+  with open(os.path.join(out_dir, "meta.json"), "w") as f:
+    json.dump(meta, f)
+  return out_dir
+
+
+def _export(args):
+  log_path, services, fmt, force = args
+  try:
+    return export_segment(log_path, services, fmt=fmt, force=force)
+  except Exception as e:  # a broken segment shouldn't stop the route
+    print(f"Error exporting {log_path}: {e}")
+    return None
+
+
+def export_route(log_paths: List[Optional[str]], services: Iterable[str], fmt: str = "npy",
+                 force: bool = False, processes: Optional[int] = None) -> List[Optional[str]]:
+  """Export every segment in parallel, missing or failed segments are None."""
+  services = list(services)
+  jobs = [(p, services, fmt, force) for p in log_paths if p is not None]
+  with multiprocessing.Pool(processes) as pool:
+    done = iter(pool.map(_export, jobs))
+  return [next(done) if p is not None else None for p in log_paths]
+
+
+def load_columns(out_dir: str, service: str, columns: Optional[Iterable[str]] = None,
+                 mmap: bool = True) -> Dict[str, np.ndarray]:
+  """Columns of an exported service, memory mapped unless mmap is False."""
+  names = _read_meta(out_dir).get("services", {}).get(f"{service}.npy")
+  if names is None:
+    raise KeyError(f"{service} is not exported in {out_dir}")
+  if columns is not None:
+    names = [n for n in names if n in set(columns)]
+  service_dir = os.path.join(out_dir, service)
+  return {n: np.load(os.path.join(service_dir, f"{n}.npy"), mmap_mode="r" if mmap else None) for n in names}
+
+
+def _pad_to(col: np.ndarray, shape: tuple) -> np.ndarray:
+  if col.shape[1:] == shape:
+    return col
+  fill = np.nan if col.dtype.kind == "f" else ("" if col.dtype.kind == "U" else 0)
+  out = np.full((len(col),) + shape, fill, dtype=col.dtype)
+  out[(slice(None),) + tuple(slice(0, n) for n in col.shape[1:])] = col
+  return out
+
+
+def load_route_columns(out_dirs: List[Optional[str]], service: str,
+                       columns: Optional[Iterable[str]] = None) -> Dict[str, np.ndarray]:
+  """Concatenate a service over the exported segments of a route. Segments are
+  padded to the widest, columns missing from a segment are left out."""
+  segments = [load_columns(d, service, columns) for d in out_dirs if d is not None]
+  if not segments:
+    return {}
+  names = [n for n in segments[0] if all(n in seg for seg in segments)]
+  ret = {}
+  for n in names:
+    cols = [seg[n] for seg in segments]
+    shape = tuple(max(dims) for dims in zip(*(c.shape[1:] for c in cols)))
+    ret[n] = np.concatenate([_pad_to(c, shape) for c in cols])
+  return ret
+
+
+def main():
+  from tools.lib.route import Route, SegmentName
+
+  parser = argparse.ArgumentParser(description="Export rlogs/qlogs to columnar tables",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("route_or_segment_name", help="route, segment or path to a log")
+  parser.add_argument("--services", nargs="+", required=True)
+  parser.add_argument("--qlog", action="store_true", help="export qlogs instead of rlogs")
+  parser.add_argument("--data_dir", help="local directory with the route")
+  parser.add_argument("--format", choices=FORMATS, default="npy")
+  parser.add_argument("--force", action="store_true", help="export again even if cached")
+  parser.add_argument("-j", "--processes", type=int, default=None)
+  args = parser.parse_args()
+
+  name = args.route_or_segment_name
+  if name.startswith(("http://", "https://", "cd:/")) or os.path.isfile(name):
+    logs = [name]
+  else:
+    sn = SegmentName(name, allow_route_name=True)
+    r = Route(sn.route_name.canonical_name, args.data_dir)
+    logs = r.qlog_paths() if args.qlog else r.log_paths()
+    if sn.segment_num >= 0:
+      logs = logs[sn.segment_num:sn.segment_num + 1]
+
+  for log_path, out_dir in zip(logs, export_route(logs, args.services, args.format, args.force, args.processes)):
+    if out_dir is not None:
+      print(f"{log_path} -> {out_dir}")
+
+
+if __name__ == "__main__":
+  main()
@@ -1,32 +1,303 @@
 #!/usr/bin/env python3
+import io
 import os
 import sys
 import bz2
+import mmap
+import array
+import struct
 import urllib.parse
 import capnp
 import warnings
+import numpy as np
 
 
 from cereal import log as capnp_log
+from cereal.event_header import EVENT_IDS, event_header, message_size
+from common.file_helpers import atomic_write_in_dir
 from tools.lib.filereader import FileReader
 from tools.lib.route import Route, SegmentName
+from tools.lib.url_file import CACHE_DIR, hash_256
+
+# compressed bytes read at a time when streaming
+READ_SIZE = 1 << 20
+NO_TRAVERSAL_LIMIT = 2**64-1
+INDEX_MAGIC = b"LOGIDX01"
+# log size, events, bz2 frames, compressed
+INDEX_HEADER = struct.Struct("<QII?")
+
+
+def _decompress_stream(f, compressed=None, frames=None):
+  """Yield the decompressed contents of f in chunks. compressed=None detects
+  bz2 from the first bytes, concatenated bz2 streams are supported and their
+  (compressed, decompressed) start offsets are appended to frames."""
+  dat = f.read(READ_SIZE)
+  if compressed is None:
+    compressed = dat.startswith(b'BZh9')
+  if not compressed:
+    while dat:
+      yield dat
+      dat = f.read(READ_SIZE)
+    return
+
+  # bounded output per call, rlogs compress well
+  d = bz2.BZ2Decompressor()
+  read, written = len(dat), 0
+  if frames is not None:
+    frames.append((0, 0))
+  while dat or not d.needs_input:
+    out = d.decompress(dat, max_length=READ_SIZE)
+    written += len(out)
+    if out:
+      yield out
+    if d.eof:
+      dat, d = d.unused_data, bz2.BZ2Decompressor()
+      if not dat:
+        dat = f.read(READ_SIZE)
+        read += len(dat)
+      if dat and frames is not None:
+        frames.append((read - len(dat), written))
+    elif d.needs_input:
+      dat = f.read(READ_SIZE)
+      read += len(dat)
+    else:
+      dat = b''
+
+
+def _skip(chunks, n):
+  for chunk in chunks:
+    if n >= len(chunk):
+      n -= len(chunk)
+      continue
+    yield chunk[n:] if n else chunk
+    n = 0
+
+
+def _messages(chunks):
+  """Yield (offset, buf, pos, size) of every message in a stream of
+  decompressed chunks, holding at most one chunk plus one message in memory."""
+  buf = b''
+  pos = 0
+  offset = 0
+  for chunk in chunks:
+    buf = buf[pos:] + chunk
+    pos = 0
+    while True:
+      size = message_size(buf, pos)
+      if size is None or pos + size > len(buf):
+        break
+      yield offset, buf, pos, size
+      pos += size
+      offset += size
+
+  if pos < len(buf):
+    warnings.warn("Corrupted events detected", RuntimeWarning)
+
+
+def iter_events(chunks, services=None):
+  """Yield log.Event readers from a stream of decompressed chunks. Events whose
+  type is not in services are skipped before a reader is built."""
+  for _, buf, pos, size in _messages(chunks):
+    if services is not None:
+      header = event_header(buf, pos)
+      if header is not None and header[0] not in services:
+        continue
+
+    try:
+      evt = capnp_log.Event.from_bytes(buf[pos:pos + size], traversal_limit_in_words=NO_TRAVERSAL_LIMIT)
+      if services is not None and evt.which() not in services:
+        continue
+    except capnp.KjException:
+      warnings.warn("Corrupted events detected", RuntimeWarning)
+      return
+    yield evt
+
+
+def iter_raw_events(chunks, services=None, exclude=()):
+  """Yield (which, message) of the events in a stream of decompressed chunks,
+  filtered like iter_events but without building readers. message is a view
+  of the serialized log.Event, e.g. to write a filtered log."""
+  for _, buf, pos, size in _messages(chunks):
+    header = event_header(buf, pos)
+    if header is not None:
+      which = header[0]
+    else:
+      try:
+        which = capnp_log.Event.from_bytes(buf[pos:pos + size], traversal_limit_in_words=NO_TRAVERSAL_LIMIT).which()
+      except capnp.KjException:
+        warnings.warn("Corrupted events detected", RuntimeWarning)
+        return
+    if (services is not None and which not in services) or which in exclude:
+      continue
+    yield which, memoryview(buf)[pos:pos + size]
+
+
+class LogIndex:
+  """logMonoTime, type and decompressed offset of every event of a log, and
+  the start of every bz2 frame, so a reader can start at any event by
+  decompressing only from the frame before it. Saved next to the log as
+  <log>.idx (or in the download cache for urls) and rebuilt when the log size
+  changes, e.g. an rlog that loggerd is still writing."""
+
+  def __init__(self, mono_time, offset, which, frames, compressed, size):
+    self.mono_time = mono_time
+    self.offset = offset
+    self.which = which
+    self.frames = frames  # (compressed, decompressed) offsets, shape (n, 2)
+    self.compressed = compressed
+    self.size = size
+    # logs are only roughly in time order, seek on the running maximum
+    self._max_time = np.maximum.accumulate(mono_time) if len(mono_time) else mono_time
+    self._service_offsets = {}
+
+  @classmethod
+  def build(cls, f, size, compressed=None):
+    """Index the log read from f, size is the size of the file on disk."""
+    frames = []
+    mono_time, offset, which = array.array('Q'), array.array('Q'), array.array('H')
+    for off, buf, pos, msg_size in _messages(_decompress_stream(f, compressed, frames)):
+      header = event_header(buf, pos)
+      if header is None:
+        try:
+          evt = capnp_log.Event.from_bytes(buf[pos:pos + msg_size], traversal_limit_in_words=NO_TRAVERSAL_LIMIT)
+          header = evt.which(), evt.logMonoTime, evt.valid
+        except capnp.KjException:
+          warnings.warn("Corrupted events detected", RuntimeWarning)
+          break
+      mono_time.append(header[1])
+      offset.append(off)
+      which.append(EVENT_IDS[header[0]])
+
+    # frames is only filled for bz2, a raw log is read from any offset
+    compressed = len(frames) > 0
+    return cls(np.frombuffer(mono_time, dtype=np.uint64), np.frombuffer(offset, dtype=np.uint64),
+               np.frombuffer(which, dtype=np.uint16), np.array(frames or [(0, 0)], dtype=np.uint64).reshape(-1, 2),
+               compressed, size)
+
+  def save(self, path):
+    with atomic_write_in_dir(path, mode="wb", overwrite=True) as f:
+      f.write(INDEX_MAGIC)
+      f.write(INDEX_HEADER.pack(self.size, len(self.offset), len(self.frames), self.compressed))
+      for a, dtype in ((self.frames, '<u8'), (self.mono_time, '<u8'), (self.offset, '<u8'), (self.which, '<u2')):
+        f.write(a.astype(dtype).tobytes())
+
+  @classmethod
+  def load(cls, path, size):
+    """The saved index, None if there is none or it is for another size."""
+    try:
+      with open(path, "rb") as f:
+        dat = f.read()
+    except OSError:
+      return None
+    if not dat.startswith(INDEX_MAGIC) or len(dat) < len(INDEX_MAGIC) + INDEX_HEADER.size:
+      return None
+    log_size, n_events, n_frames, compressed = INDEX_HEADER.unpack_from(dat, len(INDEX_MAGIC))
+    if log_size != size:
+      return None
+
+    pos = len(INDEX_MAGIC) + INDEX_HEADER.size
+    arrays = []
+    for dtype, n in (('<u8', 2 * n_frames), ('<u8', n_events), ('<u8', n_events), ('<u2', n_events)):
+      arrays.append(np.frombuffer(dat, dtype=dtype, count=n, offset=pos))
+      pos += arrays[-1].nbytes
+    frames, mono_time, offset, which = arrays
+    return cls(mono_time, offset, which, frames.reshape(-1, 2), compressed, size)
+
+  @classmethod
+  def for_log(cls, fn):
+    """Load the index of a log, or build and save it on first use."""
+    if fn.startswith(("http://", "https://", "cd:/")):
+      with FileReader(fn) as f:
+        size = f.get_length()
+      path = os.path.join(CACHE_DIR, hash_256(fn) + "_idx")
+    else:
+      size = os.path.getsize(fn)
+      path = fn + ".idx"
+
+    idx = cls.load(path, size)
+    if idx is None:
+      with FileReader(fn) as f:
+        idx = cls.build(f, size)
+      try:
+        idx.save(path)
+      except OSError:
+        pass  # read only log directory, keep it in memory
+    return idx
+
+  def __len__(self):
+    return len(self.offset)
+
+  @property
+  def start_time(self):
+    return int(self.mono_time[0]) if len(self) else 0
+
+  def index_at_time(self, t):
+    """Index of the first event at or after logMonoTime t, where a linear scan
+    from the start of the log would stop."""
+    return int(np.searchsorted(self._max_time, t, side='left'))
+
+  def offset_of(self, i):
+    """Decompressed offset of event i, None past the last event."""
+    return int(self.offset[i]) if i < len(self) else None
+
+  def nth(self, service, n):
+    """Index of the nth event of a service, None if there are fewer."""
+    if service not in self._service_offsets:
+      self._service_offsets[service] = np.flatnonzero(self.which == EVENT_IDS[service])
+    idxs = self._service_offsets[service]
+    return int(idxs[n]) if -len(idxs) <= n < len(idxs) else None
+
+  def frame(self, offset):
+    """(compressed, decompressed) offset of the frame holding a decompressed offset."""
+    i = int(np.searchsorted(self.frames[:, 1], offset, side='right')) - 1
+    return int(self.frames[i, 0]), int(self.frames[i, 1])
+
+
+class MappedEvents:
+  """log.Event readers over a memory mapped, uncompressed log. An event is
+  parsed in place from the mapping when it is accessed, nothing is copied."""
+
+  def __init__(self, buf, offsets, sizes):
+    self._buf = memoryview(buf)
+    self._offsets = offsets
+    self._sizes = sizes
+
+  def __len__(self):
+    return len(self._offsets)
+
+  def __getitem__(self, i):
+    if isinstance(i, slice):
+      return [self[j] for j in range(*i.indices(len(self)))]
+    offset = int(self._offsets[i])
+    return capnp_log.Event.from_bytes(self._buf[offset:offset + int(self._sizes[i])],
+                                      traversal_limit_in_words=NO_TRAVERSAL_LIMIT)
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self[i]
+
 
 # this is an iterator itself, and uses private variables from LogReader
 class MultiLogIterator:
-  def __init__(self, log_paths, sort_by_time=False):
+  def __init__(self, log_paths, sort_by_time=False, mmap=False):
     self._log_paths = log_paths
     self.sort_by_time = sort_by_time
+    self.mmap = mmap
 
     self._first_log_idx = next(i for i in range(len(log_paths)) if log_paths[i] is not None)
     self._current_log = self._first_log_idx
     self._idx = 0
     self._log_readers = [None]*len(log_paths)
+    # (segment, reader) starting at the last seek, until iteration leaves that segment
+    self._seek_reader = None
     self.start_time = self._log_reader(self._first_log_idx)._ts[0]
 
   def _log_reader(self, i):
+    if self._seek_reader is not None and self._seek_reader[0] == i:
+      return self._seek_reader[1]
     if self._log_readers[i] is None and self._log_paths[i] is not None:
       log_path = self._log_paths[i]
-      self._log_readers[i] = LogReader(log_path, sort_by_time=self.sort_by_time)
+      self._log_readers[i] = LogReader(log_path, sort_by_time=self.sort_by_time, mmap=self.mmap)
 
     return self._log_readers[i]
 
@@ -39,6 +310,7 @@ class MultiLogIterator:
       self._idx += 1
     else:
       self._idx = 0
+      self._seek_reader = None
       self._current_log = next(i for i in range(self._current_log + 1, len(self._log_readers) + 1)
                                if i == len(self._log_readers) or self._log_paths[i] is not None)
       if self._current_log == len(self._log_readers):
@@ -63,20 +335,44 @@ class MultiLogIterator:
 
     self._current_log = minute
 
-    # HACK: O(n) seek afterward
+    # only parse the segment from the first event at or after ts, the index is
+    # built (or loaded) here, plain iteration never needs it
+    log_path = self._log_paths[minute]
+    start = LogIndex.for_log(log_path).index_at_time(self.start_time + int(ts * 1e9))
+    # not cached, later passes through the segment need all of it
+    lr = LogReader(log_path, sort_by_time=self.sort_by_time, start=start, mmap=self.mmap)
+    self._seek_reader = (minute, lr)
     self._idx = 0
-    while self.tell() < ts:
+    if not lr._ents:
+      self._idx = -1
       self._inc()
     return True
 
   def reset(self):
-    self.__init__(self._log_paths, sort_by_time=self.sort_by_time)
+    self.__init__(self._log_paths, sort_by_time=self.sort_by_time, mmap=self.mmap)
 
 
 class LogReader:
-  def __init__(self, fn, canonicalize=True, only_union_types=False, sort_by_time=False, dat=None):
+  def __init__(self, fn, canonicalize=True, only_union_types=False, sort_by_time=False, dat=None,
+               stream=False, services=None, start=None, mmap=False):
+    """stream: decompress and parse while iterating instead of loading the
+    whole log, memory stays bounded by the largest message. Every iteration
+    reads the log again, and events can't be sorted.
+    services: only keep events of these types, e.g. {'carState', 'can'}.
+    start: begin at this event of the log's LogIndex, e.g. from index_at_time
+    or nth, decompressing only from the bz2 frame holding it.
+    mmap: memory map a local uncompressed rlog and parse events in place when
+    they are accessed, with the LogIndex giving their offsets. Opening takes
+    milliseconds once the index is saved, and processes reading the same log
+    share the page cache. Ignored for compressed and remote logs."""
     self.data_version = None
     self._only_union_types = only_union_types
+    self._fn = fn
+    self._dat = dat
+    self._services = set(services) if services is not None else None
+    self._stream = stream
+    self._start = start
+    self._index = None
 
     ext = None
     if not dat:
@@ -84,31 +380,112 @@ class LogReader:
       if ext not in ('', '.bz2'):
         # old rlogs weren't bz2 compressed
         raise Exception(f"unknown extension {ext}")
+    self._compressed = True if ext == ".bz2" else None
 
-      with FileReader(fn) as f:
-        dat = f.read()
+    if stream:
+      if sort_by_time:
+        raise ValueError("a streaming LogReader can't sort by time")
+      self._ents = None
+      self._ts = None
+      return
 
-    if ext == ".bz2" or dat.startswith(b'BZh9'):
-      dat = bz2.decompress(dat)
+    if mmap and self._mappable():
+      self._map(sort_by_time)
+      return
 
-    ents = capnp_log.Event.read_multiple_bytes(dat)
+    if self._services is not None or start:
+      _ents = list(self._iter_stream())
+    else:
+      if not dat:
+        with FileReader(fn) as f:
+          dat = f.read()
 
-    _ents = []
-    try:
-      for e in ents:
-        _ents.append(e)
-    except capnp.KjException:
-      warnings.warn("Corrupted events detected", RuntimeWarning)
+      if ext == ".bz2" or dat.startswith(b'BZh9'):
+        dat = bz2.decompress(dat)
+
+      ents = capnp_log.Event.read_multiple_bytes(dat)
 
+      _ents = []
+      try:
+        for e in ents:
+          _ents.append(e)
+      except capnp.KjException:
+        warnings.warn("Corrupted events detected", RuntimeWarning)
+
+    self._dat = None
     self._ents = list(sorted(_ents, key=lambda x: x.logMonoTime) if sort_by_time else _ents)
     self._ts = [x.logMonoTime for x in self._ents]
 
+  def _mappable(self):
+    if self._dat or self._fn.startswith(("http://", "https://", "cd:/")) or self._compressed:
+      return False
+    with open(self._fn, "rb") as f:
+      return not f.read(4).startswith(b'BZh9')
+
+  def _map(self, sort_by_time):
+    index = self._index = LogIndex.for_log(self._fn)
+    with open(self._fn, "rb") as f:
+      size = os.fstat(f.fileno()).st_size
+      buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    # the index stops before a corrupted event
+    offsets = index.offset
+    ends = np.append(offsets[1:], offsets[-1] + message_size(buf, int(offsets[-1]))) if len(offsets) else offsets
+    keep = np.arange(self._start or 0, len(index))
+    if self._services is not None:
+      ids = [EVENT_IDS[s] for s in self._services if s in EVENT_IDS]
+      keep = keep[np.isin(index.which[keep], ids)]
+    if sort_by_time:
+      keep = keep[np.argsort(index.mono_time[keep], kind='stable')]
+
+    self._ents = MappedEvents(buf, offsets[keep], (ends - offsets)[keep])
+    self._ts = index.mono_time[keep].tolist()
+
+  @property
+  def index(self):
+    if self._index is None:
+      if self._dat:
+        self._index = LogIndex.build(io.BytesIO(self._dat), len(self._dat), self._compressed)
+      else:
+        self._index = LogIndex.for_log(self._fn)
+    return self._index
+
+  def _chunks(self, f):
+    if not self._start:
+      return _decompress_stream(f, self._compressed)
+
+    offset = self.index.offset_of(self._start)
+    if offset is None:
+      return iter(())
+    if not self.index.compressed:
+      f.seek(offset)
+      return _decompress_stream(f, False)
+    frame, frame_offset = self.index.frame(offset)
+    f.seek(frame)
+    return _skip(_decompress_stream(f, True), offset - frame_offset)
+
+  def _iter_stream(self):
+    if self._dat:
+      yield from iter_events(self._chunks(io.BytesIO(self._dat)), self._services)
+      return
+    with FileReader(self._fn) as f:
+      yield from iter_events(self._chunks(f), self._services)
+
+  def iter_raw(self, exclude=()):
+    """(which, message) of the log's events, see iter_raw_events. Use with
+    stream=True so the log isn't also parsed up front."""
+    if self._dat:
+      yield from iter_raw_events(self._chunks(io.BytesIO(self._dat)), self._services, exclude)
+      return
+    with FileReader(self._fn) as f:
+      yield from iter_raw_events(self._chunks(f), self._services, exclude)
+
   @classmethod
   def from_bytes(cls, dat):
     return cls("", dat=dat)
 
   def __iter__(self):
-    for ent in self._ents:
+    for ent in self._iter_stream() if self._stream else self._ents:
       if self._only_union_types:
         try:
           ent.which()
@@ -0,0 +1,111 @@
+"""Map/reduce over the segments of a route on a process pool.
+
+  def can_addresses(seg):
+    return Counter(c.address for e in seg.events for c in e.can)
+
+  counts = map_route(can_addresses, Route(name).log_paths(), reduce=operator.add,
+                     initial=Counter(), services={"can"})
+
+fn is called with a Segment in a worker process, so it and its result must be
+picklable (fn defined at module level). Results are returned, or folded by
+reduce, in segment order; missing segments are skipped by reduce and are None
+in the returned list.
+
+Segments are processed independently. Stateful estimators (paramsd,
+torqued, calibrationd offline) get the last `warmup` seconds of the previous
+segment as seg.warmup to converge on before seg.events, state that needs the
+whole history should be reduced from per segment summaries instead.
+
+With cache_key the result of every segment is saved in the download cache and
+reused while the log is unchanged, change the key when fn changes.
+"""
+import multiprocessing
+import os
+import pickle
+from hashlib import sha256
+from typing import Any, Callable, Iterable, List, NamedTuple, Optional
+
+from tqdm import tqdm
+
+from common.file_helpers import atomic_write_in_dir, mkdirs_exists_ok
+from tools.lib.logreader import LogIndex, LogReader
+from tools.lib.url_file import CACHE_DIR
+
+
+class Segment(NamedTuple):
+  num: int
+  path: str
+  events: Iterable[Any]  # streaming LogReader, reads the log again on every iteration
+  warmup: Iterable[Any]  # end of the previous segment, empty for the first
+
+
+def _is_remote(path: str) -> bool:
+  return path.startswith(("http://", "https://", "cd:/"))
+
+
+def _cache_path(cache_key: str, path: str, services, warmup: float) -> str:
+  # remote logs don't change once uploaded
+  size = None if _is_remote(path) else os.path.getsize(path)
+  key = repr((cache_key, path.split("?")[0], size, sorted(services or []), warmup))
+  return os.path.join(CACHE_DIR, "route_map", sha256(key.encode()).hexdigest())
+
+
+def _warmup(prev_path: Optional[str], services, warmup: float) -> Iterable[Any]:
+  if prev_path is None or warmup <= 0:
+    return []
+  idx = LogIndex.for_log(prev_path)
+  if not len(idx):
+    return []
+  start = idx.index_at_time(int(idx.mono_time.max()) - int(warmup * 1e9))
+  return LogReader(prev_path, stream=True, services=services, start=start)
+
+
+def _run(args):
+  fn, num, path, prev_path, services, warmup, cache_key = args
+  cache_path = _cache_path(cache_key, path, services, warmup) if cache_key is not None else None
+  if cache_path is not None and os.path.exists(cache_path):
+    with open(cache_path, "rb") as f:
+      return pickle.load(f)
+
+  events = LogReader(path, stream=True, services=services)
+  ret = fn(Segment(num, path, events, _warmup(prev_path, services, warmup)))
+
+  if cache_path is not None:
+    mkdirs_exists_ok(os.path.dirname(cache_path))
+    with atomic_write_in_dir(cache_path, mode="wb", overwrite=True) as f:
+      pickle.dump(ret, f)
+  return ret
+
+
+def map_route(fn: Callable[[Segment], Any], log_paths: List[Optional[str]],
+              reduce: Optional[Callable[[Any, Any], Any]] = None, initial: Any = None,
+              services: Optional[Iterable[str]] = None, warmup: float = 0.,
+              processes: Optional[int] = None, cache_key: Optional[str] = None, progress: bool = False) -> Any:
+  """Run fn on every segment of log_paths (Route.log_paths() or qlog_paths()).
+  services: only these event types are parsed, for both events and warmup.
+  processes: pool size, all cores by default and no pool for 1."""
+  services = set(services) if services is not None else None
+  jobs = [(fn, i, path, log_paths[i - 1] if i > 0 else None, services, warmup, cache_key)
+          for i, path in enumerate(log_paths) if path is not None]
+
+  if processes == 1:
+    results = map(_run, jobs)
+    pool = None
+  else:
+    pool = multiprocessing.Pool(processes)
+    results = pool.imap(_run, jobs)
+
+  try:
+    done = {}
+    for (_, i, *_), ret in tqdm(zip(jobs, results), total=len(jobs), disable=not progress):
+      if reduce is not None:
+        initial = reduce(initial, ret)
+      else:
+        done[i] = ret
+  finally:
+    if pool is not None:
+      pool.terminate()
+
+  if reduce is not None:
+    return initial
+  return [done.get(i) for i in range(len(log_paths))]
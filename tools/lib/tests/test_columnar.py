@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+import bz2
+import os
+import tempfile
+import unittest
+import numpy as np
+
+from cereal import log
+from tools.lib.columnar import export_route, export_segment, flatten, load_columns, load_route_columns, to_column
+from tools.lib.tests.test_logreader import make_log
+
+
+class TestColumnar(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.rlog = self._write_log("rlog.bz2", make_log())
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def _write_log(self, name, dat):
+    path = os.path.join(self.tmp.name, name)
+    with open(path, "wb") as f:
+      f.write(bz2.compress(dat))
+    return path
+
+  def test_flatten(self):
+    d = {"a": 1, "b": {"c": [1, 2], "d": None}, "e": [{"x": 1, "y": {"z": 2}}, {"x": 3}]}
+    self.assertEqual(flatten(d), {"a": 1, "b.c": [1, 2], "e.x": [1, 3], "e.y.z": [2, None]})
+
+  def test_to_column(self):
+    np.testing.assert_equal(to_column([[1., 2.], [3.], None]), [[1., 2.], [3., np.nan], [np.nan, np.nan]])
+    self.assertEqual(to_column([1, 2**40]).dtype, np.int64)
+    self.assertEqual(to_column([2**64 - 1, 1]).dtype, np.uint64)
+    self.assertEqual(to_column([1, 2.5]).dtype, np.float64)
+    self.assertEqual(to_column(["a", None, "bcd"]).tolist(), ["a", "", "bcd"])
+    self.assertEqual(to_column([[[1, 2], [3]], []]).shape, (2, 2, 2))
+    self.assertIsNone(to_column([None, []]))
+    self.assertIsNone(to_column([list(range(5000))]))
+
+  def test_export(self):
+    out = export_segment(self.rlog, ["carState", "modelV2", "can"])
+    self.assertEqual(out, self.rlog + ".columns")
+
+    cs = load_columns(out, "carState")
+    self.assertIsInstance(cs["vEgo"], np.memmap)
+    np.testing.assert_equal(cs["vEgo"], np.arange(0, 300, 3))
+    self.assertTrue(np.all(np.diff(cs["logMonoTime"].astype(np.int64)) > 0))
+    self.assertEqual(cs["gearShifter"][0], "unknown")
+
+    model = load_columns(out, "modelV2", ["frameId", "laneLineProbs"])
+    self.assertEqual(set(model), {"frameId", "laneLineProbs"})
+    self.assertEqual(model["laneLineProbs"].shape, (100, 4))
+
+    # one row per frame
+    can = load_columns(out, "can")
+    self.assertEqual(can["address"].shape, (500,))
+    self.assertEqual(can["dat"].shape, (500, 8))
+    self.assertEqual(can["dat"].dtype, np.int64)
+    np.testing.assert_equal(can["address"][:5], 1)
+
+  def test_cache(self):
+    out = export_segment(self.rlog, ["carState"])
+    mtime = os.path.getmtime(os.path.join(out, "carState", "vEgo.npy"))
+    export_segment(self.rlog, ["carState", "modelV2"])
+    self.assertEqual(os.path.getmtime(os.path.join(out, "carState", "vEgo.npy")), mtime)
+    self.assertEqual(len(load_columns(out, "modelV2")["frameId"]), 100)
+
+    # a changed log is exported again
+    self._write_log("rlog.bz2", make_log(150))
+    with self.assertRaises(KeyError):
+      load_columns(export_segment(self.rlog, ["carState"]), "modelV2")
+    self.assertEqual(len(load_columns(out, "carState")["vEgo"]), 50)
+
+  def test_route(self):
+    # the second segment's model has wider lists
+    evt = log.Event.new_message()
+    evt.init("modelV2").laneLineProbs = [1.] * 6
+    logs = [self.rlog, None, self._write_log("rlog2.bz2", make_log(30, 60) + evt.to_bytes())]
+    out = export_route(logs, ["modelV2"], processes=2)
+    self.assertIsNone(out[1])
+
+    model = load_route_columns(out, "modelV2")
+    self.assertEqual(model["laneLineProbs"].shape, (111, 6))
+    self.assertTrue(np.isnan(model["laneLineProbs"][0, 4:]).all())
+    np.testing.assert_equal(model["laneLineProbs"][-1], 1.)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+import bz2
+import os
+import tempfile
+import unittest
+from parameterized import parameterized
+
+from cereal import log
+import tools.lib.logreader as logreader
+from tools.lib.logreader import LogIndex, LogReader, MultiLogIterator
+
+
+def make_log(n=300, start=0):
+  """n events every 10 ms after start seconds"""
+  msgs = []
+  for i in range(n):
+    service = ("carState", "can", "modelV2")[i % 3]
+    evt = log.Event.new_message()
+    # slightly out of order, like messages from different publishers
+    evt.logMonoTime = start * 1_000_000_000 + i * 10_000_000 + (5_000_000 if i % 7 == 0 else 0)
+    if service == "can":
+      can = evt.init("can", 5)
+      for c in can:
+        c.address = i
+        c.dat = os.urandom(8)
+    elif service == "modelV2":
+      evt.init("modelV2").frameId = i
+      evt.modelV2.laneLineProbs = [0.5] * 4
+    else:
+      evt.init("carState").vEgo = i
+    msgs.append(evt.to_bytes())
+  return b"".join(msgs)
+
+
+class LogTestCase(unittest.TestCase):
+
+  def setUp(self):
+    self.dat = make_log()
+    self.tmp = tempfile.TemporaryDirectory()
+    self.rlog = os.path.join(self.tmp.name, "rlog.bz2")
+    with open(self.rlog, "wb") as f:
+      # loggerd may append compressed streams
+      half = len(self.dat) // 2
+      f.write(bz2.compress(self.dat[:half]) + bz2.compress(self.dat[half:]))
+    # small reads so messages are split between chunks
+    self.read_size = logreader.READ_SIZE
+    logreader.READ_SIZE = 1000
+
+  def tearDown(self):
+    logreader.READ_SIZE = self.read_size
+    self.tmp.cleanup()
+
+
+class TestLogReader(LogTestCase):
+
+  @parameterized.expand([(None,), ({"carState", "can"},), ({"modelV2"},)])
+  def test_stream(self, services):
+    full = [e for e in LogReader(self.rlog) if services is None or e.which() in services]
+    lr = LogReader(self.rlog, stream=True, services=services)
+    for _ in range(2):  # every iteration reads the log again
+      streamed = list(lr)
+      self.assertEqual(len(streamed), len(full))
+      for a, b in zip(full, streamed):
+        self.assertEqual(a.which(), b.which())
+        self.assertEqual(a.as_builder().to_bytes(), b.as_builder().to_bytes())
+
+  def test_services(self):
+    lr = LogReader(self.rlog, services={"can"})
+    self.assertEqual({e.which() for e in lr}, {"can"})
+    self.assertEqual(len(lr._ts), 100)
+
+  def test_uncompressed(self):
+    rlog = os.path.join(self.tmp.name, "rlog")
+    with open(rlog, "wb") as f:
+      f.write(self.dat)
+    self.assertEqual(len(list(LogReader(rlog, stream=True))), 300)
+    self.assertEqual(len(list(LogReader.from_bytes(self.dat))), 300)
+
+  @parameterized.expand([({},), ({"sort_by_time": True},), ({"services": {"carState", "can"}},),
+                         ({"start": 100, "services": {"modelV2"}},)])
+  def test_mmap(self, kwargs):
+    rlog = os.path.join(self.tmp.name, "rlog")
+    with open(rlog, "wb") as f:
+      f.write(self.dat)
+    expected = LogReader(rlog, **kwargs)
+    lr = LogReader(rlog, mmap=True, **kwargs)
+    self.assertIsInstance(lr._ents, logreader.MappedEvents)
+    self.assertEqual(lr._ts, expected._ts)
+    self.assertEqual([e.as_builder().to_bytes() for e in lr], [e.as_builder().to_bytes() for e in expected])
+    self.assertEqual(lr._ents[-1].logMonoTime, expected._ts[-1])
+
+    # compressed logs are read as before
+    self.assertIsInstance(LogReader(self.rlog, mmap=True)._ents, list)
+
+  def test_iter_raw(self):
+    raw = list(LogReader(self.rlog, stream=True).iter_raw(exclude=("can",)))
+    self.assertEqual(len(raw), 200)
+    self.assertNotIn("can", {which for which, _ in raw})
+    expected = [e.as_builder().to_bytes() for e in LogReader(self.rlog) if e.which() != "can"]
+    self.assertEqual(b"".join(raw_msg for _, raw_msg in raw), b"".join(expected))
+
+  def test_truncated(self):
+    with self.assertWarns(RuntimeWarning):
+      evts = list(LogReader("", dat=self.dat[:-20], stream=True))
+    self.assertEqual(len(evts), 299)
+
+
+class TestLogIndex(LogTestCase):
+
+  def test_index(self):
+    evts = list(LogReader(self.rlog))
+    idx = LogIndex.for_log(self.rlog)
+    self.assertTrue(os.path.exists(self.rlog + ".idx"))
+    self.assertTrue(idx.compressed)
+    self.assertEqual(len(idx.frames), 2)
+    self.assertEqual(len(idx), len(evts))
+    self.assertEqual(list(idx.mono_time), [e.logMonoTime for e in evts])
+
+    loaded = LogIndex.load(self.rlog + ".idx", os.path.getsize(self.rlog))
+    for a in ("mono_time", "offset", "which", "frames"):
+      self.assertEqual(getattr(loaded, a).tolist(), getattr(idx, a).tolist())
+    self.assertIsNone(LogIndex.load(self.rlog + ".idx", 0))
+
+  @parameterized.expand([(0,), (1_234_567_890,), (1_500_000_000,), (10_000_000_000,)])
+  def test_index_at_time(self, t):
+    evts = list(LogReader(self.rlog))
+    # linear scan
+    expected = next((i for i, e in enumerate(evts) if e.logMonoTime >= t), len(evts))
+    start = LogIndex.for_log(self.rlog).index_at_time(t)
+    self.assertEqual(start, expected)
+    self.assertEqual([e.logMonoTime for e in LogReader(self.rlog, start=start)],
+                     [e.logMonoTime for e in evts[expected:]])
+
+  def test_nth(self):
+    idx = LogIndex.for_log(self.rlog)
+    start = idx.nth("modelV2", 50)
+    evt = next(iter(LogReader(self.rlog, start=start, stream=True)))
+    self.assertEqual(evt.which(), "modelV2")
+    self.assertEqual(evt.modelV2.frameId, 50 * 3 + 2)
+    self.assertIsNone(idx.nth("modelV2", 100))
+
+  def test_multi_log_seek(self):
+    paths = []
+    for i in range(2):
+      paths.append(os.path.join(self.tmp.name, f"{i}.bz2"))
+      with open(paths[-1], "wb") as f:
+        f.write(bz2.compress(make_log(600, start=i * 60)))
+
+    it = MultiLogIterator(paths)
+    # the index is only needed to seek
+    self.assertFalse(os.path.exists(paths[0] + ".idx"))
+    self.assertTrue(it.seek(63.))
+    self.assertFalse(os.path.exists(paths[0] + ".idx"))
+    self.assertTrue(os.path.exists(paths[1] + ".idx"))
+    # the first event is 5 ms late, so 63 s is logMonoTime 63.005 s
+    self.assertAlmostEqual(it.tell(), 63.01)
+    self.assertEqual(next(it).logMonoTime, 63_015_000_000)
+
+    # seeking back reads the whole segment again
+    n = len(list(MultiLogIterator(paths)))
+    self.assertTrue(it.seek(63.))
+    self.assertTrue(it.seek(0.))
+    self.assertEqual(len(list(it)), n)
+
+
+if __name__ == "__main__":
+  unittest.main()
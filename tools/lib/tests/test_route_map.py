@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+import bz2
+import operator
+import os
+import tempfile
+import unittest
+from collections import Counter
+from parameterized import parameterized
+
+import tools.lib.route_map as route_map
+from tools.lib.route_map import map_route
+from tools.lib.tests.test_logreader import make_log
+
+
+def count_services(seg):
+  return Counter(e.which() for e in seg.events)
+
+
+def first_and_warmup(seg):
+  return seg.num, next(iter(seg.events)).logMonoTime, [e.logMonoTime for e in seg.warmup]
+
+
+def fail(seg):
+  raise ValueError(seg.num)
+
+
+class TestRouteMap(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.cache_dir = route_map.CACHE_DIR
+    route_map.CACHE_DIR = self.tmp.name
+    self.paths = []
+    for i in range(4):
+      self.paths.append(os.path.join(self.tmp.name, f"{i}--rlog.bz2"))
+      with open(self.paths[-1], "wb") as f:
+        f.write(bz2.compress(make_log(60, start=i * 60)))
+    self.paths[2] = None
+
+  def tearDown(self):
+    route_map.CACHE_DIR = self.cache_dir
+    self.tmp.cleanup()
+
+  @parameterized.expand([(1,), (3,)])
+  def test_map(self, processes):
+    ret = map_route(first_and_warmup, self.paths, warmup=0.05, processes=processes)
+    self.assertIsNone(ret[2])
+    self.assertEqual([r[:2] for r in ret if r is not None], [(0, 5_000_000), (1, 60_005_000_000), (3, 180_005_000_000)])
+    # last 50 ms of the previous segment, none after a missing one
+    self.assertEqual(ret[0][2], [])
+    self.assertEqual(ret[1][2], [540_000_000, 550_000_000, 565_000_000, 570_000_000, 580_000_000, 590_000_000])
+    self.assertEqual(ret[3][2], [])
+
+  def test_reduce(self):
+    total = map_route(count_services, self.paths, reduce=operator.add, initial=Counter(), services={"can", "carState"})
+    self.assertEqual(total, Counter({"can": 60, "carState": 60}))
+
+  def test_cache(self):
+    ret = map_route(count_services, self.paths, cache_key="count", processes=2)
+    # cached results are used even if fn fails now
+    self.assertEqual(map_route(fail, self.paths, cache_key="count", processes=2), ret)
+    with self.assertRaises(ValueError):
+      map_route(fail, self.paths, cache_key="count-v2", processes=2)
+
+    # a changed log is processed again
+    with open(self.paths[0], "wb") as f:
+      f.write(bz2.compress(make_log(30)))
+    self.assertEqual(map_route(count_services, self.paths, cache_key="count")[0], Counter({"carState": 10, "can": 10, "modelV2": 10}))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+import os
+import re
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from parameterized import parameterized
+
+import tools.lib.url_file as url_file
+from tools.lib.url_file import ChunkCache, URLFile, _runs
+
+DATA = os.urandom(25_500)
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+  requests = []
+  lock = threading.Lock()
+
+  def log_message(self, *args):
+    pass
+
+  def do_HEAD(self):
+    self.send_response(200)
+    self.send_header("Content-Length", str(len(DATA)))
+    self.end_headers()
+
+  def do_GET(self):
+    m = re.fullmatch(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+    if m is None:
+      self.send_response(200)
+      start, end = 0, len(DATA)
+    else:
+      start, end = int(m.group(1)), min(int(m.group(2)) + 1, len(DATA))
+      self.send_response(206)
+      self.send_header("Content-Range", f"bytes {start}-{end - 1}/{len(DATA)}")
+    with self.lock:
+      self.requests.append((self.path, start, end))
+    self.send_header("Content-Length", str(end - start))
+    self.end_headers()
+    self.wfile.write(DATA[start:end])
+
+
+class TestURLFile(unittest.TestCase):
+
+  @classmethod
+  def setUpClass(cls):
+    cls.server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.shutdown()
+    cls.server.server_close()
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.patched = {"CACHE_DIR": self.tmp.name, "CHUNK_SIZE": 1000, "MAX_REQUEST_CHUNKS": 4}
+    self.orig = {k: getattr(url_file, k) for k in self.patched}
+    for k, v in self.patched.items():
+      setattr(url_file, k, v)
+    RangeHandler.requests.clear()
+    self.url = f"http://127.0.0.1:{self.server.server_port}/rlog.bz2"
+
+  def tearDown(self):
+    for k, v in self.orig.items():
+      setattr(url_file, k, v)
+    self.tmp.cleanup()
+
+  def _gets(self):
+    return list(RangeHandler.requests)
+
+  def test_runs(self):
+    self.assertEqual(_runs([0, 1, 2, 4, 5, 6, 7, 8, 9], 4), [[0, 1, 2], [4, 5, 6, 7], [8, 9]])
+
+  @parameterized.expand([(True,), (False,)])
+  def test_read(self, cache):
+    with URLFile(self.url, cache=cache) as f:
+      self.assertEqual(f.read(), DATA)
+      f.seek(1500)
+      self.assertEqual(f.read(3000), DATA[1500:4500])
+      self.assertEqual(f.read(10), DATA[4500:4510])
+      f.seek(len(DATA) - 5)
+      self.assertEqual(f.read(100), DATA[-5:])
+      self.assertEqual(f.read(100), b"")
+
+  def test_uncached_parallel(self):
+    with URLFile(self.url, cache=False) as f:
+      self.assertEqual(f.read(), DATA)
+    # one request per MAX_REQUEST_CHUNKS chunks
+    self.assertEqual(sorted(r[1:] for r in self._gets()), [(0, 4000), (4000, 8000), (8000, 12000), (12000, 16000),
+                                                           (16000, 20000), (20000, 24000), (24000, 25500)])
+
+  def test_cache(self):
+    with URLFile(self.url, cache=True) as f:
+      f.seek(2500)
+      self.assertEqual(f.read(1000), DATA[2500:3500])
+      # chunk 3 is new, chunk 2 is cached
+      self.assertEqual(f.read(1000), DATA[3500:4500])
+    self.assertEqual(self._gets(), [("/rlog.bz2", 2000, 4000), ("/rlog.bz2", 4000, 5000)])
+
+    # adjacent missing chunks are merged
+    RangeHandler.requests.clear()
+    with URLFile(self.url, cache=True) as f:
+      self.assertEqual(f.read(), DATA)
+    self.assertEqual(sorted(r[1:] for r in self._gets()), [(0, 2000), (5000, 9000), (9000, 13000), (13000, 17000),
+                                                           (17000, 21000), (21000, 25000), (25000, 25500)])
+
+    RangeHandler.requests.clear()
+    with URLFile(self.url, cache=True) as f:
+      self.assertEqual(f.read(), DATA)
+    self.assertEqual(self._gets(), [])
+
+  def test_corrupt_chunk(self):
+    with URLFile(self.url, cache=True) as f:
+      f.read(1000)
+    path = url_file.chunk_cache()._path(self.url, 0)
+    with open(path, "r+b") as cached:
+      cached.seek(40)
+      cached.write(b"\0" * 10)
+
+    RangeHandler.requests.clear()
+    with URLFile(self.url, cache=True) as f:
+      self.assertEqual(f.read(1000), DATA[:1000])
+    self.assertEqual(self._gets(), [("/rlog.bz2", 0, 1000)])
+
+  def test_concurrent_readers(self):
+    def read(_):
+      with URLFile(self.url, cache=True) as f:
+        return f.read()
+
+    with ThreadPoolExecutor(8) as pool:
+      self.assertTrue(all(dat == DATA for dat in pool.map(read, range(8))))
+    # every chunk is downloaded once
+    ranges = sorted(r[1:] for r in self._gets())
+    self.assertEqual(sum(end - start for start, end in ranges), len(DATA))
+
+  def test_eviction(self):
+    cache = ChunkCache(os.path.join(self.tmp.name, "chunks"), max_size=5 * 1032)
+    for n in range(5):
+      cache.put(self.url, n, DATA[n * 1000:(n + 1) * 1000])
+      os.utime(cache._path(self.url, n), (n, n))
+    self.assertEqual(cache.get(self.url, 0), DATA[:1000])  # now the most recent
+
+    # evicts down to 90% of max_size
+    cache.put(self.url, 5, DATA[5000:6000])
+    self.assertEqual([n for n in range(6) if cache.get(self.url, n) is None], [1, 2])
+    self.assertLessEqual(cache._size, 5 * 1032)
+
+
+if __name__ == "__main__":
+  unittest.main()
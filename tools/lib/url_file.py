@@ -6,15 +6,23 @@ import tempfile
 import threading
 import urllib.parse
 import pycurl
+from concurrent.futures import Future, ThreadPoolExecutor
 from hashlib import sha256
 from io import BytesIO
+from typing import Dict, Iterable, List, Optional, Tuple
 from tenacity import retry, wait_random_exponential, stop_after_attempt
 from common.file_helpers import mkdirs_exists_ok, atomic_write_in_dir
 #  Cache chunk size
 K = 1000
 CHUNK_SIZE = 1000 * K
+# adjacent chunks are downloaded with one range request of up to this many chunks
+MAX_REQUEST_CHUNKS = 8
+DOWNLOAD_WORKERS = int(os.environ.get("FILEREADER_WORKERS", "8"))
 
 CACHE_DIR = os.environ.get("FLOWDRIVE_CACHE", "/tmp/flowdrive_download_cache/")
+CACHE_SIZE = int(os.environ.get("FILEREADER_CACHE_SIZE", str(10 * 1000 ** 3)))
+
+_tlocal = threading.local()
 
 
 def hash_256(link):
@@ -22,9 +30,224 @@ def hash_256(link):
   return hsh
 
 
-class URLFile:
-  _tlocal = threading.local()
+def _curl():
+  """One handle per thread, so connections are kept alive between requests."""
+  try:
+    return _tlocal.curl
+  except AttributeError:
+    _tlocal.curl = pycurl.Curl()
+    return _tlocal.curl
+
+
+@retry(wait=wait_random_exponential(multiplier=1, max=5), stop=stop_after_attempt(3), reraise=True)
+def download_range(url, start, end, debug=False):
+  """Bytes [start, end) of url."""
+  if start >= end:
+    return b""
+  headers = ["Connection: keep-alive", f"Range: bytes={start}-{end - 1}"]
+
+  dats = BytesIO()
+  c = _curl()
+  c.reset()
+  c.setopt(pycurl.URL, url)
+  c.setopt(pycurl.WRITEDATA, dats)
+  c.setopt(pycurl.NOSIGNAL, 1)
+  c.setopt(pycurl.TIMEOUT_MS, 500000)
+  c.setopt(pycurl.HTTPHEADER, headers)
+  c.setopt(pycurl.FOLLOWLOCATION, True)
+
+  if debug:
+    print("downloading", url)
+
+    def header(x):
+      if b'MISS' in x:
+        print(x.strip())
+
+    c.setopt(pycurl.HEADERFUNCTION, header)
+
+    def test(debug_type, debug_msg):
+     print("  debug(%d): %s" % (debug_type, debug_msg.strip()))
+
+    c.setopt(pycurl.VERBOSE, 1)
+    c.setopt(pycurl.DEBUGFUNCTION, test)
+    t1 = time.time()
+
+  c.perform()
+
+  if debug:
+    t2 = time.time()
+    if t2 - t1 > 0.1:
+      print(f"get {url} {headers!r} {t2 - t1:.2f} slow")
+
+  response_code = c.getinfo(pycurl.RESPONSE_CODE)
+  if response_code == 416:  # Requested Range Not Satisfiable
+    raise Exception(f"Error, range out of bounds {response_code} {headers} ({url}): {repr(dats.getvalue())[:500]}")
+  if response_code != 206:  # Partial Content
+    raise Exception(f"Error, requested range but got unexpected response {response_code} {headers} ({url}): {repr(dats.getvalue())[:500]}")
+  ret = dats.getvalue()
+  if len(ret) != end - start:
+    raise Exception(f"Error, got {len(ret)} bytes for {headers} ({url})")
+  return ret
+
+
+class ChunkCache:
+  """Chunks of remote files on disk. Every chunk file starts with the sha256 of
+  its data and a chunk that doesn't match it is dropped. Hits refresh the mtime,
+  the least recently used chunks are evicted once the cache exceeds max_size."""
+
+  def __init__(self, path, max_size=CACHE_SIZE):
+    self.path = path
+    self.max_size = max_size
+    self._size = None
+    self._lock = threading.Lock()
+
+  def _path(self, url, n):
+    return os.path.join(self.path, f"{hash_256(url)}_{n}")
+
+  def get(self, url, n) -> Optional[bytes]:
+    path = self._path(url, n)
+    try:
+      with open(path, "rb") as f:
+        dat = f.read()
+      os.utime(path)
+    except FileNotFoundError:  # not cached, or just evicted
+      return None
+    if sha256(dat[32:]).digest() != dat[:32]:
+      self._remove(path)
+      return None
+    return dat[32:]
+
+  def put(self, url, n, dat):
+    mkdirs_exists_ok(self.path)
+    with self._lock:
+      if self._size is None:
+        self._evict()
+    with atomic_write_in_dir(self._path(url, n), mode="wb", overwrite=True) as f:
+      f.write(sha256(dat).digest() + dat)
+    with self._lock:
+      self._size += 32 + len(dat)
+      if self._size > self.max_size:
+        self._evict()
+
+  def _remove(self, path):
+    try:
+      os.remove(path)
+    except FileNotFoundError:
+      pass
+
+  def _evict(self):
+    # the size is only tracked in this process, take it from disk again
+    entries = []
+    with os.scandir(self.path) as it:
+      for e in it:
+        try:
+          st = e.stat()
+        except FileNotFoundError:
+          continue
+        entries.append((st.st_mtime, st.st_size, e.path))
+    self._size = sum(size for _, size, _ in entries)
+    # leave some room so not every put has to scan
+    for _, size, path in sorted(entries):
+      if self._size <= 0.9 * self.max_size:
+        break
+      self._remove(path)
+      self._size -= size
+
+
+def _runs(chunks: Iterable[int], max_len: int) -> List[List[int]]:
+  """Split sorted chunk numbers into runs of adjacent chunks."""
+  runs: List[List[int]] = []
+  for n in chunks:
+    if runs and runs[-1][-1] == n - 1 and len(runs[-1]) < max_len:
+      runs[-1].append(n)
+    else:
+      runs.append([n])
+  return runs
+
+
+class DownloadManager:
+  """Bounded pool of download threads shared by every URLFile in the process.
+  Runs of missing chunks are merged into one range request each and requests
+  run concurrently, a chunk that is already downloading for another reader is
+  waited for instead of requested again."""
+
+  def __init__(self, workers=DOWNLOAD_WORKERS):
+    self._pool = ThreadPoolExecutor(workers, thread_name_prefix="download")
+    self._inflight: Dict[Tuple[str, int], Future] = {}
+    self._lock = threading.Lock()
+
+  def read(self, url, start, end, debug=False) -> bytes:
+    """Uncached bytes [start, end) of url."""
+    step = MAX_REQUEST_CHUNKS * CHUNK_SIZE
+    futures = [self._pool.submit(download_range, url, s, min(s + step, end), debug) for s in range(start, end, step)]
+    return b"".join(f.result() for f in futures)
+
+  def chunks(self, url, first, last, length, cache, debug=False) -> List[bytes]:
+    """Chunks first to last of url, from cache or downloaded into it."""
+    ret = {}
+    for n in range(first, last + 1):
+      dat = cache.get(url, n)
+      if dat is not None:
+        ret[n] = dat
+
+    pending = {}
+    with self._lock:
+      missing = []
+      for n in range(first, last + 1):
+        if n in ret:
+          continue
+        if (url, n) in self._inflight:
+          pending[n] = self._inflight[(url, n)]
+        else:
+          missing.append(n)
+      for run in _runs(missing, MAX_REQUEST_CHUNKS):
+        fut = self._pool.submit(self._fetch, url, run[0], run[-1], length, cache, debug)
+        for n in run:
+          self._inflight[(url, n)] = pending[n] = fut
+
+    for n, fut in pending.items():
+      ret[n] = fut.result()[n]
+    return [ret[n] for n in range(first, last + 1)]
+
+  def _fetch(self, url, first, last, length, cache, debug):
+    try:
+      dat = download_range(url, first * CHUNK_SIZE, min((last + 1) * CHUNK_SIZE, length), debug)
+      chunks = {n: dat[(n - first) * CHUNK_SIZE:(n - first + 1) * CHUNK_SIZE] for n in range(first, last + 1)}
+      for n, chunk in chunks.items():
+        cache.put(url, n, chunk)
+      return chunks
+    finally:
+      with self._lock:
+        for n in range(first, last + 1):
+          self._inflight.pop((url, n), None)
+
+
+_manager: Optional[DownloadManager] = None
+_manager_pid = None
+_manager_lock = threading.Lock()
+
+
+def download_manager() -> DownloadManager:
+  global _manager, _manager_pid
+  with _manager_lock:
+    # threads don't survive a fork, a forked child starts its own pool
+    if _manager is None or _manager_pid != os.getpid():
+      _manager = DownloadManager()
+      _manager_pid = os.getpid()
+    return _manager
 
+
+_caches: Dict[Tuple[str, int], ChunkCache] = {}
+
+
+def chunk_cache() -> ChunkCache:
+  key = (os.path.join(CACHE_DIR, "chunks"), CACHE_SIZE)
+  if key not in _caches:
+    _caches[key] = ChunkCache(*key)
+  return _caches[key]
+
+
+class URLFile:
   def __init__(self, url, debug=False, cache=None):
     self._url = url
     self._pos = 0
@@ -35,11 +258,6 @@ class URLFile:
     self._force_download = not int(os.environ.get("FILEREADER_CACHE", "0"))
     if cache is not None:
       self._force_download = not cache
-
-    try:
-      self._curl = self._tlocal.curl
-    except AttributeError:
-      self._curl = self._tlocal.curl = pycurl.Curl()
     mkdirs_exists_ok(CACHE_DIR)
 
   def __enter__(self):
@@ -53,7 +271,7 @@ class URLFile:
 
   @retry(wait=wait_random_exponential(multiplier=1, max=5), stop=stop_after_attempt(3), reraise=True)
   def get_length_online(self):
-    c = self._curl
+    c = _curl()
     c.reset()
     c.setopt(pycurl.NOSIGNAL, 1)
     c.setopt(pycurl.TIMEOUT_MS, 500000)
@@ -77,99 +295,26 @@ class URLFile:
 
     self._length = self.get_length_online()
     if not self._force_download:
-      with atomic_write_in_dir(file_length_path, mode="w") as file_length:
+      with atomic_write_in_dir(file_length_path, mode="w", overwrite=True) as file_length:
         file_length.write(str(self._length))
     return self._length
 
   def read(self, ll=None):
-    if self._force_download:
-      return self.read_aux(ll=ll)
-
     file_begin = self._pos
-    file_end = self._pos + ll if ll is not None else self.get_length()
+    file_end = self.get_length() if ll is None else min(self._pos + ll, self.get_length())
     assert file_end != -1, f"Remote file is empty or doesn't exist: {self._url}"
-    #  We have to align with chunks we store. Position is the begginiing of the latest chunk that starts before or at our file
-    position = (file_begin // CHUNK_SIZE) * CHUNK_SIZE
-    response = b""
-    while True:
-      self._pos = position
-      chunk_number = self._pos / CHUNK_SIZE
-      file_name = hash_256(self._url) + "_" + str(chunk_number)
-      full_path = os.path.join(CACHE_DIR, str(file_name))
-      data = None
-      #  If we don't have a file, download it
-      if not os.path.exists(full_path):
-        data = self.read_aux(ll=CHUNK_SIZE)
-        with atomic_write_in_dir(full_path, mode="wb") as new_cached_file:
-          new_cached_file.write(data)
-      else:
-        with open(full_path, "rb") as cached_file:
-          data = cached_file.read()
-
-      response += data[max(0, file_begin - position): min(CHUNK_SIZE, file_end - position)]
-
-      position += CHUNK_SIZE
-      if position >= file_end:
-        self._pos = file_end
-        return response
-
-  @retry(wait=wait_random_exponential(multiplier=1, max=5), stop=stop_after_attempt(3), reraise=True)
-  def read_aux(self, ll=None):
-    download_range = False
-    headers = ["Connection: keep-alive"]
-    if self._pos != 0 or ll is not None:
-      if ll is None:
-        end = self.get_length() - 1
-      else:
-        end = min(self._pos + ll, self.get_length()) - 1
-      if self._pos >= end:
-        return b""
-      headers.append(f"Range: bytes={self._pos}-{end}")
-      download_range = True
-
-    dats = BytesIO()
-    c = self._curl
-    c.setopt(pycurl.URL, self._url)
-    c.setopt(pycurl.WRITEDATA, dats)
-    c.setopt(pycurl.NOSIGNAL, 1)
-    c.setopt(pycurl.TIMEOUT_MS, 500000)
-    c.setopt(pycurl.HTTPHEADER, headers)
-    c.setopt(pycurl.FOLLOWLOCATION, True)
+    if file_begin >= file_end:
+      return b""
 
-    if self._debug:
-      print("downloading", self._url)
-
-      def header(x):
-        if b'MISS' in x:
-          print(x.strip())
-
-      c.setopt(pycurl.HEADERFUNCTION, header)
-
-      def test(debug_type, debug_msg):
-       print("  debug(%d): %s" % (debug_type, debug_msg.strip()))
-
-      c.setopt(pycurl.VERBOSE, 1)
-      c.setopt(pycurl.DEBUGFUNCTION, test)
-      t1 = time.time()
-
-    c.perform()
-
-    if self._debug:
-      t2 = time.time()
-      if t2 - t1 > 0.1:
-        print(f"get {self._url} {headers!r} {t2 - t1:.f} slow")
-
-    response_code = c.getinfo(pycurl.RESPONSE_CODE)
-    if response_code == 416:  # Requested Range Not Satisfiable
-      raise Exception(f"Error, range out of bounds {response_code} {headers} ({self._url}): {repr(dats.getvalue())[:500]}")
-    if download_range and response_code != 206:  # Partial Content
-      raise Exception(f"Error, requested range but got unexpected response {response_code} {headers} ({self._url}): {repr(dats.getvalue())[:500]}")
-    if (not download_range) and response_code != 200:  # OK
-      raise Exception(f"Error {response_code} {headers} ({self._url}): {repr(dats.getvalue())[:500]}")
-
-    ret = dats.getvalue()
-    self._pos += len(ret)
-    return ret
+    if self._force_download:
+      response = download_manager().read(self._url, file_begin, file_end, self._debug)
+    else:
+      #  We have to align with chunks we store
+      first, last = file_begin // CHUNK_SIZE, (file_end - 1) // CHUNK_SIZE
+      chunks = download_manager().chunks(self._url, first, last, self.get_length(), chunk_cache(), self._debug)
+      response = b"".join(chunks)[file_begin - first * CHUNK_SIZE:file_end - first * CHUNK_SIZE]
+    self._pos = file_end
+    return response
 
   def seek(self, pos):
     self._pos = pos
@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 import os
 import sys
-import bz2
 import multiprocessing
 import platform
 import shutil
@@ -11,6 +10,7 @@ import tempfile
 import requests
 import argparse
 
+from cereal import log
 from common.basedir import BASEDIR
 from tools.lib.logreader import LogReader
 from tools.lib.route import Route, SegmentName
@@ -24,15 +24,6 @@ PLOTJUGGLER_BIN = os.path.join(juggle_dir, "bin/plotjuggler")
 MINIMUM_PLOTJUGGLER_VERSION = (3, 5, 2)
 MAX_STREAMING_BUFFER_SIZE = 1000
 
-def save_log(dest, log_msgs, compress=True):
-  dat = b"".join(msg.as_builder().to_bytes() for msg in log_msgs)
-
-  if compress:
-    dat = bz2.compress(dat)
-
-  with open(dest, "wb") as f:
-    f.write(dat)
-    
 def install():
   m = f"{platform.system()}-{platform.machine()}"
   supported = ("Linux-x86_64")
@@ -60,15 +51,23 @@ def get_plotjuggler_version():
   return tuple(map(int, version.split(".")))
 
 
-def load_segment(segment_name):
+def load_segment(args):
+  """Write the events of a log uncompressed to dest, copied without decoding.
+  Returns the serialized carParams of the log if it has one."""
+  segment_name, dest, can = args
   if segment_name is None:
-    return []
+    return None
 
+  car_params = None
   try:
-    return list(LogReader(segment_name))
+    with open(dest, "wb") as f:
+      for which, msg in LogReader(segment_name, stream=True).iter_raw(exclude=() if can else ('can', 'sendcan')):
+        f.write(msg)
+        if which == 'carParams' and car_params is None:
+          car_params = bytes(msg)
   except (AssertionError, ValueError) as e:
     print(f"Error parsing {segment_name}: {e}")
-    return []
+  return car_params
 
 
 def start_juggler(fn=None, dbc=None, layout=None, route_or_segment_name=None):
@@ -119,28 +118,30 @@ def juggle_route(route_or_segment_name, segment_count, qlog, can, layout, dbc=No
       print("Please try a different route or segment")
       return
 
-  all_data = []
-  with multiprocessing.Pool(24) as pool:
-    for d in pool.map(load_segment, logs):
-      all_data += d
-
-  if not can:
-    all_data = [d for d in all_data if d.which() not in ['can', 'sendcan']]
-
-  # Infer DBC name from logs
-  if dbc is None:
-    for cp in [m for m in all_data if m.which() == 'carParams']:
+  with tempfile.TemporaryDirectory(dir=juggle_dir) as tmp_dir:
+    # segments are filtered in parallel and appended to one log in order
+    jobs = [(log_path, os.path.join(tmp_dir, f"{i}.rlog"), can) for i, log_path in enumerate(logs)]
+    rlog = os.path.join(tmp_dir, "route.rlog")
+    first_car_params = None
+    with multiprocessing.Pool(24) as pool, open(rlog, "wb") as f:
+      for (_, segment_rlog, _), car_params in zip(jobs, pool.imap(load_segment, jobs)):
+        if os.path.exists(segment_rlog):
+          with open(segment_rlog, "rb") as segment:
+            shutil.copyfileobj(segment, f, 1 << 20)
+          os.remove(segment_rlog)
+        if first_car_params is None:
+          first_car_params = car_params
+
+    # Infer DBC name from logs
+    if dbc is None and first_car_params is not None:
+      cp = log.Event.from_bytes(first_car_params).carParams
       try:
-        DBC = __import__(f"selfdrive.car.{cp.carParams.carName}.values", fromlist=['DBC']).DBC
-        dbc = DBC[cp.carParams.carFingerprint]['pt']
+        DBC = __import__(f"selfdrive.car.{cp.carName}.values", fromlist=['DBC']).DBC
+        dbc = DBC[cp.carFingerprint]['pt']
       except Exception:
         pass
-      break
 
-  with tempfile.NamedTemporaryFile(suffix='.rlog', dir=juggle_dir) as tmp:
-    save_log(tmp.name, all_data, compress=False)
-    del all_data
-    start_juggler(tmp.name, dbc, layout, route_or_segment_name)
+    start_juggler(rlog, dbc, layout, route_or_segment_name)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""Replay rlogs through PubMaster, to re-run processes on recorded drives.
+
+  python tools/replay/replay.py "<route>" --rerun controlsd
+  REPLAY=1 python selfdrive/controls/controlsd.py
+
+Events are published as recorded, logMonoTime included, paced by their
+logMonoTime deltas divided by --speed. With --fast they are published as fast
+as the consumers keep up: before every message a service waits until all its
+readers read the previous one. Only msgq tells when readers are done, so that
+needs MSGQ=1 (or SHM_TRANSPORT=1 for the services marked shm), other services
+are published without waiting.
+
+--start seeks with the segment's LogIndex, only decompressing from the bz2
+frame holding the first event.
+"""
+import argparse
+import os
+import time
+from collections import Counter
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+import cereal.messaging as messaging
+from cereal import log
+from cereal.event_header import EVENT_NAMES, event_header
+from cereal.services import service_list
+from tools.lib.logreader import LogIndex, LogReader
+
+# a consumer that doesn't read a message for this long isn't waited for anymore
+READER_TIMEOUT = 1.
+# services published by processes that can be re-run, see --rerun
+PROCESS_OUTPUTS = {
+  "controlsd": ["sendcan", "controlsState", "carState", "carControl", "carEvents", "carParams"],
+  "plannerd": ["longitudinalPlan", "lateralPlan"],
+  "radard": ["radarState", "liveTracks"],
+  "paramsd": ["liveParameters"],
+  "torqued": ["liveTorqueParameters"],
+  "calibrationd": ["liveCalibration"],
+}
+
+
+def readers_tracked(s: str) -> bool:
+  """Whether all_readers_updated works for the local publisher of s."""
+  return "MSGQ" in os.environ or messaging.use_shm(s)
+
+
+class Replay:
+  def __init__(self, log_paths: List[Optional[str]], services=None, block=(), speed: float = 1.,
+               fast: bool = False, pm=None):
+    """services: publish only these, defaults to the services in the first
+    segment. block: never publish these, e.g. the outputs of a re-run process."""
+    self.log_paths = log_paths
+    first = LogIndex.for_log(next(p for p in log_paths if p is not None))
+    self.route_start = first.start_time
+    if services is None:
+      services = {EVENT_NAMES[int(w)] for w in np.unique(first.which)}
+    self.services = {s for s in services if s in service_list and s not in set(block)}
+
+    self.speed = speed
+    self.fast = fast
+    self.pm = pm if pm is not None else messaging.PubMaster(sorted(self.services))
+    self._wait = {s for s in self.services if readers_tracked(s)} if fast else set()
+    self._segment = 0
+    self._start = 0
+
+    self.sent: Counter = Counter()
+    self.reader_timeouts: Counter = Counter()
+
+  def seek(self, t: float) -> None:
+    """Continue from t seconds after the start of the route."""
+    segment = int(t / 60)
+    if segment >= len(self.log_paths) or self.log_paths[segment] is None:
+      raise ValueError(f"no segment at {t} s")
+    self._segment = segment
+    self._start = LogIndex.for_log(self.log_paths[segment]).index_at_time(self.route_start + int(t * 1e9))
+
+  def events(self) -> Iterator[Tuple[str, int, bytes]]:
+    """(which, logMonoTime, message) from the current position to the end of
+    the route, the messages are not decoded."""
+    while self._segment < len(self.log_paths):
+      path = self.log_paths[self._segment]
+      if path is not None:
+        for which, msg in LogReader(path, stream=True, services=self.services, start=self._start).iter_raw():
+          dat = bytes(msg)
+          header = event_header(dat)
+          yield which, header[1] if header is not None else log.Event.from_bytes(dat).logMonoTime, dat
+      self._segment += 1
+      self._start = 0
+
+  def _wait_readers(self, s: str) -> None:
+    deadline = time.monotonic() + READER_TIMEOUT
+    while not self.pm.all_readers_updated(s):
+      if time.monotonic() > deadline:
+        print(f"{s} isn't read for {READER_TIMEOUT} s, not waiting for it anymore")
+        self._wait.discard(s)
+        self.reader_timeouts[s] += 1
+        return
+      time.sleep(1e-4)
+
+  def run(self) -> Tuple[float, float]:
+    """Publish until the end of the route, returns the (log, wall) seconds replayed."""
+    wall_start = time.monotonic()
+    first_mono = last_mono = None
+    for which, mono_time, dat in self.events():
+      if first_mono is None:
+        first_mono = mono_time
+      last_mono = max(last_mono or mono_time, mono_time)
+
+      if which in self._wait:
+        self._wait_readers(which)
+      elif not self.fast:
+        dt = wall_start + (mono_time - first_mono) / 1e9 / self.speed - time.monotonic()
+        if dt > 0:
+          time.sleep(dt)
+
+      self.pm.send(which, dat)
+      self.sent[which] += 1
+
+    log_time = (last_mono - first_mono) / 1e9 if first_mono is not None else 0.
+    return log_time, time.monotonic() - wall_start
+
+
+def main():
+  from tools.lib.route import Route, SegmentName
+
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("route_or_segment_name", help="route, segment or path to a log")
+  parser.add_argument("--data_dir", help="local directory with the route")
+  parser.add_argument("--qlog", action="store_true", help="replay qlogs instead of rlogs")
+  parser.add_argument("--speed", type=float, default=1., help="playback speed multiplier")
+  parser.add_argument("--fast", action="store_true", help="as fast as the consumers keep up")
+  parser.add_argument("--start", type=float, default=0., help="seconds into the route to start at")
+  parser.add_argument("--allow", nargs="+", help="only publish these services")
+  parser.add_argument("--block", nargs="+", default=[], help="don't publish these services")
+  parser.add_argument("--rerun", nargs="+", default=[], choices=sorted(PROCESS_OUTPUTS),
+                      help="block the outputs of processes that are run against the replay")
+  args = parser.parse_args()
+
+  name = args.route_or_segment_name
+  if name.startswith(("http://", "https://", "cd:/")) or os.path.isfile(name):
+    logs = [name]
+  else:
+    sn = SegmentName(name, allow_route_name=True)
+    r = Route(sn.route_name.canonical_name, args.data_dir)
+    logs = r.qlog_paths() if args.qlog else r.log_paths()
+    if sn.segment_num >= 0:
+      logs = logs[sn.segment_num:sn.segment_num + 1]
+
+  block = set(args.block).union(*(PROCESS_OUTPUTS[p] for p in args.rerun))
+  replay = Replay(logs, services=args.allow, block=block, speed=args.speed, fast=args.fast)
+  if args.fast and replay.services - replay._wait:
+    print("not waiting for readers of (needs msgq):", " ".join(sorted(replay.services - replay._wait)))
+  if args.start:
+    replay.seek(args.start)
+
+  log_time, wall_time = replay.run()
+  print(f"replayed {sum(replay.sent.values())} events, {log_time:.1f} s of log in {wall_time:.1f} s "
+        f"({log_time / max(wall_time, 1e-9):.1f}x)")
+
+
+if __name__ == "__main__":
+  main()
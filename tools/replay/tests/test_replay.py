@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+import bz2
+import os
+import tempfile
+import time
+import unittest
+from collections import Counter
+from unittest import mock
+
+import tools.replay.replay as replay
+from tools.replay.replay import Replay
+from tools.lib.logreader import LogReader
+from tools.lib.tests.test_logreader import make_log
+
+
+class FakePubMaster:
+  def __init__(self, busy=0):
+    self.sent = []
+    self.busy = busy  # all_readers_updated calls returning False before every send
+
+  def send(self, s, dat):
+    self.sent.append((s, dat, time.monotonic()))
+    self.pending = self.busy
+
+  def all_readers_updated(self, s):
+    if getattr(self, "pending", 0) > 0:
+      self.pending -= 1
+      return False
+    return True
+
+
+class TestReplay(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.logs = []
+    for i in range(2):
+      self.logs.append(os.path.join(self.tmp.name, f"{i}--rlog.bz2"))
+      with open(self.logs[-1], "wb") as f:
+        f.write(bz2.compress(make_log(60, start=i * 60)))
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def test_replay(self):
+    pm = FakePubMaster()
+    r = Replay(self.logs, block=["can"], speed=1000, pm=pm)
+    self.assertEqual(r.services, {"carState", "modelV2"})
+    r.run()
+    self.assertEqual(Counter(s for s, _, _ in pm.sent), Counter({"carState": 40, "modelV2": 40}))
+    # published as recorded
+    expected = [e.as_builder().to_bytes() for fn in self.logs for e in LogReader(fn) if e.which() != "can"]
+    self.assertEqual([dat for _, dat, _ in pm.sent], expected)
+
+  def test_speed(self):
+    pm = FakePubMaster()
+    log_time, wall_time = Replay(self.logs[:1], speed=4, pm=pm).run()
+    self.assertAlmostEqual(log_time, 0.585)
+    self.assertGreater(wall_time, 0.585 / 4)
+    self.assertLess(wall_time, 0.585 / 4 + 0.1)
+    # paced by logMonoTime
+    self.assertAlmostEqual(pm.sent[30][2] - pm.sent[0][2], 0.295 / 4, delta=0.01)
+
+  def test_seek(self):
+    pm = FakePubMaster()
+    r = Replay(self.logs, services=["carState"], fast=True, pm=pm)
+    # relative to the first event, at 5 ms
+    r.seek(60.3)
+    events = list(r.events())
+    self.assertEqual(len(events), 9)
+    self.assertEqual(events[0][1], 60_330_000_000)
+    with self.assertRaises(ValueError):
+      r.seek(120)
+
+  @mock.patch.dict(os.environ, {"MSGQ": "1"})
+  def test_fast(self):
+    pm = FakePubMaster(busy=3)
+    r = Replay(self.logs[:1], services=["carState"], fast=True, pm=pm)
+    log_time, wall_time = r.run()
+    self.assertEqual(len(pm.sent), 20)
+    self.assertLess(wall_time, log_time)
+    self.assertEqual(r.reader_timeouts, Counter())
+
+  @mock.patch.dict(os.environ, {"MSGQ": "1"})
+  def test_reader_timeout(self):
+    pm = FakePubMaster(busy=10**9)
+    with mock.patch.object(replay, "READER_TIMEOUT", 0.05):
+      r = Replay(self.logs[:1], services=["carState"], fast=True, pm=pm)
+      r.run()
+    # waited once, then the stuck consumer is ignored
+    self.assertEqual(len(pm.sent), 20)
+    self.assertEqual(r.reader_timeouts, Counter({"carState": 1}))
+
+
+if __name__ == "__main__":
+  unittest.main()
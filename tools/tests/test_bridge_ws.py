@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+import json
+import struct
+import unittest
+from unittest import mock
+
+from parameterized import parameterized
+
+from cereal import log
+import tools.bridge_ws as bridge_ws
+from tools.bridge_ws import Frame, TopicEncoder, dict_delta, encode_batch, parse_rates
+from tools.bridge_ws_client import StreamState, apply_delta, decode_frame
+
+
+class TestDelta(unittest.TestCase):
+
+  @parameterized.expand([
+    ("equal", {"a": 1, "b": {"c": [1, 2]}}, {"a": 1, "b": {"c": [1, 2]}}, {}),
+    ("nested", {"a": 1, "b": {"c": 1, "d": {"e": 1, "f": 2}}}, {"a": 1, "b": {"c": 1, "d": {"e": 1, "f": 3}}},
+     {"b": {"d": {"f": 3}}}),
+    ("list", {"a": [1., 2.]}, {"a": [1., 2., 3.]}, {"a": [1., 2., 3.]}),
+    ("added", {"a": 1}, {"a": 1, "b": {"c": 2}}, {"b": {"c": 2}}),
+    ("removed", {"a": 1, "u": {"x": 1}}, {"a": 1, "v": 2}, {"v": 2, "__del__": ["u"]}),
+    ("nested_removed", {"b": {"c": 1, "d": 2}}, {"b": {"d": 2}}, {"b": {"__del__": ["c"]}}),
+    ("dict_to_scalar", {"a": {"x": 1}}, {"a": 5}, {"a": 5}),
+    ("scalar_to_dict", {"a": 5}, {"a": {"x": 1}}, {"a": {"x": 1}}),
+  ])
+  def test_dict_delta(self, _, base, new, expected):
+    delta = dict_delta(base, new)
+    self.assertEqual(delta, expected)
+    self.assertEqual(apply_delta(base, delta), new)
+
+  def test_parse_rates(self):
+    rates = {"modelV2": 20, "carState": "10", "a": "fast", "b": None, "c": [1], "d": 0, "e": -1,
+             "f": "nan", "g": float("inf")}
+    self.assertEqual(parse_rates(rates), {"modelV2": 20., "carState": 10.})
+    for rates in (None, "20", [20]):
+      self.assertEqual(parse_rates(rates), {})
+
+
+class TestTopicEncoder(unittest.TestCase):
+
+  def test_join_mid_stream(self):
+    enc = TopicEncoder("carState", keyframe_interval=1.)
+    updates = [enc.encode(i, True, {"vEgo": float(i), "cruiseState": {"enabled": i >= 3, "speed": 30.}}, now=i * 0.2)
+               for i in range(8)]
+    self.assertEqual([u.key_seq for u in updates], [1] * 5 + [6] * 3)
+    self.assertIs(updates[5].frame, updates[5].keyframe)
+
+    # a client joining at the 4th update gets the keyframe first, then only deltas on top of it
+    state = StreamState()
+    held_key = None
+    for i, upd in enumerate(updates[3:], start=3):
+      msgs = []
+      if held_key != upd.key_seq:
+        held_key = upd.key_seq
+        msgs.append(upd.keyframe.msg)
+      if upd.seq != upd.key_seq:
+        msgs.append(upd.frame.msg)
+      self.assertEqual(msgs[0]["type"], "key" if i in (3, 5) else "delta")
+      for msg in msgs:
+        data = state.apply(msg)
+      self.assertEqual(data, upd.full.msg["data"])
+
+    self.assertEqual(updates[4].frame.msg["data"], {"vEgo": 4., "cruiseState": {"enabled": True}})
+    self.assertEqual(updates[7].frame.msg["data"], {"vEgo": 7.})
+
+    # a delta without its keyframe is not applied
+    self.assertIsNone(StreamState().apply(updates[7].frame.msg))
+
+  def test_delta_built_once_on_use(self):
+    enc = TopicEncoder("carState", keyframe_interval=1.)
+    enc.encode(0, True, {"vEgo": 0.}, now=0.)
+    with mock.patch.object(bridge_ws, "dict_delta", wraps=dict_delta) as delta:
+      upd = enc.encode(1, True, {"vEgo": 1.}, now=0.1)
+      delta.assert_not_called()
+      self.assertEqual(upd.frame.encode("json"), upd.frame.encode("json"))
+      self.assertEqual(upd.frame.msg["data"], {"vEgo": 1.})
+      delta.assert_called_once()
+
+
+class TestWireFormats(unittest.TestCase):
+  MSGS = [
+    {"topic": "modelV2", "timestamp": 1, "valid": True,
+     "data": {"position": {"x": [0.1, 1.7, 3.3, 5.9], "t": [0., 0.5]}, "frameId": 12, "ids": [1, 2, 3, 4]}},
+    {"topic": "carState", "timestamp": 2, "valid": False, "data": {"vEgo": 0.1, "gearShifter": "drive"}},
+  ]
+
+  def test_msgpack(self):
+    if bridge_ws.msgpack is None:
+      self.skipTest("msgpack not installed")
+    payload = encode_batch([Frame(m).encode("msgpack") for m in self.MSGS], "msgpack")
+    self.assertIsInstance(payload, bytes)
+    msgs = decode_frame(payload, "msgpack")
+    self.assertEqual(len(msgs), 2)
+
+    # float lists come back as float32, everything else unchanged
+    pos = msgs[0]["data"]["position"]
+    self.assertEqual(pos["x"], list(struct.unpack("<4f", struct.pack("<4f", *self.MSGS[0]["data"]["position"]["x"]))))
+    self.assertNotEqual(pos["x"], self.MSGS[0]["data"]["position"]["x"])
+    self.assertEqual(pos["t"], [0., 0.5])
+    self.assertEqual(msgs[0]["data"]["ids"], [1, 2, 3, 4])
+    self.assertEqual(msgs[1], self.MSGS[1])
+
+  def test_json(self):
+    payload = encode_batch([Frame(m).encode("json") for m in self.MSGS], "json")
+    self.assertEqual(json.loads(payload), {"type": "batch", "count": 2, "messages": self.MSGS})
+    self.assertEqual(decode_frame(payload, "json"), self.MSGS)
+
+  def test_capnp(self):
+    events = []
+    for i in range(3):
+      evt = log.Event.new_message(logMonoTime=i)
+      evt.init("carState").vEgo = i
+      events.append(evt.to_bytes())
+    msgs = decode_frame(encode_batch(events, "capnp"), "capnp")
+    self.assertEqual([(m.which(), m.logMonoTime, m.carState.vEgo) for m in msgs], [("carState", i, i) for i in range(3)])
+
+
+if __name__ == "__main__":
+  unittest.main()